@@ -0,0 +1,247 @@
+'''
+Measures the overhead laboratory adds on top of the functions under test.
+
+Each benchmark is timed over ``--number`` calls, repeated ``--repeat`` times,
+and the fastest repeat is reported in nanoseconds per call. The peak memory
+allocated by a single call is measured separately with tracemalloc, and the
+memory blocks each call retains (including cyclic garbage waiting for the
+collector) with :func:`sys.getallocatedblocks`. Blocks allocated and freed
+within a call aren't counted, so this catches leaks and garbage rather than
+allocation churn.
+
+Usage::
+
+    $ python benchmarks/bench_conduct.py
+    $ python benchmarks/bench_conduct.py --save baseline.json
+    $ python benchmarks/bench_conduct.py --compare baseline.json --threshold 0.2
+
+With ``--compare`` the script exits with a non-zero status if any benchmark is
+more than ``--threshold`` (a fraction) slower than the saved baseline, or
+retains that many more memory blocks per call.
+'''
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from laboratory import Experiment  # noqa: E402
+from laboratory.experiment import _observe  # noqa: E402
+from laboratory.observation import Observation  # noqa: E402
+from laboratory.profiling import Profiler  # noqa: E402
+from laboratory.result import Result  # noqa: E402
+
+
+def noop(*args, **kwargs):
+    return None
+
+
+LARGE_CONTEXT = dict(
+    ('key%s' % i, {'nested': list(range(10)), 'value': 'x' * 20}) for i in range(100)
+)
+
+
+class DisabledExperiment(Experiment):
+    def enabled(self):
+        return False
+
+
+def conduct(candidates=1, randomize=True, context=None, cls=Experiment, read_context=False,
+            **kwargs):
+    if read_context:
+        def publish(self, result):
+            result.control.get_context()
+        cls = type('ReadContextExperiment', (cls,), {'publish': publish})
+
+    def bench():
+        experiment = cls(context=context, **kwargs)
+        experiment.control(noop, args=(1,))
+        for _ in range(candidates):
+            experiment.candidate(noop, args=(1,))
+        experiment.conduct(randomize=randomize)
+    return bench
+
+
+def decorated(cls=Experiment):
+    return cls.decorator(noop)(noop)
+
+
+def run_tested_func():
+    experiment = Experiment()
+    kwargs = {'func': noop, 'args': (), 'kwargs': {}, 'name': 'Control', 'context': {}}
+    return lambda: experiment._run_tested_func(raise_on_exception=True, **kwargs)
+
+
+def observe():
+    return lambda: _observe(noop, (), {}, 'Control', {}, {})
+
+
+def observation():
+    def bench():
+        obs = Observation('Control')
+        obs.set_start_time()
+        obs.record(None)
+        obs.set_end_time()
+    return bench
+
+
+def result():
+    experiment = Experiment()
+    control = _observe(noop, (), {}, 'Control', {}, {})
+    candidate = _observe(noop, (), {}, 'Candidate', {}, {})
+    return lambda: Result(experiment, control, [candidate]).match
+
+
+BENCHMARKS = [
+    ('direct call', lambda: noop),
+    ('conduct, 1 candidate', lambda: conduct(1)),
+    ('conduct, 5 candidates', lambda: conduct(5)),
+    ('conduct, 20 candidates', lambda: conduct(20)),
+    ('conduct, 1 candidate, randomize=False', lambda: conduct(1, randomize=False)),
+    ('conduct, 20 candidates, randomize=False', lambda: conduct(20, randomize=False)),
+    ('conduct, large context', lambda: conduct(1, context=LARGE_CONTEXT)),
+    ('conduct, large context read in publish',
+     lambda: conduct(1, context=LARGE_CONTEXT, read_context=True)),
+    ('conduct, profiler', lambda: conduct(1, profiler=Profiler())),
+    ('conduct, disabled', lambda: conduct(1, cls=DisabledExperiment)),
+    ('decorator', lambda: decorated()),
+    ('decorator, disabled', lambda: decorated(DisabledExperiment)),
+    ('_run_tested_func', run_tested_func),
+    ('_observe', observe),
+    ('Observation', observation),
+    ('Result', result),
+]
+
+
+def time_per_call(func, number, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter_ns() - start) / float(number)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_bytes_per_call(func):
+    func()  # warm up any caches
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def retained_blocks_per_call(func, number):
+    # the collector is paused so garbage kept alive by reference cycles counts
+    func()
+    gc.collect()
+    gc.disable()
+    try:
+        before = sys.getallocatedblocks()
+        for _ in range(number):
+            func()
+        return (sys.getallocatedblocks() - before) / float(number)
+    finally:
+        gc.enable()
+        gc.collect()
+
+
+def run(number, repeat, pattern=None):
+    results = {}
+    for name, factory in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        func = factory()
+        results[name] = {
+            'ns_per_call': time_per_call(func, number, repeat),
+            'peak_bytes_per_call': peak_bytes_per_call(func),
+            'retained_blocks_per_call': retained_blocks_per_call(func, min(number, 1000)),
+        }
+    return results
+
+
+def report(results, baseline=None, threshold=None):
+    regressions = []
+    width = max(len(name) for name in results)
+    header = '%-*s %12s %14s %14s' % (
+        width, 'benchmark', 'ns/call', 'peak B/call', 'retained/call',
+    )
+    if baseline:
+        header += ' %10s %10s' % ('change', 'retained')
+    print(header)
+    print('-' * len(header))
+
+    for name, data in results.items():
+        line = '%-*s %12.0f %14d %14.2f' % (
+            width, name, data['ns_per_call'], data['peak_bytes_per_call'],
+            data['retained_blocks_per_call'],
+        )
+        if baseline and name in baseline:
+            change = data['ns_per_call'] / baseline[name]['ns_per_call'] - 1
+            retained = data['retained_blocks_per_call'] - baseline[name].get(
+                'retained_blocks_per_call', 0,
+            )
+            line += ' %+9.1f%% %+10.2f' % (change * 100, retained)
+            if threshold is not None and (
+                    change > threshold or
+                    _retains_more(data, baseline[name], threshold)):
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=10000, help='calls per repeat')
+    parser.add_argument('--repeat', type=int, default=5, help='number of repeats')
+    parser.add_argument('--filter', help='only run benchmarks containing this text')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare results with this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction slower than the baseline, or fraction more '
+                             'blocks retained, counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.number, args.repeat, args.filter)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    regressions = report(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print('\n%s benchmark(s) regressed by more than %.0f%%' % (
+            len(regressions), args.threshold * 100,
+        ))
+        return 1
+    return 0
+
+
+def _retains_more(data, baseline, threshold):
+    # at least a whole block more per call, so small noise isn't a regression
+    if 'retained_blocks_per_call' not in baseline:
+        return False
+    old, new = baseline['retained_blocks_per_call'], data['retained_blocks_per_call']
+    return new - old >= 1 and new > old * (1 + threshold)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
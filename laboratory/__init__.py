@@ -1,6 +1,12 @@
+import sys
+
 from .exceptions import LaboratoryException, MismatchException
 from .experiment import Experiment
 
 __version__ = '1.0.2'
 
 __all__ = ('Experiment', 'LaboratoryException', 'MismatchException')
+
+if sys.version_info >= (3, 5):
+    from .aio import AsyncExperiment
+    __all__ += ('AsyncExperiment',)
@@ -0,0 +1,518 @@
+import errno
+import logging
+import mmap
+import os
+import threading
+
+from laboratory.comparators import _timed_out
+from laboratory.stats import Counter, Histogram
+
+
+logger = logging.getLogger(__name__)
+
+
+class ObservationStats(object):
+    '''
+    Running statistics for one named observation of an experiment.
+
+    :ivar int count: number of observations
+    :ivar int exceptions: number of observations which raised an exception
+    :ivar int mismatches: number of observations which did not match the control.
+     Always zero for the control.
+    :ivar int unknown: number of observations whose comparison with the control
+     timed out. They're left out of the mismatch rate.
+    :ivar Histogram latency: durations in nanoseconds
+    '''
+
+    __slots__ = ('count', 'exceptions', 'mismatches', 'unknown', 'latency')
+
+    def __init__(self, precision=4):
+        self.count = 0
+        self.exceptions = 0
+        self.mismatches = 0
+        self.unknown = 0
+        self.latency = Histogram(precision)
+
+    def merge(self, other):
+        self.count += other.count
+        self.exceptions += other.exceptions
+        self.mismatches += other.mismatches
+        self.unknown += other.unknown
+        self.latency.merge(other.latency)
+
+    def to_dict(self):
+        '''
+        :return dict: counts, rates and latency percentiles in nanoseconds
+        '''
+        return {
+            'count': self.count,
+            'exceptions': self.exceptions,
+            'exception_rate': _rate(self.exceptions, self.count),
+            'mismatches': self.mismatches,
+            'mismatch_rate': _rate(self.mismatches, self.count - self.unknown),
+            'unknown': self.unknown,
+            'mean': self.latency.mean,
+            'p50': self.latency.percentile(50),
+            'p95': self.latency.percentile(95),
+            'p99': self.latency.percentile(99),
+            'max': self.latency.max,
+        }
+
+
+class ExperimentStats(object):
+    '''
+    Running statistics for an experiment.
+
+    :ivar int runs: number of results recorded
+    :ivar int mismatches: number of results where a candidate did not match
+    :ivar int unknown: number of results where no candidate was found not to
+     match, but a comparison timed out. They're left out of the match rate.
+    :ivar ObservationStats control: statistics for the control
+    :ivar dict candidates: :class:`ObservationStats` keyed by candidate name
+    '''
+
+    __slots__ = ('runs', 'mismatches', 'unknown', 'control', 'candidates', '_precision')
+
+    def __init__(self, precision=4):
+        self._precision = precision
+        self.runs = 0
+        self.mismatches = 0
+        self.unknown = 0
+        self.control = ObservationStats(precision)
+        self.candidates = {}
+
+    def record(self, result, matches=None):
+        '''
+        :param Result result: result to count
+        :param list matches: whether each candidate matched, if already compared
+        '''
+        if matches is None:
+            matches = [result._compare(index) for index in range(len(result.candidates))]
+
+        self.runs += 1
+        _record_observation(self.control, result.control)
+
+        matched, unknown = True, False
+        for candidate, match in zip(result.candidates, matches):
+            stats = self.candidates.get(candidate.name)
+            if stats is None:
+                stats = self.candidates[candidate.name] = ObservationStats(self._precision)
+            _record_observation(stats, candidate, timed=not result.cached)
+            if _timed_out(match):
+                stats.unknown += 1
+                unknown = True
+            elif not match:
+                stats.mismatches += 1
+                matched = False
+
+        if not matched:
+            self.mismatches += 1
+        elif unknown:
+            self.unknown += 1
+
+    def merge(self, other):
+        self.runs += other.runs
+        self.mismatches += other.mismatches
+        self.unknown += other.unknown
+        self.control.merge(other.control)
+        for name, stats in other.candidates.items():
+            if name not in self.candidates:
+                self.candidates[name] = ObservationStats(self._precision)
+            self.candidates[name].merge(stats)
+
+    @property
+    def match_rate(self):
+        known = self.runs - self.unknown
+        return _rate(known - self.mismatches, known)
+
+    def to_dict(self):
+        return {
+            'runs': self.runs,
+            'mismatches': self.mismatches,
+            'unknown': self.unknown,
+            'match_rate': self.match_rate,
+            'control': self.control.to_dict(),
+            'candidates': dict(
+                (name, stats.to_dict()) for name, stats in self.candidates.items()
+            ),
+        }
+
+
+class Aggregator(object):
+    '''
+    Aggregates experiment results in-process, keeping running counts and latency
+    histograms per experiment and observation name instead of every result.
+    Memory use depends on the number of experiments and observation names, not
+    on the number of results.
+
+    Results are recorded when passed to an experiment with ``aggregator=``, or
+    by calling :meth:`record`. Comparisons are made when results are recorded.
+    '''
+
+    def __init__(self, precision=4):
+        '''
+        :param int precision: latency histogram precision, see :class:`Histogram`
+        '''
+        self.precision = precision
+        self._experiments = {}
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        '''
+        :param Result result: result to add to the running statistics
+        '''
+        # comparisons can be slow, so they're made before taking the lock
+        matches = [result._compare(index) for index in range(len(result.candidates))]
+        name = result.experiment.name
+        with self._lock:
+            stats = self._experiments.get(name)
+            if stats is None:
+                stats = self._experiments[name] = ExperimentStats(self.precision)
+            stats.record(result, matches)
+
+    def snapshot(self, reset=False):
+        '''
+        Return a copy of the current statistics.
+
+        :param bool reset: start counting from zero again afterwards
+        :return dict: :class:`ExperimentStats` keyed by experiment name
+        '''
+        with self._lock:
+            if reset:
+                experiments, self._experiments = self._experiments, {}
+                return experiments
+
+            snapshot = {}
+            for name, stats in self._experiments.items():
+                snapshot[name] = ExperimentStats(self.precision)
+                snapshot[name].merge(stats)
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._experiments = {}
+
+
+class SharedAggregator(object):
+    '''
+    Aggregates experiment results from many processes on the same host, such as
+    the workers of a pre-forking server, in a memory-mapped file. Each process
+    claims a slot of the file the first time it records a result, and only
+    writes to its own slot, so processes never wait for each other. A reader,
+    such as a single exporter process, merges every slot with :meth:`snapshot`.
+
+    Counts only go up: slots left by workers that have exited are kept, and
+    claimed by the next new process. Report the difference between snapshots
+    to get rates. Slots are claimed by process id, so processes must share a
+    process id namespace. Requires :mod:`fcntl`, so isn't available on Windows.
+
+    A snapshot taken while results are being recorded may include part of a
+    result, so counts can be off by one while processes are busy.
+
+    :ivar Counter dropped: results that weren't recorded because every slot
+     was claimed when the process first recorded a result, or its slot had no
+     room for another experiment or observation name
+    '''
+
+    def __init__(self, path, slots=64, series=32, precision=4):
+        '''
+        The layout of the file is fixed when it's created, by the first process
+        to open it; later processes use the file's layout.
+
+        :param string path: file to aggregate in, created if it doesn't exist
+        :param int slots: number of processes that can record results
+        :param int series: number of experiment and observation names each
+            process can record. Each experiment uses one for itself, one for
+            its control and one for each candidate name
+        :param int precision: latency histogram precision, see :class:`Histogram`
+        '''
+        self.path = path
+        self.dropped = Counter()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._slot = None
+        self._series = {}
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._map, layout = _open_shared(self._fd, slots, series, precision)
+        except Exception:
+            os.close(self._fd)
+            raise
+        self.slots, self.series_per_slot, self.precision, self._max_bits = layout
+        self._cells = memoryview(self._map).cast('q')
+        self._buckets = (self._max_bits - self.precision + 1) << self.precision
+        self._series_words = _KEY_WORDS + _FIELDS + self._buckets
+        self._slot_words = _SLOT_HEADER_WORDS + self.series_per_slot * self._series_words
+        self._histogram = Histogram(self.precision, self._max_bits)
+
+    def record(self, result):
+        '''
+        :param Result result: result to add to this process' slot
+        '''
+        # comparisons can be slow, so they're made before taking the lock
+        matches = [result._compare(index) for index in range(len(result.candidates))]
+        name = result.experiment.name
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._claim()
+            if self._slot is None:
+                self.dropped.increment()
+                return
+
+            offsets = [self._offset(name, _EXPERIMENT, ''), self._offset(name, _CONTROL, '')]
+            offsets.extend(
+                self._offset(name, _CANDIDATE, candidate.name)
+                for candidate in result.candidates
+            )
+            if None in offsets:
+                self.dropped.increment()
+                return
+
+            cells = self._cells
+            experiment, control = offsets[0], offsets[1]
+            cells[experiment + _COUNT] += 1
+            if not all(matches):
+                cells[experiment + _MISMATCHES] += 1
+            elif any(_timed_out(match) for match in matches):
+                cells[experiment + _UNKNOWN] += 1
+
+            self._record_observation(control, result.control)
+            for offset, candidate, match in zip(offsets[2:], result.candidates, matches):
+                self._record_observation(offset, candidate, timed=not result.cached)
+                if _timed_out(match):
+                    cells[offset + _UNKNOWN] += 1
+                elif not match:
+                    cells[offset + _MISMATCHES] += 1
+
+    def snapshot(self):
+        '''
+        Merge the statistics of every slot.
+
+        :return dict: :class:`ExperimentStats` keyed by experiment name
+        '''
+        experiments = {}
+        for slot in range(self.slots):
+            start = _HEADER_WORDS + slot * self._slot_words
+            used = min(self._cells[start + 1], self.series_per_slot)
+            for index in range(used):
+                offset = start + _SLOT_HEADER_WORDS + index * self._series_words
+                key = self._read_key(offset)
+                if key is None:
+                    continue
+                name, kind, observation = key
+                stats = experiments.get(name)
+                if stats is None:
+                    stats = experiments[name] = ExperimentStats(self.precision)
+                self._merge_series(stats, kind, observation, offset + _KEY_WORDS)
+        return experiments
+
+    def workers(self):
+        '''
+        :return list: ids of the processes that have claimed slots, including
+            any that have since exited
+        '''
+        return [
+            pid for pid in (
+                self._cells[_HEADER_WORDS + slot * self._slot_words]
+                for slot in range(self.slots)
+            )
+            if pid
+        ]
+
+    def close(self):
+        '''
+        Unmap the file, releasing this process' slot for another to claim.
+        '''
+        with self._lock:
+            if self._slot is not None and self._pid == os.getpid():
+                self._cells[self._slot] = 0
+            self._cells.release()
+            self._map.close()
+            os.close(self._fd)
+            self._slot = None
+
+    def _claim(self):
+        # slots are claimed under a lock on the file's header, which is only
+        # held while choosing one. A slot whose process has exited is reused,
+        # and its counts carried on from
+        import fcntl
+
+        self._pid = os.getpid()
+        self._slot = None
+        self._series = {}
+
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER_WORDS * 8, 0)
+        try:
+            for slot in range(self.slots):
+                start = _HEADER_WORDS + slot * self._slot_words
+                pid = self._cells[start]
+                if not _alive(pid):
+                    self._cells[start] = self._pid
+                    self._slot = start
+                    break
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER_WORDS * 8, 0)
+
+        if self._slot is None:
+            logger.warning('Every slot of %s is claimed, results will be dropped' % self.path)
+            return
+
+        used = min(self._cells[self._slot + 1], self.series_per_slot)
+        for index in range(used):
+            offset = self._slot + _SLOT_HEADER_WORDS + index * self._series_words
+            key = self._read_key(offset)
+            if key is not None:
+                self._series[key] = offset + _KEY_WORDS
+
+    def _offset(self, name, kind, observation):
+        key = (name, kind, observation)
+        offset = self._series.get(key)
+        if offset is not None:
+            return offset
+
+        used = self._cells[self._slot + 1]
+        encoded = _KEY_SEPARATOR.join(key).encode('utf-8')
+        if used >= self.series_per_slot or len(encoded) > _KEY_WORDS * 8 or b'\0' in encoded:
+            return None
+
+        # the key is written before the slot's count of series is increased,
+        # so readers only see complete keys
+        offset = self._slot + _SLOT_HEADER_WORDS + used * self._series_words
+        start = offset * 8
+        self._map[start:start + _KEY_WORDS * 8] = encoded.ljust(_KEY_WORDS * 8, b'\0')
+        fields = offset + _KEY_WORDS
+        self._cells[fields + _MIN] = -1
+        self._cells[self._slot + 1] = used + 1
+        self._series[key] = fields
+        return fields
+
+    def _record_observation(self, offset, observation, timed=True):
+        cells = self._cells
+        cells[offset + _COUNT] += 1
+        if observation.failure:
+            cells[offset + _EXCEPTIONS] += 1
+        if observation.end_ns is None or not timed:
+            return
+
+        duration = max(0, observation.duration)
+        cells[offset + _LATENCY_COUNT] += 1
+        cells[offset + _TOTAL] += duration
+        if cells[offset + _MIN] < 0 or duration < cells[offset + _MIN]:
+            cells[offset + _MIN] = duration
+        if duration > cells[offset + _MAX]:
+            cells[offset + _MAX] = duration
+        cells[offset + _FIELDS + self._histogram.bucket(duration)] += 1
+
+    def _read_key(self, offset):
+        start = offset * 8
+        data = self._map[start:start + _KEY_WORDS * 8].rstrip(b'\0')
+        parts = data.decode('utf-8', 'replace').split(_KEY_SEPARATOR)
+        if len(parts) != 3:
+            return None
+        return tuple(parts)
+
+    def _merge_series(self, stats, kind, observation, offset):
+        cells = self._cells
+        if kind == _EXPERIMENT:
+            stats.runs += cells[offset + _COUNT]
+            stats.mismatches += cells[offset + _MISMATCHES]
+            stats.unknown += cells[offset + _UNKNOWN]
+            return
+
+        series = ObservationStats(self.precision)
+        series.count = cells[offset + _COUNT]
+        series.exceptions = cells[offset + _EXCEPTIONS]
+        series.mismatches = cells[offset + _MISMATCHES]
+        series.unknown = cells[offset + _UNKNOWN]
+
+        latency = series.latency = Histogram(self.precision, self._max_bits)
+        latency.count = cells[offset + _LATENCY_COUNT]
+        latency.total = cells[offset + _TOTAL]
+        if latency.count and cells[offset + _MIN] >= 0:
+            latency.min = cells[offset + _MIN]
+            latency.max = cells[offset + _MAX]
+        latency.counts = cells[offset + _FIELDS:offset + _FIELDS + self._buckets].tolist()
+
+        if kind == _CONTROL:
+            stats.control.merge(series)
+        else:
+            if observation not in stats.candidates:
+                stats.candidates[observation] = ObservationStats(self.precision)
+            stats.candidates[observation].merge(series)
+
+
+def _record_observation(stats, observation, timed=True):
+    # candidates reused from a cache are counted, but their durations were
+    # already recorded when they ran
+    stats.count += 1
+    if observation.failure:
+        stats.exceptions += 1
+    if observation.end_ns is not None and timed:
+        stats.latency.record(observation.duration)
+
+
+def _rate(count, total):
+    return count / float(total) if total else None
+
+
+# layout of a shared aggregation file, in native 8-byte integers: a header,
+# then a slot per process. Each slot has a header of its process id and the
+# number of series it has used, then its series. A series is a key of
+# experiment name, kind and observation name, counts, and a latency histogram
+_MAGIC = 0x3130474741424c  # 'LBAGG01'
+_VERSION = 2
+_HEADER_WORDS = 8
+_SLOT_HEADER_WORDS = 4
+_KEY_WORDS = 32
+_KEY_SEPARATOR = '\x1f'
+
+# series fields, which follow the key
+_COUNT, _EXCEPTIONS, _MISMATCHES = 0, 1, 2
+_LATENCY_COUNT, _TOTAL, _MIN, _MAX = 3, 4, 5, 6
+_UNKNOWN = 7
+_FIELDS = 8
+
+_EXPERIMENT, _CONTROL, _CANDIDATE = 'experiment', 'control', 'candidate'
+
+
+def _open_shared(fd, slots, series, precision, max_bits=48):
+    # the first process to lock the header creates the file's layout
+    import fcntl
+
+    header_bytes = _HEADER_WORDS * 8
+    fcntl.lockf(fd, fcntl.LOCK_EX, header_bytes, 0)
+    try:
+        created = os.fstat(fd).st_size < header_bytes
+        if created:
+            buckets = (max_bits - precision + 1) << precision
+            slot_words = _SLOT_HEADER_WORDS + series * (_KEY_WORDS + _FIELDS + buckets)
+            os.ftruncate(fd, (_HEADER_WORDS + slots * slot_words) * 8)
+
+        shared = mmap.mmap(fd, 0)
+        header = memoryview(shared).cast('q')
+        if created:
+            for index, value in enumerate((_VERSION, slots, series, precision, max_bits), 1):
+                header[index] = value
+            header[0] = _MAGIC
+        valid = header[0] == _MAGIC and header[1] == _VERSION
+        layout = tuple(header[2:6].tolist())
+        header.release()
+    finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN, header_bytes, 0)
+
+    if not valid:
+        shared.close()
+        raise ValueError('Not a shared aggregation file')
+    return shared, layout
+
+
+def _alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        return ex.errno == errno.EPERM
+    return True
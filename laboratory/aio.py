@@ -0,0 +1,282 @@
+import asyncio
+from functools import wraps
+import inspect
+import logging
+import random
+
+from laboratory import exceptions
+from laboratory.experiment import Experiment
+from laboratory.observation import Observation, perf_counter_ns
+from laboratory.result import Result
+
+
+logger = logging.getLogger(__name__)
+
+# strong references to candidates running in the background, which asyncio
+# would otherwise be free to garbage collect before they complete
+_background_tasks = set()
+
+
+class AsyncExperiment(Experiment):
+    '''
+    Experiment for asyncio code. Control and candidate functions may be
+    coroutine functions or regular functions, and :meth:`conduct` must be
+    awaited. ``enabled()`` and ``publish()`` may also be coroutine functions.
+
+    :ivar bool background: Run candidates in the background rather than
+     waiting for them before returning the control's value
+    '''
+
+    def __init__(self, *args, background=False, **kwargs):
+        '''
+        Accepts the same arguments as :class:`Experiment`, except for ``executor``,
+        ``worker`` and ``cache``, as well as:
+
+        :param bool background: Return the control's value without waiting for
+            candidates. The result is published when they complete.
+        :raise ValueError: if given ``executor``, ``worker`` or ``cache``
+        '''
+        super(AsyncExperiment, self).__init__(*args, **kwargs)
+        for option in ('executor', 'worker', 'cache'):
+            if getattr(self, option) is not None:
+                raise ValueError('AsyncExperiment does not support %s' % option)
+        self.background = background
+
+    @classmethod
+    def decorator(cls, candidate, *exp_args, **exp_kwargs):
+        '''
+        Decorate a coroutine function in order to conduct an experiment when awaited.
+
+        :param callable candidate: your candidate function
+        :param iterable exp_args: positional arguments passed to :class:`AsyncExperiment`
+        :param dict exp_kwargs: keyword arguments passed to :class:`AsyncExperiment`
+
+        Usage::
+
+            async def candidate_func():
+                return True
+
+            @AsyncExperiment.decorator(candidate_func)
+            async def control_func():
+                return True
+
+        As with :meth:`Experiment.decorator`, the experiment is created once and
+        shared by every call. It's available as ``control_func.experiment``.
+        Subclasses which override :meth:`conduct` get a new experiment for each
+        call instead.
+        '''
+        def wrapper(control):
+            experiment = cls(*exp_args, **exp_kwargs)
+            experiment.control(control)
+            experiment.candidate(candidate)
+
+            if cls.conduct is not AsyncExperiment.conduct:
+                @wraps(control)
+                async def inner(*args, **kwargs):
+                    call_experiment = cls(*exp_args, **exp_kwargs)
+                    call_experiment.control(control, args=args, kwargs=kwargs)
+                    call_experiment.candidate(candidate, args=args, kwargs=kwargs)
+                    return await call_experiment.conduct()
+                inner.experiment = experiment
+                return inner
+
+            @wraps(control)
+            async def inner(*args, **kwargs):
+                return await experiment._conduct(True, args, kwargs)
+            inner.experiment = experiment
+            return inner
+        return wrapper
+
+    async def conduct(self, randomize=True):
+        '''
+        Run control & candidate functions concurrently and return the control's
+        return value. ``control()`` must be called first.
+
+        If the experiment was created with ``background=True`` the control's
+        value is returned as soon as the control completes, and the result is
+        published once the candidates complete.
+
+        Candidates still running after ``candidate_timeout`` seconds are cancelled
+        and recorded as failed with a :class:`~laboratory.exceptions.TimeoutException`.
+
+        :param bool randomize: controls whether we shuffle the order in which
+            candidates are started
+        :raise LaboratoryException: when no control case has been set
+        :return: Control function's return value
+        '''
+        if self._control is None:
+            raise exceptions.LaboratoryException(
+                'Your experiment must contain a control case'
+            )
+
+        return await self._conduct(randomize)
+
+    async def _conduct(self, randomize=True, args=None, kwargs=None):
+        # ``args`` and ``kwargs``, when given, are passed to every function
+        # in place of the arguments they were set up with
+        registration = self._registration
+        registration.calls.increment()
+        if not await self._is_enabled():
+            return await _resolve(self._call_control(args, kwargs))
+        if not self._sample():
+            return await self._call_unsampled(args, kwargs)
+        registration.sampled.increment()
+
+        control_def = self._control
+        candidates = list(self._candidates)
+        if args is not None:
+            control_def = dict(control_def, args=args, kwargs=kwargs)
+            candidates = [dict(cand, args=args, kwargs=kwargs) for cand in candidates]
+
+        context = self._snapshot_context()
+        if self.recorder is not None:
+            args, kwargs = control_def['args'], control_def['kwargs']
+            if self.isolation is not None:
+                control_def = self._bind([control_def], None, None, self.isolation)[0]
+            control = await self._run_tested_coro(
+                is_control=True, experiment_context=context, **control_def
+            )
+            if control.failure:
+                raise control.exception
+            value = control.value
+            self.recorder.record(self, args, kwargs, control)
+            return value
+
+        if self.circuit_breaker is not None and candidates:
+            candidates = self._allowed(candidates)
+            if not candidates:
+                return await _resolve(self._call_control(args, kwargs))
+
+        # every function is passed its own isolated arguments
+        if self.isolation is not None:
+            bound = self._bind([control_def] + candidates, None, None, self.isolation)
+            control_def, candidates = bound[0], bound[1:]
+
+        if randomize:
+            random.shuffle(candidates)
+
+        # candidates are started first so they run alongside the control
+        pending = asyncio.gather(*[
+            self._run_tested_coro(is_control=False, experiment_context=context, **cand)
+            for cand in candidates
+        ])
+
+        control = await self._run_tested_coro(
+            is_control=True, experiment_context=context, **control_def
+        )
+        if control.failure:
+            pending.cancel()
+            raise control.exception
+
+        # the value is taken before concluding, which may replace it
+        value = control.value
+        if not self.background:
+            await self._conclude(control, await pending)
+            return value
+
+        if self.capture is not None:
+            self._capture([control])
+        task = asyncio.ensure_future(self._conclude_when_complete(control, pending))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return value
+
+    async def _call_unsampled(self, args, kwargs):
+        sampler = self.sampler
+        if sampler is None or not sampler.times_unsampled:
+            return await _resolve(self._call_control(args, kwargs))
+
+        start = perf_counter_ns()
+        value = await _resolve(self._call_control(args, kwargs))
+        sampler.record_unsampled(perf_counter_ns() - start)
+        return value
+
+    async def _is_enabled(self):
+        if self._registration.enabled is not None:
+            return self._registration.enabled
+        if self.enabled_ttl is None:
+            return await _resolve(self.enabled())
+
+        now = perf_counter_ns()
+        if now >= self._enabled_expires:
+            self._enabled = bool(await _resolve(self.enabled()))
+            self._enabled_expires = now + int(self.enabled_ttl * 1e9)
+        return self._enabled
+
+    async def _conclude_when_complete(self, control, pending):
+        try:
+            await self._conclude(control, await pending, background=True)
+        except Exception:
+            msg = 'Exception occured when concluding %s experiment'
+            logger.exception(msg % self.name)
+
+    async def _conclude(self, control, candidates, background=False):
+        # in the background the control was captured when its value was returned
+        if self.capture is not None:
+            self._capture(candidates if background else [control] + candidates)
+        if background:
+            result = Result(self, control, candidates, raise_on_mismatch=False)
+            if self.raise_on_mismatch:
+                self._log_mismatches(result)
+        else:
+            result = Result(self, control, candidates)
+        self._record(result)
+
+        try:
+            await _resolve(self.publish(result))
+        except Exception:
+            msg = 'Exception occured when publishing %s experiment data'
+            logger.exception(msg % self.name)
+
+    async def _run_tested_coro(self, func, args, kwargs, name, context, is_control,
+                               experiment_context=None):
+        if experiment_context is None:
+            experiment_context = self._snapshot_context()
+        timeout = None if is_control else self.candidate_timeout
+        return await _observe(
+            func, args, kwargs, name, context, experiment_context, timeout,
+            self.cpu_time, self.profiler,
+        )
+
+
+async def _observe(func, args, kwargs, name, context, experiment_context, timeout=None,
+                   cpu_time=False, profiler=None):
+    obs = Observation(name, context, experiment_context)
+    profile = profiler.start() if profiler is not None else None
+    obs.set_start_time(cpu_time)
+
+    try:
+        value = func(*args, **kwargs)
+        if inspect.isawaitable(value):
+            if timeout is None:
+                value = await value
+            else:
+                value = await _wait_for(value, timeout, name)
+        obs.record(value)
+    except Exception as ex:
+        obs.set_exception(ex)
+    finally:
+        obs.set_end_time()
+        if profile is not None:
+            obs.profile = profiler.stop(profile)
+
+    return obs
+
+
+async def _wait_for(awaitable, timeout, name):
+    # asyncio.wait_for would conflate our timeout with a TimeoutError
+    # raised by the candidate itself
+    task = asyncio.ensure_future(awaitable)
+    done, _ = await asyncio.wait([task], timeout=timeout)
+    if not done:
+        task.cancel()
+        raise exceptions.TimeoutException(
+            '%s did not complete within %ss' % (name, timeout)
+        )
+    return task.result()
+
+
+async def _resolve(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
@@ -0,0 +1,289 @@
+import math
+import threading
+
+from laboratory.stats import Histogram
+
+
+FASTER = 'faster'
+SLOWER = 'slower'
+INCONCLUSIVE = 'inconclusive'
+
+
+class RunningStats(object):
+    '''
+    Count, mean and variance of a stream of numbers, updated one at a time in
+    constant memory with Welford's algorithm.
+    '''
+
+    __slots__ = ('count', 'mean', '_m2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        '''
+        Sample variance, or None with fewer than two values
+        '''
+        return self._m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def stddev(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+
+class Verdict(object):
+    '''
+    Whether a candidate is faster or slower than the control.
+
+    :ivar string verdict: ``faster``, ``slower`` or ``inconclusive``
+    :ivar bool stop: the verdict is decided and the experiment can be stopped
+    :ivar int samples: number of paired runs analysed
+    :ivar float difference: mean of candidate duration minus control duration,
+     in nanoseconds
+    :ivar tuple interval: confidence interval ``(low, high)`` on ``difference``
+    :ivar dict ratios: ``(ratio, low, high)`` of the candidate's percentile to
+     the control's, with its confidence interval, keyed by percentile
+    '''
+
+    __slots__ = ('verdict', 'stop', 'samples', 'difference', 'interval', 'ratios')
+
+    def __init__(self, verdict, stop, samples, difference, interval, ratios):
+        self.verdict = verdict
+        self.stop = stop
+        self.samples = samples
+        self.difference = difference
+        self.interval = interval
+        self.ratios = ratios
+
+    def to_dict(self):
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__)
+
+    def __repr__(self):
+        return 'Verdict(%r, stop=%r, samples=%r, difference=%r, interval=%r)' % (
+            self.verdict, self.stop, self.samples, self.difference, self.interval,
+        )
+
+
+class CandidateAnalysis(object):
+    '''
+    Compares the durations of one candidate with the control's, run by run.
+    Uses constant memory: a running mean and variance of the paired
+    differences, and a latency :class:`~laboratory.stats.Histogram` each for
+    the control and candidate.
+    '''
+
+    def __init__(self, confidence=0.95, precision=4):
+        '''
+        :param float confidence: confidence level of intervals, e.g. 0.95
+        :param int precision: histogram precision, see :class:`~laboratory.stats.Histogram`
+        '''
+        self.confidence = confidence
+        self.differences = RunningStats()
+        self.control = Histogram(precision)
+        self.candidate = Histogram(precision)
+        self._z = _z(confidence)
+
+    def record(self, control_ns, candidate_ns):
+        self.differences.add(candidate_ns - control_ns)
+        self.control.record(control_ns)
+        self.candidate.record(candidate_ns)
+
+    def merge(self, other):
+        self.differences.merge(other.differences)
+        self.control.merge(other.control)
+        self.candidate.merge(other.candidate)
+
+    def interval(self, sequential=True, prior_samples=100):
+        '''
+        Confidence interval on the mean difference in duration.
+
+        With ``sequential`` the interval is a confidence sequence: it holds
+        however many times it's checked while results come in, so it's safe to
+        stop the experiment as soon as it excludes zero. It's wider than a
+        fixed-sample interval, which is only valid if checked once, at a sample
+        size chosen in advance.
+
+        :param bool sequential: return an interval that's valid under continuous
+            monitoring
+        :param int prior_samples: number of samples at which the sequential
+            interval is tightest relative to the fixed-sample interval
+        :return tuple: ``(low, high)`` in nanoseconds, or None with fewer than two runs
+        '''
+        stats = self.differences
+        if stats.stddev is None:
+            return None
+
+        n = stats.count
+        if sequential:
+            # Robbins' normal mixture boundary, with the variance estimated
+            alpha = 1 - self.confidence
+            radius = stats.stddev * math.sqrt(
+                2.0 * (n + prior_samples) *
+                (math.log(2.0 / alpha) + 0.5 * math.log((n + prior_samples) / float(prior_samples)))
+            ) / n
+        else:
+            radius = self._z * stats.stddev / math.sqrt(n)
+        return stats.mean - radius, stats.mean + radius
+
+    def ratio(self, percentile):
+        '''
+        Ratio of the candidate's percentile duration to the control's, with a
+        conservative confidence interval from the order statistics around each.
+
+        :param float percentile: from 0 to 100
+        :return tuple: ``(ratio, low, high)``, or None if there are no runs
+        '''
+        bounds = []
+        for histogram in (self.candidate, self.control):
+            if not histogram.count:
+                return None
+            n, p = histogram.count, percentile / 100.0
+            half = self._z * math.sqrt(n * p * (1 - p))
+            bounds.append((
+                histogram.percentile(percentile),
+                histogram.value_at(int(math.floor(n * p - half))),
+                histogram.value_at(int(math.ceil(n * p + half))),
+            ))
+
+        (candidate, candidate_low, candidate_high), (control, control_low, control_high) = bounds
+        return (
+            _divide(candidate, control),
+            _divide(candidate_low, control_high),
+            _divide(candidate_high, control_low),
+        )
+
+    def verdict(self, min_samples=100, min_effect=0.0, sequential=True,
+                percentiles=(50, 95, 99)):
+        '''
+        :param int min_samples: runs needed before the verdict can be decided
+        :param float min_effect: smallest difference worth detecting, as a
+            fraction of the control's mean duration
+        :param bool sequential: see :meth:`interval`
+        :param percentiles: percentiles to report ratios for
+        :rtype: Verdict
+        '''
+        samples = self.differences.count
+        interval = self.interval(sequential, min_samples)
+        ratios = dict((p, self.ratio(p)) for p in percentiles)
+
+        verdict = INCONCLUSIVE
+        if interval is not None:
+            threshold = min_effect * (self.control.mean or 0)
+            if interval[1] < -threshold:
+                verdict = FASTER
+            elif interval[0] > threshold:
+                verdict = SLOWER
+
+        stop = verdict != INCONCLUSIVE and samples >= min_samples
+        difference = self.differences.mean if samples else None
+        return Verdict(verdict, stop, samples, difference, interval, ratios)
+
+
+class Analyzer(object):
+    '''
+    Decides whether candidates are faster or slower than the control as results
+    come in, per experiment and candidate name, in constant memory.
+
+    Results are recorded when passed to an experiment with ``analyzer=``, or by
+    calling :meth:`record`. Runs where the control or candidate raised are
+    ignored.
+    '''
+
+    def __init__(self, confidence=0.95, min_samples=100, min_effect=0.0,
+                 sequential=True, precision=4):
+        '''
+        :param float confidence: confidence level, e.g. 0.95
+        :param int min_samples: runs needed before a verdict can be decided
+        :param float min_effect: smallest difference worth detecting, as a
+            fraction of the control's mean duration
+        :param bool sequential: use intervals that are valid however often
+            verdicts are checked. See :meth:`CandidateAnalysis.interval`
+        :param int precision: histogram precision, see :class:`~laboratory.stats.Histogram`
+        '''
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.min_effect = min_effect
+        self.sequential = sequential
+        self.precision = precision
+        self._analyses = {}
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        '''
+        :param Result result: result to add to the analysis
+        '''
+        control = result.control
+        # cached candidates ran alongside an earlier control, so can't be paired
+        if control.failure or control.end_ns is None or result.cached:
+            return
+
+        name = result.experiment.name
+        with self._lock:
+            for candidate in result.candidates:
+                if candidate.failure or candidate.end_ns is None:
+                    continue
+                key = (name, candidate.name)
+                analysis = self._analyses.get(key)
+                if analysis is None:
+                    analysis = self._analyses[key] = CandidateAnalysis(self.confidence, self.precision)
+                analysis.record(control.duration, candidate.duration)
+
+    def verdicts(self, experiment):
+        '''
+        :param string experiment: experiment name
+        :return dict: :class:`Verdict` keyed by candidate name
+        '''
+        with self._lock:
+            analyses = [
+                (key[1], analysis) for key, analysis in self._analyses.items()
+                if key[0] == experiment
+            ]
+            return dict(
+                (name, analysis.verdict(self.min_samples, self.min_effect, self.sequential))
+                for name, analysis in analyses
+            )
+
+    def should_stop(self, experiment):
+        '''
+        Whether every candidate of an experiment has a decided verdict.
+
+        :param string experiment: experiment name
+        :rtype: bool
+        '''
+        verdicts = self.verdicts(experiment)
+        return bool(verdicts) and all(verdict.stop for verdict in verdicts.values())
+
+    def reset(self):
+        with self._lock:
+            self._analyses = {}
+
+
+def _z(confidence):
+    try:
+        from statistics import NormalDist
+    except ImportError:  # python < 3.8
+        return {0.9: 1.6449, 0.95: 1.96, 0.99: 2.5758}[confidence]
+    return NormalDist().inv_cdf(0.5 + confidence / 2.0)
+
+
+def _divide(a, b):
+    return a / float(b) if b else None
@@ -0,0 +1,223 @@
+from collections import deque, namedtuple
+import threading
+
+from laboratory.comparators import _timed_out
+from laboratory.observation import perf_counter_ns
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class StateChange(namedtuple('StateChange', 'experiment candidate previous state reason')):
+    '''
+    A candidate's circuit changed state.
+
+    :ivar string experiment: experiment name
+    :ivar string candidate: candidate name
+    :ivar string previous: the state before, one of ``closed``, ``open`` or ``half-open``
+    :ivar string state: the new state
+    :ivar string reason: why the state changed, e.g. ``exception rate 0.52``
+    '''
+
+    __slots__ = ()
+
+
+class CircuitBreaker(object):
+    '''
+    Stops running candidates that are failing, disagreeing with the control or
+    too slow, so that a broken candidate doesn't keep costing its full latency
+    on every run.
+
+    The breaker keeps a sliding window of each candidate's last ``window`` runs,
+    per experiment and candidate name. Once it holds at least ``min_calls`` runs,
+    the candidate's circuit opens if any limit is exceeded and the candidate is
+    skipped for ``cooldown`` seconds. It's then half-open: one run is let
+    through as a probe. The circuit closes again if the probe is a clean run,
+    otherwise it opens for another cooldown.
+
+    Share a breaker between experiments with the same name, e.g. ones created
+    per call, by passing it to each with ``Experiment(circuit_breaker=...)``.
+    '''
+
+    def __init__(self, max_exception_rate=None, max_mismatch_rate=None, max_p99=None,
+                 window=100, min_calls=20, cooldown=30.0):
+        '''
+        :param float max_exception_rate: open if more than this fraction of runs raise
+        :param float max_mismatch_rate: open if more than this fraction of runs
+            don't match the control. Every result is compared when this is set.
+            Runs whose comparison timed out are left out of the rate
+        :param float max_p99: open if the 99th percentile duration is over this
+            many seconds
+        :param int window: number of recent runs to consider
+        :param int min_calls: runs needed before the circuit can open
+        :param float cooldown: seconds to skip a candidate for once its circuit opens
+        '''
+        self.max_exception_rate = max_exception_rate
+        self.max_mismatch_rate = max_mismatch_rate
+        self.max_p99 = max_p99
+        self.window = window
+        self.min_calls = min(min_calls, window)
+        self.cooldown = cooldown
+        self._max_p99_ns = int(max_p99 * 1e9) if max_p99 is not None else None
+        self._cooldown_ns = int(cooldown * 1e9)
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, experiment, name):
+        '''
+        Should the candidate run? Moves open circuits whose cooldown has
+        elapsed to half-open, letting a probe through.
+
+        :param Experiment experiment: the experiment about to run
+        :param string name: candidate name
+        :rtype: bool
+        '''
+        circuit = self._circuits.get((experiment.name, name))
+        if circuit is None or circuit.state == CLOSED:
+            return True
+
+        with self._lock:
+            now = perf_counter_ns()
+            if now < circuit.retry_at:
+                return False
+            if circuit.state == OPEN:
+                circuit.change(HALF_OPEN, 'cooldown elapsed')
+            # a probe that never reports back, e.g. one dropped by a full
+            # worker queue, is given up on after another cooldown
+            circuit.retry_at = now + self._cooldown_ns
+            return True
+
+    def record(self, result):
+        '''
+        Add each candidate's run to its window, opening or closing circuits.
+
+        :param Result result: result of a run
+        :return list: :class:`StateChange` for each circuit that changed state
+            since the last result was recorded for that candidate
+        '''
+        # comparisons can be slow, so they're made before taking the lock
+        comparisons = [
+            result._compare(index)
+            if self.max_mismatch_rate is not None and not candidate.failure else True
+            for index, candidate in enumerate(result.candidates)
+        ]
+
+        changes = []
+        experiment = result.experiment.name
+        with self._lock:
+            for candidate, comparison in zip(result.candidates, comparisons):
+                key = (experiment, candidate.name)
+                circuit = self._circuits.get(key)
+                if circuit is None:
+                    circuit = self._circuits[key] = _Circuit(experiment, candidate.name, self.window)
+                self._record(circuit, candidate, not comparison, _timed_out(comparison))
+                if circuit.changes:
+                    changes.extend(circuit.changes)
+                    circuit.changes = []
+        return changes
+
+    def state(self, experiment, name):
+        '''
+        :param string experiment: experiment name
+        :param string name: candidate name
+        :return string: ``closed``, ``open`` or ``half-open``
+        '''
+        circuit = self._circuits.get((experiment, name))
+        return circuit.state if circuit is not None else CLOSED
+
+    def reset(self):
+        '''
+        Close every circuit and forget all runs.
+        '''
+        with self._lock:
+            self._circuits = {}
+
+    def _record(self, circuit, candidate, mismatched, unknown):
+        failed = candidate.failure
+        # p99 is over the limit exactly when more than 1% of runs are, so
+        # counting slow runs avoids keeping a sorted window of durations
+        slow = (
+            self._max_p99_ns is not None and candidate.end_ns is not None and
+            candidate.duration > self._max_p99_ns
+        )
+
+        if circuit.state == HALF_OPEN:
+            if failed or mismatched or slow:
+                self._open(circuit, 'probe failed')
+            else:
+                circuit.clear()
+                circuit.change(CLOSED, 'probe succeeded')
+            return
+
+        if circuit.state == OPEN:
+            # a run started before the circuit opened
+            return
+
+        circuit.add(failed, mismatched, unknown, slow)
+        if circuit.count < self.min_calls:
+            return
+
+        reason = self._exceeded(circuit)
+        if reason is not None:
+            self._open(circuit, reason)
+
+    def _exceeded(self, circuit):
+        count = float(circuit.count)
+        if self.max_exception_rate is not None and circuit.failures / count > self.max_exception_rate:
+            return 'exception rate %.2f' % (circuit.failures / count)
+        compared = count - circuit.unknown
+        if (self.max_mismatch_rate is not None and compared and
+                circuit.mismatches / compared > self.max_mismatch_rate):
+            return 'mismatch rate %.2f' % (circuit.mismatches / compared)
+        if self._max_p99_ns is not None and circuit.slow / count > 0.01:
+            return 'p99 over %ss' % self.max_p99
+        return None
+
+    def _open(self, circuit, reason):
+        circuit.clear()
+        circuit.retry_at = perf_counter_ns() + self._cooldown_ns
+        circuit.change(OPEN, reason)
+
+
+class _Circuit(object):
+    __slots__ = (
+        'experiment', 'name', 'state', 'retry_at', 'runs', 'count',
+        'failures', 'mismatches', 'unknown', 'slow', 'changes',
+    )
+
+    def __init__(self, experiment, name, window):
+        self.experiment = experiment
+        self.name = name
+        self.state = CLOSED
+        self.retry_at = 0
+        self.runs = deque(maxlen=window)
+        self.changes = []
+        self.clear()
+
+    def add(self, failed, mismatched, unknown, slow):
+        if len(self.runs) == self.runs.maxlen:
+            old_failed, old_mismatched, old_unknown, old_slow = self.runs[0]
+            self.failures -= old_failed
+            self.mismatches -= old_mismatched
+            self.unknown -= old_unknown
+            self.slow -= old_slow
+        self.runs.append((failed, mismatched, unknown, slow))
+        self.count = len(self.runs)
+        self.failures += failed
+        self.mismatches += mismatched
+        self.unknown += unknown
+        self.slow += slow
+
+    def clear(self):
+        self.runs.clear()
+        self.count = 0
+        self.failures = 0
+        self.mismatches = 0
+        self.unknown = 0
+        self.slow = 0
+
+    def change(self, state, reason):
+        self.changes.append(StateChange(self.experiment, self.name, self.state, state, reason))
+        self.state = state
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+import logging
+import threading
+
+from laboratory.observation import perf_counter_ns
+from laboratory.stats import Counter
+
+
+logger = logging.getLogger(__name__)
+
+class ResultCache(object):
+    '''
+    Remembers the candidate observations and comparison outcomes of recent
+    runs, keyed on their arguments, so that runs with arguments seen recently
+    don't run the candidates again. Only suitable for candidates that always
+    return the same value for the same arguments, such as pure read paths.
+
+    Pass a cache to an experiment with ``Experiment(cache=...)``. Share one
+    cache between experiments created per call; entries are kept per
+    experiment name.
+
+    :ivar Counter hits: runs that reused cached candidates
+    :ivar Counter misses: runs whose arguments weren't cached, or had expired
+    :ivar Counter evictions: entries discarded to stay within ``maxsize``
+    :ivar Counter uncacheable: runs whose arguments couldn't be made into a key
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None, key=None):
+        '''
+        :param int maxsize: number of entries to keep. The least recently used
+            entry is discarded to make room for a new one
+        :param float ttl: seconds an entry is used for, or None to use entries
+            until they're evicted
+        :param callable key: called with the positional and keyword arguments
+            of a run, returns a hashable key. Runs with equal keys share an
+            entry. By default the arguments themselves are the key, so they
+            must be hashable
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.key_func = key or _default_key
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = Counter()
+        self.uncacheable = Counter()
+        self._ttl_ns = int(ttl * 1e9) if ttl is not None else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, experiment, args, kwargs):
+        '''
+        :return: the cache key for a run, or None if the arguments can't be
+            made into one. The run then goes uncached
+        '''
+        try:
+            key = (experiment.name, self.key_func(args, kwargs))
+            hash(key)
+        except TypeError:
+            self.uncacheable.increment()
+            return None
+        except Exception:
+            # e.g. a broken key function or __hash__, which mustn't fail the run
+            self.uncacheable.increment()
+            msg = 'Exception occured when making a cache key for %s experiment'
+            logger.exception(msg % experiment.name)
+            return None
+        return key
+
+    def get(self, key, names):
+        '''
+        :param key: a key returned by :meth:`key`
+        :param names: names of the candidates about to run
+        :return dict: ``(observation, match)`` keyed by candidate name, or None
+            if the entry is missing, expired or for other candidates
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, candidates = entry
+                if expires is not None and perf_counter_ns() >= expires:
+                    del self._entries[key]
+                    entry = None
+                elif not all(name in candidates for name in names):
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+
+        if entry is None:
+            self.misses.increment()
+            return None
+        self.hits.increment()
+        return candidates
+
+    def put(self, key, result):
+        '''
+        Cache the candidates of a result. Compares them with the control if
+        they haven't been already.
+
+        :param key: a key returned by :meth:`key`
+        :param Result result: result of a run with that key
+        '''
+        candidates = dict(
+            (candidate.name, (candidate, result._compare(index)))
+            for index, candidate in enumerate(result.candidates)
+        )
+        expires = perf_counter_ns() + self._ttl_ns if self._ttl_ns is not None else None
+
+        with self._lock:
+            self._entries[key] = (expires, candidates)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions.increment()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _default_key(args, kwargs):
+    return tuple(args), tuple(sorted(kwargs.items())) if kwargs else ()
@@ -0,0 +1,162 @@
+import hashlib
+import pickle
+import weakref
+
+
+class Digest(object):
+    '''
+    Stands in for a value that was not kept. Digests are equal if the values
+    they were made from were equal, so experiments can still compare them.
+
+    :ivar string digest: hex digest of the value's serialised form
+    :ivar int size: size of the serialised form in bytes
+    :ivar string preview: the start of the value's ``repr()``, if kept
+    '''
+
+    __slots__ = ('digest', 'size', 'preview')
+
+    def __init__(self, digest, size, preview=None):
+        self.digest = digest
+        self.size = size
+        self.preview = preview
+
+    def __eq__(self, other):
+        if not isinstance(other, Digest):
+            return NotImplemented
+        return self.digest == other.digest
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        if self.preview is not None:
+            return 'Digest(%s, size=%d, preview=%r)' % (self.digest, self.size, self.preview)
+        return 'Digest(%s, size=%d)' % (self.digest, self.size)
+
+
+class Capture(object):
+    '''
+    Base class for capture policies. A capture policy decides what an
+    observation keeps of its function's return value once the control's value
+    has been returned, and before the result is compared and published.
+
+    Pass a policy to an experiment with ``Experiment(capture=...)``. Any
+    callable which takes a value and returns what to keep can be used instead.
+    '''
+
+    def __call__(self, value):
+        '''
+        :param value: a function's return value
+        :return: what the observation should keep in its place
+        '''
+        raise NotImplementedError
+
+
+class KeepValue(Capture):
+    '''
+    Keeps the value itself, as experiments do by default.
+    '''
+
+    def __call__(self, value):
+        return value
+
+
+class DigestCapture(Capture):
+    '''
+    Replaces values with a :class:`Digest` of their serialised form. The
+    serialised form is discarded straight away, so at most one copy of it is
+    alive at a time.
+
+    The default serialiser is :func:`pickle.dumps`, so equal dicts and sets that
+    were built in a different order may not match. Provide a ``serializer`` that
+    produces a canonical form if that matters. Values that can't be serialised
+    are digested by their ``repr()``.
+    '''
+
+    def __init__(self, algorithm='sha1', serializer=None, preview=0):
+        '''
+        :param string algorithm: a :mod:`hashlib` algorithm name
+        :param callable serializer: converts a value into bytes
+        :param int preview: keep this many characters of the value's ``repr()``
+        '''
+        self.algorithm = algorithm
+        self.serializer = serializer or _pickle
+        self.preview = preview
+
+    def __call__(self, value):
+        if isinstance(value, Digest):
+            return value
+        try:
+            data = self.serializer(value)
+        except Exception:
+            data = repr(value).encode('utf-8')
+        preview = _truncate(repr(value), self.preview) if self.preview else None
+        return Digest(hashlib.new(self.algorithm, data).hexdigest(), len(data), preview)
+
+
+class ReprCapture(Capture):
+    '''
+    Replaces values with a :class:`Digest` of their ``repr()``, keeping the
+    first ``max_length`` characters of it for publishing. Values match if
+    their full reprs are equal, not only the part that is kept.
+    '''
+
+    def __init__(self, max_length=200, algorithm='sha1'):
+        '''
+        :param int max_length: characters of the ``repr()`` to keep
+        :param string algorithm: a :mod:`hashlib` algorithm name
+        '''
+        self.max_length = max_length
+        self.algorithm = algorithm
+
+    def __call__(self, value):
+        if isinstance(value, Digest):
+            return value
+        text = repr(value)
+        data = text.encode('utf-8')
+        return Digest(
+            hashlib.new(self.algorithm, data).hexdigest(), len(data),
+            _truncate(text, self.max_length),
+        )
+
+
+class WeakRefCapture(Capture):
+    '''
+    Replaces values with a :func:`weakref.ref`, so the experiment doesn't keep
+    them alive after the caller has finished with them. Weak references compare
+    equal if the values they refer to are equal; once either value has been
+    garbage collected they no longer match, so this is best suited to values
+    the caller holds on to, e.g. cached objects.
+
+    Many built-in types such as ``dict``, ``list`` and ``int`` can't be weakly
+    referenced. Those values are passed to ``fallback``, or kept if there is none.
+    '''
+
+    def __init__(self, fallback=None):
+        '''
+        :param callable fallback: capture policy for values that can't be
+            weakly referenced, e.g. :class:`DigestCapture`
+        '''
+        self.fallback = fallback
+
+    def __call__(self, value):
+        try:
+            return weakref.ref(value)
+        except TypeError:
+            if self.fallback is None:
+                return value
+            return self.fallback(value)
+
+
+def _pickle(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _truncate(text, length):
+    if len(text) <= length:
+        return text
+    return text[:max(length - 3, 0)] + '...'
@@ -0,0 +1,388 @@
+import hashlib
+import math
+import pickle
+
+from laboratory.capture import Digest
+from laboratory.observation import perf_counter_ns
+
+
+class Comparison(object):
+    '''
+    The outcome of comparing a control value with a candidate value.
+    Truthy if the values match.
+
+    :ivar bool match: whether the values match
+    :ivar list differences: ``(path, control, candidate)`` tuples describing
+     where the values differ, for comparators that report them
+    :ivar bool timed_out: the comparator ran out of time, so whether the values
+     match is unknown. Comparisons that time out are truthy so that they don't
+     raise false alarms, but are left out of match and mismatch rates.
+    '''
+
+    __slots__ = ('match', 'differences', 'timed_out')
+
+    def __init__(self, match, differences=None, timed_out=False):
+        self.match = match
+        self.differences = differences or []
+        self.timed_out = timed_out
+
+    def __bool__(self):
+        return self.match
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return 'Comparison(match=%r, differences=%r, timed_out=%r)' % (
+            self.match, self.differences, self.timed_out,
+        )
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Budget(object):
+    '''
+    A time limit for a single comparison. Comparators call :meth:`tick` as
+    they work, which raises :class:`BudgetExceeded` once time is up. The clock
+    is only read every ``interval`` ticks, or on every call to :meth:`check`
+    for comparators that work in fewer, larger steps.
+    '''
+
+    __slots__ = ('deadline', 'interval', '_ticks')
+
+    def __init__(self, seconds, interval=256):
+        self.deadline = perf_counter_ns() + int(seconds * 1e9) if seconds is not None else None
+        self.interval = interval
+        self._ticks = 0
+
+    def tick(self):
+        if self.deadline is None:
+            return
+        self._ticks += 1
+        if self._ticks % self.interval == 0 and perf_counter_ns() > self.deadline:
+            raise BudgetExceeded()
+
+    def check(self):
+        if self.deadline is not None and perf_counter_ns() > self.deadline:
+            raise BudgetExceeded()
+
+
+class Comparator(object):
+    '''
+    Base class for comparators. Subclasses implement :meth:`compare`.
+
+    Pass a comparator to an experiment with ``Experiment(comparator=...)``.
+
+    The budget is only enforced between the steps a comparator takes, so it
+    can't interrupt a single ``==``. :class:`EqualityComparator`, like
+    experiments without a comparator, makes one comparison and isn't bounded;
+    :class:`DigestComparator` doesn't bound serialising the values.
+    '''
+
+    def __init__(self, budget=None):
+        '''
+        :param float budget: maximum seconds to spend on a single comparison
+        '''
+        self.budget = budget
+
+    def __call__(self, control, candidate):
+        '''
+        Compare a control value with a candidate value.
+
+        :rtype: Comparison
+        '''
+        try:
+            outcome = self.compare(control, candidate, Budget(self.budget))
+        except BudgetExceeded:
+            return Comparison(True, timed_out=True)
+        if isinstance(outcome, Comparison):
+            return outcome
+        return Comparison(bool(outcome))
+
+    def compare(self, control, candidate, budget):
+        '''
+        :param control: the control's value
+        :param candidate: the candidate's value
+        :param Budget budget: call ``budget.tick()`` regularly during long comparisons
+        :return: a bool or :class:`Comparison`
+        '''
+        raise NotImplementedError
+
+
+class EqualityComparator(Comparator):
+    '''
+    Compares values with ``==``, as experiments do by default. The comparison
+    is a single step, so the budget can't be enforced.
+    '''
+
+    def compare(self, control, candidate, budget):
+        return not (control != candidate)
+
+
+class DigestComparator(Comparator):
+    '''
+    Compares a digest of each value's serialised form. Useful for large values
+    that are cheaper to hash than to compare item by item.
+
+    The default serialiser is :func:`pickle.dumps`, so equal dicts and sets that
+    were built in a different order may not match. Provide a ``serializer`` that
+    produces a canonical form if that matters.
+
+    Values already replaced with a :class:`~laboratory.capture.Digest` by an
+    experiment's capture policy are compared by that digest, so use the same
+    ``algorithm`` and ``serializer`` for both.
+
+    The budget is checked between chunks of hashing, not while serialising.
+    '''
+
+    def __init__(self, algorithm='sha1', serializer=None, budget=None):
+        '''
+        :param string algorithm: a :mod:`hashlib` algorithm name
+        :param callable serializer: converts a value into bytes
+        '''
+        super(DigestComparator, self).__init__(budget)
+        self.algorithm = algorithm
+        self.serializer = serializer or _pickle
+
+    def digest(self, value, budget=None):
+        if isinstance(value, Digest):
+            return value.digest
+        data = self.serializer(value)
+        if budget is None or budget.deadline is None:
+            return hashlib.new(self.algorithm, data).hexdigest()
+
+        digest = hashlib.new(self.algorithm)
+        data = memoryview(data)
+        for start in range(0, len(data), _CHUNK_BYTES):
+            budget.check()
+            digest.update(data[start:start + _CHUNK_BYTES])
+        return digest.hexdigest()
+
+    def compare(self, control, candidate, budget):
+        return self.digest(control, budget) == self.digest(candidate, budget)
+
+
+class OrderedComparator(Comparator):
+    '''
+    Compares sequences item by item, stopping at the first difference, which is
+    reported. Anything that isn't a list or tuple is compared with ``==``.
+    '''
+
+    def compare(self, control, candidate, budget):
+        if not (isinstance(control, (list, tuple)) and isinstance(candidate, (list, tuple))):
+            return not (control != candidate)
+
+        if len(control) != len(candidate):
+            return Comparison(False, [('len()', len(control), len(candidate))])
+
+        for index, (a, b) in enumerate(zip(control, candidate)):
+            budget.tick()
+            if a != b:
+                return Comparison(False, [('[%r]' % index, a, b)])
+        return True
+
+
+class ToleranceComparator(Comparator):
+    '''
+    Compares numbers with a tolerance, recursing into dicts, lists and tuples.
+    Anything else is compared with ``==``.
+    '''
+
+    def __init__(self, rel_tol=1e-9, abs_tol=0.0, budget=None):
+        '''
+        :param float rel_tol: maximum difference relative to the larger value
+        :param float abs_tol: maximum absolute difference
+        '''
+        super(ToleranceComparator, self).__init__(budget)
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
+
+    def compare(self, control, candidate, budget):
+        return self._equal(control, candidate, budget)
+
+    def _equal(self, control, candidate, budget):
+        budget.tick()
+        if _is_number(control) and _is_number(candidate):
+            return _isclose(control, candidate, self.rel_tol, self.abs_tol)
+        if isinstance(control, dict) and isinstance(candidate, dict):
+            if control.keys() != candidate.keys():
+                return False
+            return all(self._equal(control[k], candidate[k], budget) for k in control)
+        if isinstance(control, (list, tuple)) and isinstance(candidate, (list, tuple)):
+            if len(control) != len(candidate):
+                return False
+            return all(self._equal(a, b, budget) for a, b in zip(control, candidate))
+        return not (control != candidate)
+
+
+class ArrayComparator(Comparator):
+    '''
+    Compares NumPy arrays with vectorised operations. Requires NumPy.
+    Arrays are compared exactly unless a tolerance is given. With a budget,
+    large arrays are compared a chunk at a time, checking the budget between
+    chunks.
+    '''
+
+    def __init__(self, rtol=None, atol=None, equal_nan=False, budget=None):
+        '''
+        :param float rtol: relative tolerance, see :func:`numpy.allclose`
+        :param float atol: absolute tolerance, see :func:`numpy.allclose`
+        :param bool equal_nan: treat NaNs in the same position as equal
+        '''
+        import numpy
+
+        super(ArrayComparator, self).__init__(budget)
+        self.numpy = numpy
+        self.rtol = rtol
+        self.atol = atol
+        self.equal_nan = equal_nan
+
+    def compare(self, control, candidate, budget):
+        np = self.numpy
+        control, candidate = np.asanyarray(control), np.asanyarray(candidate)
+        if control.shape != candidate.shape:
+            return Comparison(False, [('.shape', control.shape, candidate.shape)])
+
+        if budget.deadline is None or control.size <= _CHUNK_ITEMS:
+            return self._equal(control, candidate)
+        control, candidate = control.reshape(-1), candidate.reshape(-1)
+        for start in range(0, control.size, _CHUNK_ITEMS):
+            budget.check()
+            end = start + _CHUNK_ITEMS
+            if not self._equal(control[start:end], candidate[start:end]):
+                return False
+        return True
+
+    def _equal(self, control, candidate):
+        np = self.numpy
+        if self.rtol is None and self.atol is None:
+            return bool(np.array_equal(control, candidate, equal_nan=self.equal_nan))
+        return bool(np.allclose(
+            control, candidate,
+            rtol=self.rtol if self.rtol is not None else 1e-05,
+            atol=self.atol if self.atol is not None else 1e-08,
+            equal_nan=self.equal_nan,
+        ))
+
+
+class DiffComparator(Comparator):
+    '''
+    Compares dicts, lists, tuples and sets structurally and reports the paths
+    where they differ, e.g. ``['users'][3]['email']``, up to ``max_differences``.
+    '''
+
+    def __init__(self, max_differences=10, budget=None):
+        '''
+        :param int max_differences: stop after finding this many differences
+        '''
+        super(DiffComparator, self).__init__(budget)
+        self.max_differences = max_differences
+
+    def compare(self, control, candidate, budget):
+        differences = []
+        try:
+            self._diff('', control, candidate, differences, budget)
+        except _Enough:
+            pass
+        return Comparison(not differences, differences)
+
+    def _diff(self, path, control, candidate, differences, budget):
+        budget.tick()
+        if isinstance(control, dict) and isinstance(candidate, dict):
+            for key in control:
+                if key not in candidate:
+                    self._add(differences, '%s[%r]' % (path, key), control[key], _missing)
+                else:
+                    self._diff('%s[%r]' % (path, key), control[key], candidate[key], differences, budget)
+            for key in candidate:
+                if key not in control:
+                    self._add(differences, '%s[%r]' % (path, key), _missing, candidate[key])
+
+        elif isinstance(control, (list, tuple)) and isinstance(candidate, (list, tuple)):
+            for index, (a, b) in enumerate(zip(control, candidate)):
+                self._diff('%s[%r]' % (path, index), a, b, differences, budget)
+            if len(control) != len(candidate):
+                self._add(differences, '%s.len()' % path, len(control), len(candidate))
+
+        elif isinstance(control, (set, frozenset)) and isinstance(candidate, (set, frozenset)):
+            if control != candidate:
+                self._add(differences, path, control - candidate, candidate - control)
+
+        elif control != candidate:
+            self._add(differences, path, control, candidate)
+
+    def _add(self, differences, path, control, candidate):
+        differences.append((path, control, candidate))
+        if len(differences) >= self.max_differences:
+            raise _Enough()
+
+
+class _Enough(Exception):
+    pass
+
+
+class _Missing(object):
+    def __repr__(self):
+        return 'Missing'
+
+
+_missing = _Missing()
+
+# the budget is checked between chunks of this many bytes hashed or array items compared
+_CHUNK_BYTES = 1 << 20
+_CHUNK_ITEMS = 1 << 16
+
+
+_registry = {
+    'equal': EqualityComparator,
+    'digest': DigestComparator,
+    'ordered': OrderedComparator,
+    'tolerance': ToleranceComparator,
+    'array': ArrayComparator,
+    'diff': DiffComparator,
+}
+
+
+def register(name, factory):
+    '''
+    Register a comparator so that it can be referred to by name, e.g.
+    ``Experiment(comparator='my-comparator')``.
+
+    :param string name: comparator name
+    :param callable factory: returns a comparator when called with keyword arguments
+    '''
+    _registry[name] = factory
+
+
+def get(name, **kwargs):
+    '''
+    Create a registered comparator.
+
+    :param string name: one of ``equal``, ``digest``, ``ordered``, ``tolerance``,
+        ``array``, ``diff`` or a name passed to :func:`register`
+    :param kwargs: passed to the comparator
+    :raises KeyError: if no comparator is registered under ``name``
+    '''
+    return _registry[name](**kwargs)
+
+
+def _timed_out(comparison):
+    # whether a comparison's outcome is unknown because it ran out of time
+    return getattr(comparison, 'timed_out', False) is True
+
+
+def _pickle(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _isclose(a, b, rel_tol, abs_tol):
+    if a == b:
+        return True
+    if math.isinf(a) or math.isinf(b) or math.isnan(a) or math.isnan(b):
+        return False
+    return abs(a - b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
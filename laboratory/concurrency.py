@@ -0,0 +1,565 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import weakref
+
+from laboratory import exceptions
+from laboratory.observation import Observation, perf_counter_ns
+
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+if sys.version_info >= (3, 3):
+    from time import monotonic as _monotonic
+else:
+    from time import time as _monotonic
+
+
+logger = logging.getLogger(__name__)
+
+
+_shared_executor = None
+_shared_process_executor = None
+_shared_executor_lock = threading.Lock()
+
+#: Arguments of at least this many bytes are sent to candidates running in
+#: another process through shared memory rather than being pickled
+SHARED_MEMORY_MIN_BYTES = 1 << 20
+
+
+def shared_executor(max_workers=None):
+    '''
+    Return a process-wide thread pool suitable for running candidates.
+    The pool is created on first use; ``max_workers`` is ignored after that.
+
+    :param int max_workers: maximum number of candidate threads
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    '''
+    global _shared_executor
+
+    if _shared_executor is None:
+        with _shared_executor_lock:
+            if _shared_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _shared_executor = ThreadPoolExecutor(max_workers=max_workers or 4)
+    return _shared_executor
+
+
+def shared_process_executor(max_workers=None, interpreters=False):
+    '''
+    Return a process-wide process pool for running CPU-bound candidates without
+    contending with the control for the GIL. The pool is created, and its
+    workers started, on first use; the arguments are ignored after that.
+
+    Candidates run in a pool must be picklable, i.e. defined at module level,
+    as must their arguments and return values. See :ref:`processes`
+
+    :param int max_workers: number of worker processes. Defaults to the number of CPUs
+    :param bool interpreters: use a pool of subinterpreters instead of processes,
+        where Python provides one (3.14+)
+    :rtype: concurrent.futures.Executor
+    '''
+    global _shared_process_executor
+
+    if _shared_process_executor is None:
+        with _shared_executor_lock:
+            if _shared_process_executor is None:
+                import concurrent.futures
+
+                max_workers = max_workers or os.cpu_count() or 1
+                pool = getattr(concurrent.futures, 'InterpreterPoolExecutor', None)
+                if not interpreters or pool is None:
+                    pool = concurrent.futures.ProcessPoolExecutor
+                executor = pool(max_workers=max_workers)
+
+                # start the workers now rather than on the first candidate
+                for future in [executor.submit(_warm_up) for _ in range(max_workers)]:
+                    future.result()
+                _shared_process_executor = executor
+    return _shared_process_executor
+
+
+class Scheduler(object):
+    '''
+    Runs callbacks after a delay on a single daemon thread. Used to enforce
+    candidate timeouts without starting a timer thread per experiment.
+    '''
+
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition(threading.Lock())
+        self._thread = None
+        self._pid = None
+
+    def schedule(self, delay, callback):
+        '''
+        Call ``callback`` after ``delay`` seconds.
+
+        :return: a handle which can be passed to :meth:`cancel`
+        '''
+        entry = [_monotonic() + delay, next(self._counter), callback]
+        with self._condition:
+            self._ensure_thread()
+            heapq.heappush(self._queue, entry)
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        # entries are left on the heap and skipped when they come due
+        entry[2] = None
+
+    def _ensure_thread(self):
+        # threads do not survive a fork, so restart in the child if needed
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='laboratory-scheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                when, _, callback = self._queue[0]
+                delay = when - _monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._queue)
+
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception:
+                logger.exception('Exception occured in scheduled callback')
+
+
+scheduler = Scheduler()
+
+
+class BackgroundWorker(object):
+    '''
+    Runs work on background threads from a bounded queue. When the queue is
+    full new work is dropped rather than blocking the caller, and counted in
+    :attr:`dropped`.
+
+    :ivar int submitted: number of jobs accepted onto the queue
+    :ivar int dropped: number of jobs dropped because the queue was full
+    '''
+
+    def __init__(self, maxsize=1000, threads=1, shed_above=None):
+        '''
+        :param int maxsize: maximum number of queued jobs
+        :param int threads: number of worker threads
+        :param float shed_above: fraction of ``maxsize`` above which jobs are
+            randomly sampled, becoming less likely to be accepted as the queue
+            fills. By default jobs are only dropped once the queue is full.
+        '''
+        self.maxsize = maxsize
+        self.threads = threads
+        self.submitted = 0
+        self.dropped = 0
+
+        self._shed_above = None
+        if shed_above is not None:
+            self._shed_above = int(maxsize * shed_above)
+
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        _after_fork(self, '_reset')
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Queue ``func(*args, **kwargs)`` to be run in the background.
+
+        :return bool: whether the job was accepted
+        '''
+        if self._pid != os.getpid():
+            self._start()
+
+        if self._shed_above is not None and not self._admit():
+            return self._drop()
+
+        try:
+            self._queue.put_nowait((func, args, kwargs))
+        except queue.Full:
+            return self._drop()
+
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def join(self):
+        '''
+        Block until every queued job has been run.
+        '''
+        self._queue.join()
+
+    def _admit(self):
+        depth = self._queue.qsize()
+        if depth <= self._shed_above:
+            return True
+        headroom = float(self.maxsize - self._shed_above) or 1.0
+        return random.random() < (self.maxsize - depth) / headroom
+
+    def _drop(self):
+        with self._lock:
+            self.dropped += 1
+        return False
+
+    def _start(self):
+        # threads do not survive a fork, so start them again in the child
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for i in range(self.threads):
+                thread = threading.Thread(target=self._run, name='laboratory-worker-%s' % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _reset(self):
+        # in a forked child the jobs queued by the parent are the parent's to
+        # run, and the queue's locks may be held by threads which no longer
+        # exist. The child starts with an empty queue, counting what it discards
+        discarded = len(self._queue.queue)
+        self._queue = queue.Queue(self.maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self.dropped += discarded
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception('Exception occured in background job')
+            finally:
+                self._queue.task_done()
+
+
+class CandidateCollector(object):
+    '''
+    Submits an experiment's candidates to an executor and concludes the
+    experiment once the control and every candidate have finished (or the
+    candidates have timed out).
+    '''
+
+    def __init__(self, experiment, candidates, executor, timeout=None, experiment_context=None):
+        from laboratory.experiment import _observe
+
+        self.experiment = experiment
+        self._lock = threading.Lock()
+        self._control = None
+        self._concluded = False
+        self._timed_out = False
+        self._pending = len(candidates)
+        self._submitted = perf_counter_ns()
+        self._deadline = None
+
+        if experiment_context is None:
+            experiment_context = experiment._snapshot_context()
+        self._experiment_context = experiment_context
+        self._isolated = _is_isolated(executor)
+        self._candidates = []
+        for cand in candidates:
+            try:
+                if self._isolated:
+                    future = self._submit_isolated(executor, cand)
+                else:
+                    future = executor.submit(
+                        _observe, cand['func'], cand['args'], cand['kwargs'], cand['name'],
+                        cand['context'], self._experiment_context, False,
+                        experiment.cpu_time, experiment.profiler,
+                    )
+            except Exception as ex:
+                # e.g. the executor was shut down or its pool is broken. The
+                # candidate is recorded as failed rather than failing the caller
+                msg = 'Exception occured when submitting %s candidate of %s experiment'
+                logger.exception(msg % (cand['name'], experiment.name))
+                future = _failed_future(ex)
+            self._candidates.append((cand['name'], cand['context'], future))
+
+        if timeout is not None:
+            self._deadline = scheduler.schedule(timeout, self._expire)
+
+        for _, _, future in self._candidates:
+            future.add_done_callback(self._candidate_done)
+
+    def set_control(self, control):
+        '''
+        Record the control's :class:`Observation`. The experiment is concluded
+        immediately if the candidates have already finished.
+        '''
+        with self._lock:
+            self._control = control
+            ready = self._ready()
+        if ready:
+            self._conclude()
+
+    def cancel(self):
+        '''
+        Abandon the experiment, cancelling any candidates yet to start.
+        Nothing is published.
+        '''
+        with self._lock:
+            self._concluded = True
+        self._cancel_pending()
+
+    def _submit_isolated(self, executor, cand):
+        # large buffers are copied into shared memory, which is released once
+        # the candidate is done with it whether or not it's still wanted
+        buffers = []
+        try:
+            args = [_share(arg, buffers) for arg in cand['args']]
+            kwargs = dict((key, _share(value, buffers)) for key, value in cand['kwargs'].items())
+            future = executor.submit(
+                _observe_isolated, cand['func'], args, kwargs, cand['name'],
+                self.experiment.cpu_time, self.experiment.profiler,
+            )
+        except Exception:
+            _release(buffers)
+            raise
+
+        if buffers:
+            future.add_done_callback(lambda future: _release(buffers))
+        return future
+
+    def _candidate_done(self, future):
+        with self._lock:
+            self._pending -= 1
+            ready = self._ready()
+        if ready:
+            self._conclude()
+
+    def _expire(self):
+        with self._lock:
+            self._timed_out = True
+            ready = self._ready()
+        if ready:
+            self._conclude()
+
+    def _ready(self):
+        # must be called with the lock held
+        if self._concluded or self._control is None:
+            return False
+        if self._pending and not self._timed_out:
+            return False
+        self._concluded = True
+        return True
+
+    def _cancel_pending(self):
+        if self._deadline is not None:
+            scheduler.cancel(self._deadline)
+        for _, _, future in self._candidates:
+            future.cancel()
+
+    def _conclude(self):
+        self._cancel_pending()
+        observations = [
+            self._observation(name, ctx, future)
+            for name, ctx, future in self._candidates
+        ]
+
+        try:
+            self.experiment._conclude(self._control, observations, background=True)
+        except Exception:
+            msg = 'Exception occured when concluding %s experiment'
+            logger.exception(msg % self.experiment.name)
+
+    def _observation(self, name, ctx, future):
+        if future.done() and not future.cancelled():
+            ex = future.exception()
+            if ex is None:
+                obs = future.result()
+                if self._isolated:
+                    # context isn't sent to other processes, so it's restored here
+                    obs._experiment_context = self._experiment_context
+                    obs._observation_context = ctx
+                return obs
+            # the executor itself failed, e.g. a broken process pool
+            exc_info = (type(ex), ex, getattr(ex, '__traceback__', None))
+        else:
+            ex = exceptions.TimeoutException(
+                '%s did not complete within %ss' % (name, self.experiment.candidate_timeout)
+            )
+            exc_info = (type(ex), ex, None)
+
+        obs = Observation(name, ctx, self._experiment_context)
+        obs.start_ns = self._submitted
+        obs.set_end_time()
+        obs.set_exception(ex, exc_info=exc_info)
+        return obs
+
+
+class _SharedBuffer(object):
+    '''
+    A bytes-like argument copied into shared memory. Only the segment's name
+    and the argument's type and shape are pickled; the receiving process copies
+    the data back out.
+    '''
+
+    def __init__(self, value, data):
+        from multiprocessing import shared_memory
+
+        self.kind = type(value).__name__
+        self.size = data.nbytes
+        self.shape = getattr(value, 'shape', None)
+        self.dtype = getattr(value, 'dtype', None)
+        self.memory = shared_memory.SharedMemory(create=True, size=self.size)
+        self.memory.buf[:self.size] = data
+        self.name = self.memory.name
+
+    def __getstate__(self):
+        return {
+            'kind': self.kind, 'size': self.size, 'shape': self.shape,
+            'dtype': self.dtype, 'name': self.name, 'memory': None,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def restore(self):
+        memory = _attach(self.name, self.size)
+        try:
+            data = memory.buf[:self.size]
+            if self.kind == 'ndarray':
+                import numpy
+                value = numpy.frombuffer(data, dtype=self.dtype).reshape(self.shape).copy()
+            elif self.kind == 'bytearray':
+                value = bytearray(data)
+            else:
+                value = bytes(data)
+            data.release()
+        finally:
+            memory.close()
+        return value
+
+    def release(self):
+        try:
+            self.memory.close()
+            self.memory.unlink()
+        except (OSError, ValueError):
+            logger.exception('Exception occured when releasing shared memory %s' % self.name)
+
+
+class _Mapping(object):
+    # the parts of SharedMemory that restore() uses, for a segment mapped
+    # without registering it with the resource tracker
+
+    def __init__(self, name, size):
+        import _posixshmem
+        import mmap
+
+        fd = _posixshmem.shm_open('/' + name, os.O_RDWR, mode=0o600)
+        try:
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self._map)
+
+    def close(self):
+        self.buf.release()
+        self._map.close()
+
+
+def _attach(name, size):
+    # SharedMemory(name=...) registers the segment with this process' resource
+    # tracker as if it had created it. The tracker then warns about a leak and
+    # tries to unlink it again when the worker exits, or forgets the creator's
+    # registration if the worker shares its tracker
+    from multiprocessing import shared_memory
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    if os.name != 'posix':  # segments are only tracked on posix
+        return shared_memory.SharedMemory(name=name)
+    return _Mapping(name, size)
+
+
+def _share(value, buffers):
+    if isinstance(value, (bytes, bytearray)):
+        data = memoryview(value)
+    elif type(value).__name__ == 'ndarray' and 'numpy' in sys.modules:
+        import numpy
+        if not isinstance(value, numpy.ndarray) or value.dtype.hasobject:
+            return value
+        data = memoryview(numpy.ascontiguousarray(value)).cast('B')
+    else:
+        return value
+
+    if data.nbytes < SHARED_MEMORY_MIN_BYTES:
+        return value
+
+    buffer = _SharedBuffer(value, data)
+    buffers.append(buffer)
+    return buffer
+
+
+def _after_fork(obj, method):
+    # call ``method`` of ``obj`` in the child after a fork, for as long as
+    # ``obj`` is alive
+    if not hasattr(os, 'register_at_fork'):  # python < 3.7 or no fork
+        return
+    ref = weakref.ref(obj)
+
+    def after_in_child():
+        instance = ref()
+        if instance is not None:
+            getattr(instance, method)()
+
+    os.register_at_fork(after_in_child=after_in_child)
+
+
+def _failed_future(ex):
+    from concurrent.futures import Future
+
+    future = Future()
+    future.set_exception(ex)
+    return future
+
+
+def _release(buffers):
+    for buffer in buffers:
+        buffer.release()
+
+
+def _observe_isolated(func, args, kwargs, name, cpu_time, profiler):
+    # runs in a worker process. Context stays in the parent, which restores it
+    from laboratory.experiment import _observe
+
+    args = [arg.restore() if isinstance(arg, _SharedBuffer) else arg for arg in args]
+    kwargs = dict(
+        (key, value.restore() if isinstance(value, _SharedBuffer) else value)
+        for key, value in kwargs.items()
+    )
+    return _observe(func, args, kwargs, name, None, None, False, cpu_time, profiler)
+
+
+def _is_isolated(executor):
+    import concurrent.futures
+
+    isolated = (concurrent.futures.ProcessPoolExecutor,)
+    if hasattr(concurrent.futures, 'InterpreterPoolExecutor'):
+        isolated += (concurrent.futures.InterpreterPoolExecutor,)
+    return isinstance(executor, isolated)
+
+
+def _warm_up():
+    import laboratory.experiment  # noqa: F401
@@ -11,3 +11,10 @@ class LaboratoryException(Exception):
 class MismatchException(LaboratoryException):
     '''
     '''
+
+
+class TimeoutException(LaboratoryException):
+    '''
+    Recorded on a candidate's :class:`Observation` when it does not complete
+    within the experiment's ``candidate_timeout``
+    '''
@@ -1,11 +1,11 @@
-from copy import deepcopy
 from functools import wraps
 import logging
 import random
-import traceback
 
-from laboratory import exceptions
-from laboratory.observation import Observation
+from laboratory import comparators, exceptions, streams
+from laboratory.concurrency import CandidateCollector, _is_isolated
+from laboratory.observation import Observation, perf_counter_ns
+from laboratory.registry import registry
 from laboratory.result import Result
 
 
@@ -17,21 +17,109 @@ class Experiment(object):
     Experiment base class. Handles running your control and candidate functions.
     Should be subclassed to add publishing functionality.
 
+    Experiments register with :data:`laboratory.registry.registry` by name, so
+    they can be inspected and controlled at runtime. See :ref:`registry`.
+
     :ivar string name: Experiment name
     :ivar bool raise_on_mismatch: Raise :class:`MismatchException` when
      experiment results do not match
+    :ivar executor: Executor used to run candidates concurrently, if any
+    :ivar float candidate_timeout: Seconds to wait for concurrent candidates
+    :ivar BackgroundWorker worker: Worker used to run candidates after the
+     control has returned, if any
+    :ivar bool cpu_time: Record CPU time on each observation
+    :ivar Sampler sampler: Decides which runs execute candidates, if any
+    :ivar publisher: Publisher that results are passed to by default, if any
+    :ivar Aggregator aggregator: Aggregator that results are recorded in, if any
+    :ivar float enabled_ttl: Seconds to cache the result of ``enabled()`` for
+    :ivar comparator: Compares control and candidate values, if set
+    :ivar capture: Capture policy applied to observation values, if set
+    :ivar CircuitBreaker circuit_breaker: Skips failing or slow candidates, if set
+    :ivar Recorder recorder: Records runs for replaying later instead of running
+     candidates, if set
+    :ivar Profiler profiler: Takes measurements while each function runs, if set
+    :ivar Analyzer analyzer: Analyzer that durations are recorded in, if any
+    :ivar ResultCache cache: Cache of candidate outcomes keyed on arguments, if any
+    :ivar Isolation isolation: Decides what functions are passed in place of
+     shared arguments, if set
     '''
 
-    def __init__(self, name='Experiment', context=None, raise_on_mismatch=False):
+    def __init__(self, name='Experiment', context=None, raise_on_mismatch=False,
+                 executor=None, candidate_timeout=None, worker=None, cpu_time=False,
+                 sampler=None, publisher=None, aggregator=None, enabled_ttl=None,
+                 comparator=None, capture=None, circuit_breaker=None, recorder=None,
+                 profiler=None, analyzer=None, cache=None, isolation=None):
         '''
         :param string name: Experiment name
         :param dict context: Experiment-wide context
         :param bool raise_on_mismatch: Raise if results do not match
+        :param executor: a :class:`concurrent.futures.Executor` to run candidates on.
+            See :ref:`concurrency`
+        :param float candidate_timeout: Seconds to wait for candidates run on
+            ``executor`` before recording them as timed out
+        :param BackgroundWorker worker: run candidates, comparison and publishing
+            on a background worker once the control has returned. See :ref:`background`
+        :param bool cpu_time: Record the CPU time used by each function in
+            :attr:`Observation.cpu_ns`
+        :param Sampler sampler: only run candidates for runs chosen by this
+            sampler. See :ref:`sampling`
+        :param publisher: pass results to this publisher, such as a
+            :class:`~laboratory.publishing.BufferedPublisher`. See :ref:`publishing`
+        :param Aggregator aggregator: record every result in this aggregator's
+            running statistics. See :ref:`aggregation`
+        :param float enabled_ttl: cache the result of ``enabled()`` for this
+            many seconds rather than calling it on every run
+        :param comparator: compare values with this comparator instead of ``==``.
+            Either a :class:`~laboratory.comparators.Comparator`, any callable
+            taking the control and candidate values, or the name of a registered
+            comparator. See :ref:`comparators`
+        :param capture: a capture policy, such as
+            :class:`~laboratory.capture.DigestCapture`, deciding what observations
+            keep of each return value once the control's value has been returned.
+            See :ref:`capture`
+        :param CircuitBreaker circuit_breaker: stop running candidates that
+            raise, mismatch or are slow too often. See :ref:`circuit_breaker`
+        :param Recorder recorder: record the arguments and control observation
+            of sampled runs, without running candidates, to replay them later.
+            See :ref:`replay`
+        :param Profiler profiler: measure memory, garbage collection and
+            optionally profile each function, attaching the measurements to
+            :attr:`Observation.profile`. See :ref:`profiling`
+        :param Analyzer analyzer: record durations in this analyzer to decide
+            whether candidates are faster or slower. See :ref:`analysis`
+        :param ResultCache cache: reuse candidate outcomes for arguments seen
+            recently rather than running the candidates again. See :ref:`caching`
+        :param Isolation isolation: pass every function, the control included,
+            read-only or copy-on-write views of its arguments, and optionally detect which functions
+            mutate them. See :ref:`isolation`
         '''
 
         self.name = name
         self._context = context or {}
         self.raise_on_mismatch = raise_on_mismatch
+        self.executor = executor
+        self.candidate_timeout = candidate_timeout
+        self.worker = worker
+        self.cpu_time = cpu_time
+        self.sampler = sampler
+        self.publisher = publisher
+        self.aggregator = aggregator
+        self.enabled_ttl = enabled_ttl
+
+        if isinstance(comparator, str):
+            comparator = comparators.get(comparator)
+        self.comparator = comparator
+        self.capture = capture
+        self.circuit_breaker = circuit_breaker
+        self.recorder = recorder
+        self.profiler = profiler
+        self.analyzer = analyzer
+        self.cache = cache
+        self.isolation = isolation
+
+        self._enabled = None
+        self._enabled_expires = 0
+        self._registered = registry.register(name)
 
         self._control = None
         self._candidates = []
@@ -53,14 +141,36 @@ class Experiment(object):
             def control_func():
                 return True
 
+        The experiment is created once, when the function is decorated, and is
+        shared by every call (and thread) that calls the function. It's available
+        as ``control_func.experiment``.
+
+        Subclasses which override :meth:`conduct` get a new experiment for each
+        call instead, set up with the call's arguments, so that their
+        ``conduct()`` is run.
         '''
         def wrapper(control):
+            experiment = cls(*exp_args, **exp_kwargs)
+            experiment.control(control)
+            experiment.candidate(candidate)
+
+            if _overrides_conduct(cls):
+                @wraps(control)
+                def inner(*args, **kwargs):
+                    call_experiment = cls(*exp_args, **exp_kwargs)
+                    call_experiment.control(control, args=args, kwargs=kwargs)
+                    call_experiment.candidate(candidate, args=args, kwargs=kwargs)
+                    return call_experiment.conduct()
+                inner.experiment = experiment
+                return inner
+
             @wraps(control)
             def inner(*args, **kwargs):
-                experiment = cls(*exp_args, **exp_kwargs)
-                experiment.control(control, args=args, kwargs=kwargs)
-                experiment.candidate(candidate, args=args, kwargs=kwargs)
-                return experiment.conduct()
+                experiment._registration.calls.increment()
+                if not experiment._is_enabled():
+                    return control(*args, **kwargs)
+                return experiment._conduct_enabled(True, args, kwargs)
+            inner.experiment = experiment
             return inner
         return wrapper
 
@@ -113,6 +223,20 @@ class Experiment(object):
         Run control & candidate functions and return the control's return value.
         ``control()`` must be called first.
 
+        If the experiment has an ``executor`` the control is run inline and
+        candidates are run on the executor. The control's value is returned as
+        soon as the control completes, and the result is published once the
+        candidates complete or ``candidate_timeout`` elapses.
+
+        If the experiment has a ``worker`` the control is run and its value
+        returned immediately. Candidates are run, compared and published later on
+        the worker, or not at all if the worker's queue is full.
+
+        If the control returns a generator and candidates run inline, an
+        iterator of the control's elements is returned. Candidate
+        streams are compared with it element by element as it's consumed, and
+        the result is published once it ends or is closed. See :ref:`streams`
+
         :param bool randomize: controls whether we shuffle the order
             of execution between control and candidate
         :raise LaboratoryException: when no control case has been set
@@ -123,54 +247,28 @@ class Experiment(object):
                 'Your experiment must contain a control case'
             )
 
-
-        # execute control and exit if experiment is not enabled
-        if not self.enabled():
-            control = self._run_tested_func(raise_on_exception=True, **self._control)
-            return control.value
-
-        # otherwise, let's wrap an executor around all of our functions and randomise the ordering
-
-        def get_func_executor(obs_def, is_control):
-            """A lightweight wrapper around a tested function in order to retrieve state"""
-            return lambda *a, **kw: (self._run_tested_func(raise_on_exception=is_control, **obs_def), is_control)
-
-        funcs = [
-            get_func_executor(self._control, is_control=True),
-        ] + [get_func_executor(cand, is_control=False,) for cand in self._candidates]
-
-        if randomize:
-            random.shuffle(funcs)
-
-        control = None
-        candidates = []
-
-        # go through the randomised list and execute the functions
-        for func in funcs:
-            observation, is_control = func()
-            if is_control:
-                control = observation
-            else:
-                candidates.append(observation)
-
-        result = Result(self, control, candidates)
-
-        try:
-            self.publish(result)
-        except Exception:
-            msg = 'Exception occured when publishing %s experiment data'
-            logger.exception(msg % self.name)
-
-        return control.value
+        return self._conduct(randomize)
 
     def enabled(self):
         '''
-        Enable the experiment? If false candidates will not be executed.
+        Enable the experiment? If false candidates will not be executed, and the
+        control function is called directly without being observed.
+        Runs are only sampled by the experiment's ``sampler`` if this returns true.
+
+        If the experiment has an ``enabled_ttl`` the result is cached for that
+        many seconds, so this shouldn't depend on per-call context.
 
         :rtype: bool
         '''
         return True
 
+    def reload_enabled(self):
+        '''
+        Discard the cached result of ``enabled()`` so that it is called again on
+        the next run.
+        '''
+        self._enabled_expires = 0
+
     def compare(self, control, candidate):
         '''
         Compares two :class:`Observation` instances.
@@ -180,12 +278,22 @@ class Experiment(object):
 
         :raises MismatchException: If ``Experiment.raise_on_mismatch`` is True
 
-        :return bool: match?
+        :return: match? A :class:`~laboratory.comparators.Comparison` if the
+            experiment has a ``comparator``, otherwise a bool
         '''
-        if candidate.failure or control.value != candidate.value:
+        if candidate.failure:
             return self._handle_comparison_mismatch(control, candidate)
 
-        return True
+        # streams have already been compared element by element
+        if self.comparator is None or isinstance(control.value, streams.StreamSummary):
+            if control.value != candidate.value:
+                return self._handle_comparison_mismatch(control, candidate)
+            return True
+
+        comparison = self.comparator(control.value, candidate.value)
+        if not comparison:
+            return self._handle_comparison_mismatch(control, candidate, comparison)
+        return comparison
 
     def publish(self, result):
         '''
@@ -193,11 +301,13 @@ class Experiment(object):
         This is called after each experiment run.
         Exceptions that occur during publishing will be caught, but logged.
 
-        By default this is a no-op. See :ref:`publishing`.
+        By default results are passed to the experiment's ``publisher`` if it has
+        one, otherwise this is a no-op. See :ref:`publishing`.
 
         :param Result result: The result of an experiment run
         '''
-        return
+        if self.publisher is not None:
+            self.publisher.publish(result)
 
     def get_context(self):
         '''
@@ -205,33 +315,374 @@ class Experiment(object):
         '''
         return self._context
 
-    def _run_tested_func(self, func, args, kwargs, name, context, raise_on_exception):
-        ctx = deepcopy(self.get_context())
-        ctx.update(context)
+    def _conduct(self, randomize=True, args=None, kwargs=None):
+        # ``args`` and ``kwargs``, when given, are passed to every function
+        # in place of the arguments they were set up with
+        self._registration.calls.increment()
+
+        # call the control directly if the experiment is not enabled
+        if not self._is_enabled():
+            return self._call_control(args, kwargs)
+        return self._conduct_enabled(randomize, args, kwargs)
+
+    def _conduct_enabled(self, randomize, args, kwargs):
+        # the call has been counted and the experiment found to be enabled.
+        # Call the control directly if the run isn't sampled
+        control_def = self._control
+        if not self._sample():
+            return self._call_unsampled(args, kwargs)
+        self._registration.sampled.increment()
+
+        # observations of this run share one snapshot of the experiment context
+        context = self._snapshot_context()
+        if self.recorder is not None:
+            return self._conduct_recording(args, kwargs, context)
+
+        # or call it directly if every candidate's circuit is open
+        candidates = self._candidates
+        if self.circuit_breaker is not None and candidates:
+            candidates = self._allowed(candidates)
+            if not candidates:
+                return self._call_control(args, kwargs)
+
+        # results are only cached when candidates run inline
+        cache_key = cached = None
+        if self.cache is not None and candidates and self.executor is None and self.worker is None:
+            if args is None:
+                cache_key = self.cache.key(self, control_def['args'], control_def['kwargs'])
+            else:
+                cache_key = self.cache.key(self, args, kwargs)
+            if cache_key is not None:
+                cached = self.cache.get(cache_key, [cand['name'] for cand in candidates])
+
+        # arguments are fingerprinted after each function if checking for
+        # mutation, and every function is passed its own isolated arguments
+        watch = None
+        if self.isolation is not None:
+            if self.executor is None and self.worker is None and cached is None:
+                if args is None:
+                    watch = self.isolation.watch(control_def['args'], control_def['kwargs'])
+                else:
+                    watch = self.isolation.watch(args, kwargs)
+            control_def, candidates = self._isolate(control_def, candidates, args, kwargs)
+            args = kwargs = None
+
+        if cached is not None:
+            return self._conduct_cached(control_def, candidates, cached, args, kwargs, context)
+
+        if self.worker is not None:
+            return self._conduct_in_background(
+                control_def, candidates, randomize, args, kwargs, context,
+            )
 
-        obs = Observation(name, ctx)
-        obs.set_start_time()
+        if self.executor is not None:
+            return self._conduct_concurrently(
+                control_def, candidates, randomize, args, kwargs, context,
+            )
+        # otherwise run everything in a random order. Placing the control at a
+        # random position among shuffled candidates is equivalent to shuffling
+        # them all together
+        control_index = 0
+        if randomize:
+            control_index = random.randint(0, len(candidates))
+            if len(candidates) > 1:
+                candidates = random.sample(candidates, len(candidates))
 
-        try:
-            obs.record(func(*args, **kwargs))
-        except Exception as ex:
-            obs.set_exception(ex)
-            if raise_on_exception:
-                raise
-        finally:
-            obs.set_end_time()
+        control = None
+        observations = []
+
+        for index, cand in enumerate(candidates):
+            if index == control_index:
+                control = self._run_definition(control_def, args, kwargs, True, watch, context)
+            observations.append(self._run_definition(cand, args, kwargs, False, watch, context))
+
+        if control is None:
+            control = self._run_definition(control_def, args, kwargs, True, watch, context)
+
+        # the value is taken before concluding, which may replace it
+        value = control.value
+        if streams.is_stream(value):
+            return streams.compare_streams(self, control, observations)
+        result = self._conclude(control, observations)
+
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+
+        return value
+
+    def _conduct_cached(self, control_def, candidates, cached, args, kwargs, context):
+        control = self._run_definition(control_def, args, kwargs, True, context=context)
+        value = control.value
+
+        observations, matches = [], []
+        for cand in candidates:
+            observation, match = cached[cand['name']]
+            observations.append(observation)
+            matches.append(match)
+
+        for observation, match in zip(observations, matches):
+            if not match:
+                self._registration.mismatches.increment()
+                self._handle_comparison_mismatch(control, observation)
+
+        if self.capture is not None:
+            self._capture([control])
+        result = Result(self, control, observations, matches)
+        self._record(result)
+        self._publish(result)
+        return value
+
+    def _call_control(self, args, kwargs):
+        if args is None:
+            args, kwargs = self._control['args'], self._control['kwargs']
+        return self._control['func'](*args, **kwargs)
+
+    def _call_unsampled(self, args, kwargs):
+        sampler = self.sampler
+        if sampler is None or not sampler.times_unsampled:
+            return self._call_control(args, kwargs)
+
+        start = perf_counter_ns()
+        value = self._call_control(args, kwargs)
+        sampler.record_unsampled(perf_counter_ns() - start)
+        return value
+
+    def _conduct_recording(self, args, kwargs, context):
+        if args is None:
+            args, kwargs = self._control['args'], self._control['kwargs']
+        control_def = self._bind([self._control], args, kwargs, self.isolation)[0]
+        control = self._run_definition(control_def, None, None, True, context=context)
+        value = control.value
+        self.recorder.record(self, args, kwargs, control)
+        return value
+
+    def _conduct_concurrently(self, control_def, candidates, randomize, args, kwargs, context):
+        # candidates are submitted first so they run alongside the control,
+        # and the experiment is concluded by whichever finishes last
+        candidates = self._bind(candidates, args, kwargs)
+        if randomize:
+            random.shuffle(candidates)
 
-        return obs
+        collector = CandidateCollector(
+            self, candidates, self.executor, timeout=self.candidate_timeout,
+            experiment_context=context,
+        )
 
-    def _handle_comparison_mismatch(self, control, observation):
+        try:
+            control = self._run_definition(control_def, args, kwargs, True, context=context)
+        except Exception:
+            collector.cancel()
+            raise
+
+        value = control.value
+        if self.capture is not None:
+            self._capture([control])
+        collector.set_control(control)
+        return value
+
+    def _conduct_in_background(self, control_def, candidates, randomize, args, kwargs, context):
+        control = self._run_definition(control_def, args, kwargs, True, context=context)
+        value = control.value
+        if self.capture is not None:
+            self._capture([control])
+        self.worker.submit(self._run_candidates, control, candidates, randomize, args, kwargs)
+        return value
+
+    def _run_candidates(self, control, candidates, randomize, args, kwargs):
+        candidates = list(candidates)
+        if randomize:
+            random.shuffle(candidates)
+
+        observations = [
+            self._run_definition(cand, args, kwargs, False, context=control._experiment_context)
+            for cand in candidates
+        ]
+        self._conclude(control, observations, background=True)
+
+    def _isolate(self, control_def, candidates, args, kwargs):
+        # candidates run in another process are sent their own copy of the
+        # arguments, so only the control's are isolated. Wrappers can't be sent
+        if self.executor is not None and _is_isolated(self.executor):
+            control_def = self._bind([control_def], args, kwargs, self.isolation)[0]
+            return control_def, self._bind(candidates, args, kwargs)
+
+        bound = self._bind([control_def] + list(candidates), args, kwargs, self.isolation)
+        return bound[0], bound[1:]
+
+    def _bind(self, definitions, args, kwargs, isolation=None):
+        # with an isolation policy, snapshots are taken before any function runs
+        if args is None and isolation is None:
+            return list(definitions)
+
+        arguments = [
+            (args, kwargs) if args is not None else (definition['args'], definition['kwargs'])
+            for definition in definitions
+        ]
+        if isolation is not None:
+            arguments = isolation.prepare(arguments)
+        return [
+            dict(definition, args=bound_args, kwargs=bound_kwargs)
+            for definition, (bound_args, bound_kwargs) in zip(definitions, arguments)
+        ]
+
+    @property
+    def _registration(self):
+        # looked up again by name once the registry has been reset
+        registration = self._registered
+        if registration.forgotten:
+            registration = self._registered = registry.register(self.name)
+        return registration
+
+    def _is_enabled(self):
+        if self._registration.enabled is not None:
+            return self._registration.enabled
+        if self.enabled_ttl is None:
+            return self.enabled()
+
+        now = perf_counter_ns()
+        if now >= self._enabled_expires:
+            self._enabled = bool(self.enabled())
+            self._enabled_expires = now + int(self.enabled_ttl * 1e9)
+        return self._enabled
+
+    def _sample(self):
+        percentage = self._registration.percentage
+        if percentage is not None:
+            return random.random() * 100 < percentage
+        return self.sampler is None or self.sampler.sample(self)
+
+    def _allowed(self, candidates):
+        return [
+            cand for cand in candidates
+            if self.circuit_breaker.allow(self, cand['name'])
+        ]
+
+    def _conclude(self, control, candidates, background=False):
+        # off the caller's thread there's nobody to raise mismatches to, so
+        # they're logged and the result is still recorded and published. The
+        # control was captured there when its value was handed back, before the
+        # caller could change it
+        if self.capture is not None:
+            self._capture(candidates if background else [control] + candidates)
+        if background:
+            result = Result(self, control, candidates, raise_on_mismatch=False)
+            if self.raise_on_mismatch:
+                self._log_mismatches(result)
+        else:
+            result = Result(self, control, candidates)
+        self._record(result)
+        self._publish(result)
+        return result
+
+    def _log_mismatches(self, result):
+        for index in range(len(result.candidates)):
+            try:
+                result._compare(index)
+            except exceptions.MismatchException as ex:
+                result._matches[index] = False
+                self._registration.mismatches.increment()
+                msg = 'Mismatch in %s experiment: %s'
+                logger.error(msg % (self.name, ex.message))
+
+    def _publish(self, result):
+        try:
+            self.publish(result)
+        except Exception:
+            msg = 'Exception occured when publishing %s experiment data'
+            logger.exception(msg % self.name)
+
+    def _capture(self, observations):
+        for observation in observations:
+            if observation.failure or isinstance(observation.value, streams.StreamSummary):
+                continue
+            try:
+                observation.value = self.capture(observation.value)
+            except Exception:
+                msg = 'Exception occured when capturing %s value of %s experiment'
+                logger.exception(msg % (observation.name, self.name))
+
+    def _record(self, result):
+        # feed the result to anything that learns from experiment runs
+        self._registration.record(result)
+        if self.sampler is not None:
+            self.sampler.record(result)
+        if self.aggregator is not None:
+            self.aggregator.record(result)
+        if self.analyzer is not None:
+            self.analyzer.record(result)
+        if self.circuit_breaker is not None:
+            result.state_changes = self.circuit_breaker.record(result)
+
+    def _run_definition(self, definition, args, kwargs, raise_on_exception, watch=None,
+                        context=None):
+        if args is None:
+            args, kwargs = definition['args'], definition['kwargs']
+
+        observation = self._run_tested_func(
+            definition['func'], args, kwargs, definition['name'],
+            definition['context'], raise_on_exception, context,
+        )
+        if watch is not None:
+            watch.check(observation)
+        return observation
+
+    def _run_tested_func(self, func, args, kwargs, name, context, raise_on_exception,
+                         experiment_context=None):
+        if experiment_context is None:
+            experiment_context = self._snapshot_context()
+        return _observe(
+            func, args, kwargs, name, context, experiment_context,
+            raise_on_exception, self.cpu_time, self.profiler,
+        )
+
+    def _snapshot_context(self):
+        # a shallow copy taken when the run starts, so keys set on the experiment
+        # context afterwards aren't published with it. Values are only deep
+        # copied by observations asked for their context
+        context = self.get_context()
+        return dict(context) if context else context
+
+    def _handle_comparison_mismatch(self, control, observation, comparison=None):
         if self.raise_on_mismatch:
             if observation.failure:
-                tb = ''.join(traceback.format_exception(*observation.exc_info))
-                msg = '%s raised an exception:\n%s' % (observation.name, tb)
+                msg = '%s raised an exception:\n%s' % (
+                    observation.name, observation.format_exception(),
+                )
+            elif getattr(comparison, 'differences', None):
+                msg = '%s does not match control value:\n%s' % (
+                    observation.name,
+                    '\n'.join('%s: %r != %r' % diff for diff in comparison.differences),
+                )
             else:
                 msg = '%s does not match control value (%s != %s)' % (
                     observation.name, control.value, observation.value
                 )
             raise exceptions.MismatchException(msg)
 
-        return False
+        return comparison if comparison is not None else False
+
+
+def _overrides_conduct(cls):
+    conduct = getattr(cls.conduct, '__func__', cls.conduct)
+    return conduct is not Experiment.__dict__['conduct']
+
+
+def _observe(func, args, kwargs, name, context, experiment_context,
+             raise_on_exception=False, cpu_time=False, profiler=None):
+    # module-level so that it can be shipped to a process pool
+    obs = Observation(name, context, experiment_context)
+    profile = profiler.start() if profiler is not None else None
+    obs.set_start_time(cpu_time)
+
+    try:
+        obs.record(func(*args, **kwargs))
+    except Exception as ex:
+        obs.set_exception(ex)
+        if raise_on_exception:
+            raise
+    finally:
+        obs.set_end_time()
+        if profile is not None:
+            obs.profile = profiler.stop(profile)
+
+    return obs
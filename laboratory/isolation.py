@@ -0,0 +1,406 @@
+import hashlib
+import pickle
+
+try:
+    from collections.abc import MutableMapping, MutableSequence, Sequence
+except ImportError:  # python 2
+    from collections import MutableMapping, MutableSequence, Sequence
+
+try:
+    from types import MappingProxyType
+except ImportError:  # python 2
+    MappingProxyType = None
+
+
+class Isolation(object):
+    '''
+    Base class for argument isolation policies. A policy decides what each
+    function is passed in place of the arguments the control and candidates
+    share, so that one which mutates its arguments can't change what the
+    others see, without deep copying them for every call.
+
+    Snapshots of the arguments are taken once, before any function runs, and
+    every function, the control included, is passed its own isolated
+    arguments made from them.
+
+    Pass a policy to an experiment with ``Experiment(isolation=...)``. This
+    base class passes arguments through as they are, so ``Isolation(detect=True)``
+    only detects mutation.
+
+    :ivar bool detect: check whether each function mutated the arguments
+    '''
+
+    def __init__(self, detect=False):
+        '''
+        :param bool detect: fingerprint the arguments before the functions run
+            and after each one, recording the arguments each function changed
+            in :attr:`Observation.mutations`. Only done when candidates run
+            inline, one after the other
+        '''
+        self.detect = detect
+
+    def snapshot(self, value):
+        '''
+        Called once for each argument, before any function runs.
+
+        :param value: an argument shared by the control and candidates
+        :return: what each function's isolated argument is made from
+        '''
+        return value
+
+    def isolate(self, value):
+        '''
+        :param value: an argument shared by the control and candidates, or its
+            snapshot
+        :return: what a function should be passed in its place
+        '''
+        return value
+
+    def prepare(self, arguments):
+        '''
+        Snapshot the arguments of a run, then isolate them for each function.
+        Arguments shared by several functions are only snapshotted once.
+
+        :param list arguments: ``(args, kwargs)`` for each function
+        :return list: isolated ``(args, kwargs)`` for each function
+        '''
+        snapshots = {}
+
+        def snapshot(value):
+            # the value is kept with its snapshot so its id can't be reused
+            key = id(value)
+            if key not in snapshots:
+                snapshots[key] = (value, self.snapshot(value))
+            return snapshots[key][1]
+
+        prepared = []
+        for args, kwargs in arguments:
+            args = [snapshot(arg) for arg in args]
+            kwargs = dict((key, snapshot(value)) for key, value in kwargs.items())
+            prepared.append(self.isolate_arguments(args, kwargs))
+        return prepared
+
+    def isolate_arguments(self, args, kwargs):
+        '''
+        :return: positional and keyword arguments for a function
+        '''
+        isolate = self.isolate
+        return (
+            [isolate(arg) for arg in args],
+            dict((key, isolate(value)) for key, value in kwargs.items()),
+        )
+
+    def watch(self, args, kwargs):
+        '''
+        :return MutationWatch: watch over the arguments, or None if mutation
+            isn't detected
+        '''
+        if not self.detect:
+            return None
+        return MutationWatch(args, kwargs)
+
+
+class ReadOnly(Isolation):
+    '''
+    Passes functions read-only views of their arguments: dicts as
+    :class:`types.MappingProxyType`, lists as :class:`ReadOnlyList`, and
+    writable buffers such as ``bytearray`` and NumPy arrays as read-only
+    views of a snapshot. Only writable buffers are copied, once per run.
+
+    A function which tries to change a view raises: a candidate is recorded as
+    failing, and the control's exception is raised as usual. Only the
+    arguments themselves are protected; objects they contain can still be
+    changed, which ``detect`` will report.
+    '''
+
+    def snapshot(self, value):
+        return _snapshot_buffer(value)
+
+    def isolate(self, value):
+        if isinstance(value, dict) and MappingProxyType is not None:
+            return MappingProxyType(value)
+        if isinstance(value, list):
+            return ReadOnlyList(value)
+        return _read_only_buffer(value)
+
+
+class CopyOnWrite(Isolation):
+    '''
+    Passes functions dicts and lists wrapped in :class:`CopyOnWriteDict` and
+    :class:`CopyOnWriteList`, which read from the original until the first
+    change, then make a shallow copy and change that instead. Writable buffers
+    are passed as read-only views of a snapshot, as with :class:`ReadOnly`.
+
+    Changes the control makes are kept in its own copy, so they aren't seen by
+    the caller either. The wrappers aren't ``dict`` or ``list`` instances, so
+    functions which check types strictly should use :class:`ReadOnly` or
+    detection only.
+    '''
+
+    def snapshot(self, value):
+        return _snapshot_buffer(value)
+
+    def isolate(self, value):
+        if isinstance(value, dict):
+            return CopyOnWriteDict(value)
+        if isinstance(value, list):
+            return CopyOnWriteList(value)
+        return _read_only_buffer(value)
+
+
+class MutationWatch(object):
+    '''
+    Fingerprints a run's arguments, and after each function records which of
+    them it changed. Buffers are hashed in place; other arguments are hashed
+    by their pickled form, or their ``repr()`` if they can't be pickled.
+    Changes to attributes that don't affect either can't be detected.
+    '''
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self._fingerprints = self._fingerprint()
+
+    def check(self, observation):
+        '''
+        Record the arguments changed since the last check in
+        :attr:`Observation.mutations`.
+
+        :param Observation observation: observation of the function that just ran
+        '''
+        fingerprints = self._fingerprint()
+        observation.mutations = tuple(
+            key for key, fingerprint in fingerprints.items()
+            if self._fingerprints.get(key) != fingerprint
+        )
+        self._fingerprints = fingerprints
+
+    def _fingerprint(self):
+        fingerprints = dict(
+            (index, _fingerprint(arg)) for index, arg in enumerate(self.args)
+        )
+        for key, value in self.kwargs.items():
+            fingerprints[key] = _fingerprint(value)
+        return fingerprints
+
+
+class ReadOnlyList(Sequence):
+    '''
+    Read-only view of a list.
+    '''
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, value):
+        return value in self._data
+
+    def __eq__(self, other):
+        if isinstance(other, ReadOnlyList):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ReadOnlyList(%r)' % (self._data,)
+
+
+class CopyOnWriteDict(MutableMapping):
+    '''
+    Dict wrapper which reads from the original dict until it's changed, then
+    copies it.
+
+    :ivar bool copied: the wrapper has made its own copy
+    '''
+
+    __slots__ = ('_data', 'copied')
+
+    def __init__(self, data):
+        self._data = data
+        self.copied = False
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._writable()[key] = value
+
+    def __delitem__(self, key):
+        del self._writable()[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def copy(self):
+        return dict(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, CopyOnWriteDict):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'CopyOnWriteDict(%r)' % (self._data,)
+
+    def _writable(self):
+        if not self.copied:
+            self._data = dict(self._data)
+            self.copied = True
+        return self._data
+
+
+class CopyOnWriteList(MutableSequence):
+    '''
+    List wrapper which reads from the original list until it's changed, then
+    copies it.
+
+    :ivar bool copied: the wrapper has made its own copy
+    '''
+
+    __slots__ = ('_data', 'copied')
+
+    def __init__(self, data):
+        self._data = data
+        self.copied = False
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        self._writable()[index] = value
+
+    def __delitem__(self, index):
+        del self._writable()[index]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, value):
+        return value in self._data
+
+    def insert(self, index, value):
+        self._writable().insert(index, value)
+
+    def append(self, value):
+        self._writable().append(value)
+
+    def extend(self, values):
+        self._writable().extend(values)
+
+    def sort(self, *args, **kwargs):
+        self._writable().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._writable().reverse()
+
+    def copy(self):
+        return list(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, CopyOnWriteList):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'CopyOnWriteList(%r)' % (self._data,)
+
+    def _writable(self):
+        if not self.copied:
+            self._data = list(self._data)
+            self.copied = True
+        return self._data
+
+
+def _snapshot_buffer(value):
+    # writable buffers are copied, so changes made to them while the functions
+    # run, by any of them or by another thread, aren't seen
+    if _is_array(value):
+        if not value.flags.writeable:
+            return value
+        snapshot = value.copy()
+        snapshot.flags.writeable = False
+        return snapshot
+
+    if isinstance(value, bytearray):
+        return memoryview(bytes(value))
+    if isinstance(value, memoryview) and not value.readonly:
+        snapshot = memoryview(value.tobytes())
+        try:
+            return snapshot.cast(value.format, value.shape)
+        except (TypeError, ValueError):
+            return snapshot
+    return value
+
+
+def _read_only_buffer(value):
+    if isinstance(value, (bytes, str)):
+        return value
+
+    if _is_array(value):
+        # numpy arrays keep their type as a read-only view of the same data
+        view = value.view()
+        view.flags.writeable = False
+        return view
+
+    if isinstance(value, (bytearray, memoryview)):
+        view = memoryview(value)
+        if hasattr(view, 'toreadonly'):
+            return view.toreadonly()
+    return value
+
+
+def _is_array(value):
+    return hasattr(getattr(value, 'flags', None), 'writeable') and hasattr(value, 'view')
+
+
+def _fingerprint(value):
+    try:
+        view = memoryview(value)
+    except TypeError:
+        pass
+    else:
+        if view.c_contiguous:
+            return hashlib.sha1(view.cast('B')).digest()
+
+    try:
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        data = repr(value).encode('utf-8', 'replace')
+    return hashlib.sha1(data).digest()
@@ -1,11 +1,42 @@
-from datetime import datetime
+from copy import deepcopy
+from datetime import datetime, timedelta
 import sys
+import time
+import traceback
+
+
+if sys.version_info >= (3, 7):
+    from time import perf_counter_ns
+
+    # thread CPU time isn't skewed by other threads, but isn't available everywhere
+    cpu_time_ns = getattr(time, 'thread_time_ns', time.process_time_ns)
+    wall_time_ns = time.time_ns
+else:
+    _perf_counter = getattr(time, 'perf_counter', time.time)
+    _process_time = getattr(time, 'process_time', time.clock)
+
+    def perf_counter_ns():
+        return int(_perf_counter() * 1e9)
+
+    def cpu_time_ns():
+        return int(_process_time() * 1e9)
+
+    def wall_time_ns():
+        return int(time.time() * 1e9)
+
+
+# used to convert perf_counter_ns() readings into wall clock datetimes
+_perf_counter_epoch_ns = wall_time_ns() - perf_counter_ns()
 
 
 class _Unrecorded(object):
     def __repr__(self):
         return "Unrecorded"
 
+    def __reduce__(self):
+        # unpickle as the module's singleton
+        return 'unrecorded'
+
 
 unrecorded = _Unrecorded()
 
@@ -19,45 +50,162 @@ class Observation(object):
     :ivar Exception exception: exception raised, if any
     :ivar exc_info: result of sys.exc_info(), if exception raised
     :ivar value: function return value
+    :ivar int start_ns: :func:`time.perf_counter_ns` reading when the function was called
+    :ivar int end_ns: :func:`time.perf_counter_ns` reading when the function returned
+    :ivar int cpu_ns: CPU time used by the function in nanoseconds, if recorded
+    :ivar Profile profile: measurements taken by the experiment's profiler, if any
+    :ivar tuple mutations: positions and names of the arguments the function
+     changed, if the experiment checked for mutation
+
+    Context is layered: experiment-wide context, observation-specific context,
+    and anything added with :meth:`update_context`. The experiment's context
+    dict is copied (shallowly) once when the experiment runs, and shared by that
+    run's observations. The layers are only merged and deep copied when
+    :meth:`get_context` is first called, so observations that are never asked
+    for their context never pay to copy it.
+
+    Observations can be pickled, e.g. to return them from another process. The
+    traceback can't be, so it's kept formatted as a string for
+    :meth:`format_exception` and the third item of ``exc_info`` becomes None.
     '''
 
-    def __init__(self, name, context=None):
+    __slots__ = (
+        'name', 'failure', 'exception', 'exc_info', 'value',
+        'start_ns', 'end_ns', 'cpu_ns', 'profile', 'mutations',
+        '_experiment_context', '_observation_context', '_updates', '_context',
+        '_formatted_exception',
+    )
+
+    def __init__(self, name, context=None, experiment_context=None):
         self.name = name
         self.failure = False
         self.exception = None
         self.exc_info = None
-        self.context = context or {}
         self.value = unrecorded
 
+        self.start_ns = None
+        self.end_ns = None
+        self.cpu_ns = None
+        self.profile = None
+        self.mutations = None
+
+        self._experiment_context = experiment_context
+        self._observation_context = context
+        self._updates = None
+        self._context = None
+        self._formatted_exception = None
+
     def record(self, value):
         self.value = value
 
-    def set_start_time(self):
-        self.start_time = datetime.now()
+    def set_start_time(self, cpu_time=False):
+        '''
+        :param bool cpu_time: also start measuring CPU time
+        '''
+        if cpu_time:
+            self.cpu_ns = cpu_time_ns()
+        self.start_ns = perf_counter_ns()
 
     def set_end_time(self):
-        self.end_time = datetime.now()
+        self.end_ns = perf_counter_ns()
+        if self.cpu_ns is not None:
+            self.cpu_ns = cpu_time_ns() - self.cpu_ns
 
     @property
     def duration(self):
+        '''
+        How long the function took to execute, in nanoseconds
+
+        :rtype: int
+        '''
+        return self.end_ns - self.start_ns
+
+    @property
+    def duration_timedelta(self):
         '''
         How long the function took to execute
 
         :rtype: timedelta
         '''
-        return self.end_time - self.start_time
+        return timedelta(microseconds=self.duration / 1000.0)
 
-    def set_exception(self, exception):
+    @property
+    def start_time(self):
+        '''
+        When the function was called
+
+        :rtype: datetime
+        '''
+        return _to_datetime(self.start_ns)
+
+    @property
+    def end_time(self):
+        '''
+        When the function returned
+
+        :rtype: datetime
+        '''
+        return _to_datetime(self.end_ns)
+
+    def set_exception(self, exception, exc_info=None):
         self.failure = True
         self.exception = exception
-        self.exc_info = sys.exc_info()
+        self.exc_info = exc_info or sys.exc_info()
+
+    def format_exception(self):
+        '''
+        :return string: the exception and its traceback, formatted as Python
+            would print them, or None if the function didn't raise
+        '''
+        if self._formatted_exception is None and self.exc_info is not None:
+            return ''.join(traceback.format_exception(*self.exc_info))
+        return self._formatted_exception
+
+    @property
+    def context(self):
+        return self.get_context()
 
     def get_context(self):
         '''Return observation-specific context'''
-        return self.context
+        if self._context is None:
+            ctx = deepcopy(self._experiment_context) if self._experiment_context else {}
+            if self._observation_context:
+                ctx.update(self._observation_context)
+            if self._updates:
+                ctx.update(self._updates)
+            self._context = ctx
+        return self._context
+
+    def get_context_value(self, key, default=None):
+        '''
+        Look up a single context value without merging the context layers.
+        The value is not copied, so it must not be mutated.
+        '''
+        if self._context is not None:
+            return self._context.get(key, default)
+        for layer in (self._updates, self._observation_context, self._experiment_context):
+            if layer and key in layer:
+                return layer[key]
+        return default
 
     def update_context(self, context):
-        self.context.update(context)
+        if self._context is not None:
+            self._context.update(context)
+        elif self._updates is None:
+            self._updates = dict(context)
+        else:
+            self._updates.update(context)
+
+    def __getstate__(self):
+        state = dict((slot, getattr(self, slot)) for slot in self.__slots__)
+        if self.exc_info is not None and self.exc_info[2] is not None:
+            state['_formatted_exception'] = self.format_exception()
+            state['exc_info'] = (self.exc_info[0], self.exc_info[1], None)
+        return state
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
 
     def __repr__(self):
         repr = "Observation(name={name!r}".format(name=self.name)
@@ -66,3 +214,7 @@ class Observation(object):
             repr += ", exception={exception!r}".format(exception=self.exception)
         repr += ")"
         return repr
+
+
+def _to_datetime(ns):
+    return datetime.fromtimestamp((_perf_counter_epoch_ns + ns) / 1e9)
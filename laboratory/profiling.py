@@ -0,0 +1,167 @@
+import gc
+import random
+import sys
+import threading
+
+from laboratory.observation import perf_counter_ns
+
+
+class Profile(object):
+    '''
+    Measurements taken while a function ran, attached to its observation as
+    :attr:`Observation.profile`. Measurements that weren't taken are None.
+
+    :ivar int memory_delta: change in memory traced by :mod:`tracemalloc`, in bytes
+    :ivar int memory_peak: peak traced memory above what was traced when the
+     function was called, in bytes
+    :ivar int allocated_blocks: change in the number of memory blocks allocated
+     by the interpreter
+    :ivar int gc_collections: garbage collections run on the function's thread
+    :ivar int gc_ns: time spent in those collections, in nanoseconds
+    :ivar list stats: ``(function, calls, total_time, cumulative_time)`` tuples
+     for the functions with the most cumulative time, if the run was profiled
+     with :mod:`cProfile`. Times are in seconds
+    '''
+
+    __slots__ = (
+        'memory_delta', 'memory_peak', 'allocated_blocks', 'gc_collections',
+        'gc_ns', 'stats',
+    )
+
+    def __init__(self):
+        self.memory_delta = None
+        self.memory_peak = None
+        self.allocated_blocks = None
+        self.gc_collections = None
+        self.gc_ns = None
+        self.stats = None
+
+    def to_dict(self):
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__)
+
+    def __repr__(self):
+        return 'Profile(%s)' % ', '.join(
+            '%s=%r' % (slot, getattr(self, slot))
+            for slot in self.__slots__ if getattr(self, slot) is not None
+        )
+
+
+class Profiler(object):
+    '''
+    Takes measurements while control and candidate functions run. Pass a
+    profiler to an experiment with ``Experiment(profiler=...)`` and each
+    observation will have a :class:`Profile`.
+
+    Memory and garbage collection are measured process-wide, so concurrent
+    threads or tasks affect each other's figures. Tracing memory slows every
+    allocation in the process, so it's off by default; :mod:`tracemalloc` is
+    started the first time it's needed and left running.
+    '''
+
+    def __init__(self, memory=False, gc=True, sample=0.0, limit=20):
+        '''
+        :param bool memory: measure memory use with :mod:`tracemalloc`
+        :param bool gc: measure garbage collection
+        :param float sample: fraction of runs, from 0 to 1, to profile with :mod:`cProfile`
+        :param int limit: number of functions to keep from each cProfile run
+        '''
+        self.memory = memory
+        self.gc = gc
+        self.sample = sample
+        self.limit = limit
+
+    def start(self):
+        '''
+        Start measuring. Called just before a function is called.
+
+        :return: state to pass to :meth:`stop`
+        '''
+        gc_state = memory_state = profile = None
+
+        if self.gc:
+            _install_gc_callback()
+            gc_state = (getattr(_gc_local, 'collections', 0), getattr(_gc_local, 'ns', 0))
+
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            memory_state = (tracemalloc.get_traced_memory()[0], sys.getallocatedblocks())
+
+        if self.sample and random.random() < self.sample:
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler is active on this thread
+                profile = None
+
+        return gc_state, memory_state, profile
+
+    def stop(self, state):
+        '''
+        Stop measuring. Called as soon as the function returns or raises.
+
+        :rtype: Profile
+        '''
+        gc_state, memory_state, profile = state
+        if profile is not None:
+            profile.disable()
+
+        result = Profile()
+        if memory_state is not None:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            result.memory_delta = current - memory_state[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                result.memory_peak = max(peak - memory_state[0], 0)
+            result.allocated_blocks = sys.getallocatedblocks() - memory_state[1]
+
+        if gc_state is not None:
+            result.gc_collections = getattr(_gc_local, 'collections', 0) - gc_state[0]
+            result.gc_ns = getattr(_gc_local, 'ns', 0) - gc_state[1]
+
+        if profile is not None:
+            result.stats = _summarise(profile, self.limit)
+
+        return result
+
+
+_gc_local = threading.local()
+_gc_installed = False
+_gc_lock = threading.Lock()
+
+
+def _gc_callback(phase, info):
+    if phase == 'start':
+        _gc_local.started = perf_counter_ns()
+        return
+    started = getattr(_gc_local, 'started', None)
+    if started is not None:
+        _gc_local.ns = getattr(_gc_local, 'ns', 0) + perf_counter_ns() - started
+        _gc_local.collections = getattr(_gc_local, 'collections', 0) + 1
+        _gc_local.started = None
+
+
+def _install_gc_callback():
+    global _gc_installed
+    if not _gc_installed:
+        with _gc_lock:
+            if _gc_callback not in gc.callbacks:
+                gc.callbacks.append(_gc_callback)
+            _gc_installed = True
+
+
+def _summarise(profile, limit):
+    import pstats
+
+    stats = pstats.Stats(profile).stats
+    rows = [
+        ('%s:%d(%s)' % function, calls, total, cumulative)
+        for function, (_, calls, total, cumulative, _) in stats.items()
+    ]
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows[:limit]
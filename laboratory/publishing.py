@@ -0,0 +1,330 @@
+import atexit
+from collections import deque
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from laboratory.concurrency import _after_fork
+from laboratory.stats import Counter
+
+
+logger = logging.getLogger(__name__)
+
+
+def result_to_dict(result):
+    '''
+    Convert a :class:`Result` into a dict of basic types, suitable for
+    serialising. Observation values are included as-is.
+
+    :rtype: dict
+    '''
+    return {
+        'experiment': result.experiment.name,
+        'match': result.match,
+        'unknown': result.unknown,
+        'control': observation_to_dict(result.control),
+        'candidates': [observation_to_dict(obs) for obs in result.candidates],
+        'state_changes': [change._asdict() for change in result.state_changes],
+    }
+
+
+def observation_to_dict(observation):
+    '''
+    Convert an :class:`Observation` into a dict of basic types.
+
+    :rtype: dict
+    '''
+    return {
+        'name': observation.name,
+        'value': observation.value,
+        'exception': repr(observation.exception) if observation.failure else None,
+        'duration': observation.duration,
+        'profile': observation.profile.to_dict() if observation.profile is not None else None,
+        'mutations': observation.mutations,
+        'context': observation.get_context(),
+    }
+
+
+class BufferedPublisher(object):
+    '''
+    Buffers results in memory and writes them to one or more sinks in batches,
+    from a background thread. A batch is written once ``batch_size`` results have
+    been buffered or ``flush_interval`` seconds have passed, whichever is first.
+
+    When the buffer is full new results are dropped, or if ``block`` is set,
+    the publishing thread waits for space for up to ``block_timeout`` seconds.
+
+    :ivar Counter published: number of results buffered
+    :ivar Counter dropped: number of results dropped because the buffer was full,
+     or because they were published after :meth:`close`
+    '''
+
+    def __init__(self, sinks, batch_size=100, flush_interval=1.0, maxsize=10000,
+                 block=False, block_timeout=None):
+        '''
+        :param list sinks: sinks to write batches of results to
+        :param int batch_size: number of results to buffer before writing
+        :param float flush_interval: maximum seconds to buffer results for
+        :param int maxsize: maximum number of buffered results
+        :param bool block: wait for space when the buffer is full instead of dropping
+        :param float block_timeout: maximum seconds to wait for space
+        '''
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self.block = block
+        self.block_timeout = block_timeout
+
+        self.published = Counter()
+        self.dropped = Counter()
+
+        self._buffer = deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        self._pid = None
+
+        atexit.register(self.close)
+        _after_fork(self, '_reset')
+
+    def publish(self, result):
+        '''
+        Buffer ``result`` to be written to the sinks.
+
+        Candidates are compared with the control first, on the caller's thread.
+        Once ``conduct()`` has returned the caller may change the control's
+        value, which would make a comparison on the publisher's thread wrong.
+
+        :return bool: whether the result was buffered
+        '''
+        result.comparisons
+        if self._pid != os.getpid():
+            self._start()
+
+        with self._condition:
+            if self.block and len(self._buffer) >= self.maxsize:
+                self._wait_for_space()
+            # nothing is written once closed, so later results are dropped too
+            if self._closed or len(self._buffer) >= self.maxsize:
+                self.dropped.increment()
+                return False
+            self._buffer.append(result)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify_all()
+
+        self.published.increment()
+        return True
+
+    def flush(self):
+        '''
+        Write everything buffered to the sinks from the calling thread.
+        '''
+        with self._condition:
+            batch = self._drain()
+        self._write(batch)
+
+    def close(self):
+        '''
+        Stop the background thread, flush, and close the sinks.
+        '''
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self.flush()
+
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception:
+                logger.exception('Exception occured when closing %r' % sink)
+
+    def _wait_for_space(self):
+        # must be called with the condition held. Condition.wait_for isn't
+        # available on python 2
+        deadline = None
+        if self.block_timeout is not None:
+            deadline = time.time() + self.block_timeout
+        while not self._closed and len(self._buffer) >= self.maxsize:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return
+            self._condition.wait(timeout)
+
+    def _drain(self):
+        # must be called with the condition held
+        batch = list(self._buffer)
+        self._buffer.clear()
+        self._condition.notify_all()
+        return batch
+
+    def _start(self):
+        # threads do not survive a fork, so start one again in the child
+        with self._condition:
+            if self._pid == os.getpid() or self._closed:
+                return
+            self._thread = threading.Thread(target=self._run, name='laboratory-publisher')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _reset(self):
+        # in a forked child the buffered results are the parent's to write,
+        # and the locks may be held by threads which no longer exist. The
+        # child starts with an empty buffer, so neither its publisher thread
+        # nor the close() registered with atexit writes the parent's results
+        self._buffer = deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+                batch = self._drain()
+            self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._write_lock:
+            for sink in self.sinks:
+                try:
+                    sink.write(batch)
+                except Exception:
+                    logger.exception('Exception occured when writing to %r' % sink)
+
+
+class Sink(object):
+    '''
+    Base class for :class:`BufferedPublisher` sinks.
+    '''
+
+    def write(self, results):
+        '''
+        Write a batch of results.
+
+        :param list results: :class:`Result` instances
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        return
+
+
+class CallbackSink(Sink):
+    '''
+    Calls a function with each batch of results.
+    '''
+
+    def __init__(self, callback):
+        '''
+        :param callable callback: called with a list of :class:`Result` instances
+        '''
+        self.callback = callback
+
+    def write(self, results):
+        self.callback(results)
+
+
+class JSONLinesSink(Sink):
+    '''
+    Appends results to a file as JSON, one result per line.
+    Values which can't be serialised are written as their ``repr()``.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param string path: file to append to
+        '''
+        self.path = path
+        self._file = open(path, 'a')
+
+    def write(self, results):
+        lines = [
+            json.dumps(result_to_dict(result), default=repr) + '\n'
+            for result in results
+        ]
+        self._file.write(''.join(lines))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class StatsdSink(Sink):
+    '''
+    Sends match counts and timings to a statsd server over UDP, packing as many
+    metrics into each packet as will fit.
+
+    For an experiment named ``auth`` this sends:
+
+    - ``<prefix>.auth.match`` or ``<prefix>.auth.mismatch`` counts, or
+      ``<prefix>.auth.unknown`` if a comparison timed out and none mismatched
+    - ``<prefix>.auth.<observation name>`` timings, in milliseconds
+    - ``<prefix>.auth.<observation name>.exception`` counts
+    '''
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='laboratory', packet_size=512):
+        '''
+        :param string host: statsd host
+        :param int port: statsd port
+        :param string prefix: prefix for every metric name
+        :param int packet_size: maximum bytes to send in a single packet
+        '''
+        self.address = (host, port)
+        self.prefix = prefix
+        self.packet_size = packet_size
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write(self, results):
+        packet = b''
+        for metric in self._metrics(results):
+            if packet and len(packet) + len(metric) + 1 > self.packet_size:
+                self._send(packet)
+                packet = b''
+            packet = packet + b'\n' + metric if packet else metric
+        if packet:
+            self._send(packet)
+
+    def close(self):
+        self._socket.close()
+
+    def _metrics(self, results):
+        for result in results:
+            name = '%s.%s' % (self.prefix, result.experiment.name)
+            if not result.match:
+                outcome = 'mismatch'
+            elif result.unknown:
+                outcome = 'unknown'
+            else:
+                outcome = 'match'
+            yield ('%s.%s:1|c' % (name, outcome)).encode('utf-8')
+
+            for obs in [result.control] + list(result.candidates):
+                metric = '%s.%s' % (name, obs.name)
+                yield ('%s:%.3f|ms' % (metric, obs.duration / 1e6)).encode('utf-8')
+                if obs.failure:
+                    yield ('%s.exception:1|c' % metric).encode('utf-8')
+
+    def _send(self, packet):
+        try:
+            self._socket.sendto(packet, self.address)
+        except socket.error:
+            logger.exception('Exception occured when sending metrics to statsd')
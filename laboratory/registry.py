@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import threading
+
+from laboratory.stats import Counter
+
+
+logger = logging.getLogger(__name__)
+
+
+class Registration(object):
+    '''
+    Live statistics and runtime overrides for every experiment of one name.
+    Experiments created per call share their name's registration.
+
+    :ivar string name: experiment name
+    :ivar Counter calls: calls to ``conduct()``
+    :ivar Counter sampled: calls which ran candidates, or recorded the run
+    :ivar Counter mismatches: candidates found not to match the control. Counted
+     as results are compared, so results which are never compared aren't counted
+    :ivar Counter candidate_ns: nanoseconds spent running candidates
+    :ivar bool enabled: overrides ``enabled()`` if set. None leaves it to the
+     experiment
+    :ivar float percentage: overrides the experiment's sampler if set, sampling
+     this percentage of runs at random. None leaves it to the experiment
+    :ivar bool forgotten: the registry was reset after this was registered, so
+     experiments look their name up again
+    '''
+
+    __slots__ = (
+        'name', 'calls', 'sampled', 'mismatches', 'candidate_ns', 'enabled', 'percentage',
+        'forgotten',
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = Counter()
+        self.sampled = Counter()
+        self.mismatches = Counter()
+        self.candidate_ns = Counter()
+        self.enabled = None
+        self.percentage = None
+        self.forgotten = False
+
+    def record(self, result):
+        '''
+        Count the time spent running a result's candidates, unless they were
+        reused from a cache rather than run.
+        '''
+        if result.cached:
+            return
+        self.candidate_ns.increment(sum(
+            candidate.duration for candidate in result.candidates
+            if candidate.end_ns is not None
+        ))
+
+    def to_dict(self):
+        return {
+            'calls': self.calls.value,
+            'sampled': self.sampled.value,
+            'mismatches': self.mismatches.value,
+            'candidate_ns': self.candidate_ns.value,
+            'enabled': self.enabled,
+            'percentage': self.percentage,
+        }
+
+    def __repr__(self):
+        return 'Registration(%r, calls=%s, sampled=%s)' % (
+            self.name, self.calls.value, self.sampled.value,
+        )
+
+
+class Registry(object):
+    '''
+    Keeps a :class:`Registration` for each experiment name. Every experiment
+    registers with :data:`registry` when it's created, so experiments can be
+    listed, inspected, and turned off or sampled differently while the process
+    runs.
+
+    Experiments keep a reference to their registration, so the cost on each
+    call is reading its overrides and incrementing its counters. They look
+    their name up again once the registry is reset.
+    '''
+
+    def __init__(self):
+        self._registrations = {}
+        self._lock = threading.Lock()
+        self._watched = None
+
+    def register(self, name):
+        '''
+        :param string name: experiment name
+        :rtype: Registration
+        '''
+        registration = self._registrations.get(name)
+        if registration is None:
+            with self._lock:
+                registration = self._registrations.get(name)
+                if registration is None:
+                    registration = self._registrations[name] = Registration(name)
+        return registration
+
+    def get(self, name):
+        '''
+        :return Registration: the registration for ``name``, or None if no
+            experiment of that name has been created
+        '''
+        return self._registrations.get(name)
+
+    def names(self):
+        return sorted(self._registrations)
+
+    def snapshot(self):
+        '''
+        :return dict: statistics and overrides of each experiment, keyed by name
+        '''
+        return dict(
+            (name, registration.to_dict())
+            for name, registration in list(self._registrations.items())
+        )
+
+    def enable(self, name):
+        '''
+        Run ``name``'s candidates whatever its ``enabled()`` returns.
+        '''
+        self.register(name).enabled = True
+
+    def disable(self, name):
+        '''
+        Only call ``name``'s control, whatever its ``enabled()`` returns.
+        '''
+        self.register(name).enabled = False
+
+    def set_percentage(self, name, percentage):
+        '''
+        Sample ``percentage`` of ``name``'s runs instead of using its sampler.
+
+        :param float percentage: from 0 to 100, or None to use the sampler again
+        '''
+        self.register(name).percentage = percentage
+
+    def clear_overrides(self, name=None):
+        '''
+        Leave ``name``, or every experiment, to decide whether it's enabled and
+        sampled again.
+        '''
+        for registration in list(self._registrations.values()):
+            if name is None or registration.name == name:
+                registration.enabled = None
+                registration.percentage = None
+
+    def load(self, path):
+        '''
+        Set overrides from a JSON file of ``{"name": {"enabled": bool,
+        "percentage": float}}``. Either key may be left out, or null. Overrides
+        of experiments not in the file are cleared, so the file describes every
+        override.
+
+        :param string path: JSON file to read
+        '''
+        with open(path) as f:
+            overrides = json.load(f)
+
+        for registration in list(self._registrations.values()):
+            if registration.name not in overrides:
+                registration.enabled = None
+                registration.percentage = None
+        for name, override in overrides.items():
+            registration = self.register(name)
+            registration.enabled = override.get('enabled')
+            registration.percentage = override.get('percentage')
+
+    def watch(self, path, interval=5.0):
+        '''
+        Load overrides from ``path`` now, and again whenever it's modified,
+        checking every ``interval`` seconds on laboratory's scheduler thread.
+        Replaces any file watched before.
+
+        :param string path: JSON file, see :meth:`load`
+        :param float interval: seconds between checks
+        '''
+        from laboratory.concurrency import scheduler
+
+        watched = self._watched = [path, None]
+
+        def check():
+            if self._watched is not watched:
+                return
+            try:
+                mtime = os.stat(path).st_mtime
+                if mtime != watched[1]:
+                    self.load(path)
+                    watched[1] = mtime
+            except Exception:
+                logger.exception('Exception occured when loading experiment overrides from %s' % path)
+            scheduler.schedule(interval, check)
+
+        check()
+
+    def unwatch(self):
+        '''
+        Stop watching the file passed to :meth:`watch`.
+        '''
+        self._watched = None
+
+    def reload_on_signal(self, path, signum=None):
+        '''
+        Load overrides from ``path`` when the process receives ``signum``. Must
+        be called from the main thread.
+
+        :param string path: JSON file, see :meth:`load`
+        :param int signum: signal to reload on, ``SIGHUP`` by default
+        '''
+        import signal
+
+        def handler(signum, frame):
+            try:
+                self.load(path)
+            except Exception:
+                logger.exception('Exception occured when loading experiment overrides from %s' % path)
+
+        signal.signal(signal.SIGHUP if signum is None else signum, handler)
+
+    def reset(self):
+        '''
+        Forget every registration and its counts and overrides. Experiments
+        already created register again the next time they're used.
+        '''
+        with self._lock:
+            registrations, self._registrations = self._registrations, {}
+        for registration in registrations.values():
+            registration.forgotten = True
+
+
+#: The process-wide registry experiments register with
+registry = Registry()
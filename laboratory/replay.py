@@ -0,0 +1,248 @@
+import atexit
+from collections import deque
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+
+from laboratory.concurrency import _after_fork
+from laboratory.stats import Counter
+
+
+logger = logging.getLogger(__name__)
+
+_header = struct.Struct('>I')
+
+
+class Recorder(object):
+    '''
+    Records the arguments and control observation of experiment runs to an
+    append-only log, so that candidates can be run against them later with
+    :func:`replay` instead of on the serving path.
+
+    Pass a recorder to an experiment with ``Experiment(recorder=...)``. Sampled
+    runs then call only the control, and write a record of the run. Each record
+    is a pickle, prefixed with its length as a 4-byte big-endian integer.
+
+    Records are buffered; call :meth:`flush` or :meth:`close` to write them
+    out. Recorders are closed when the process exits. Buffered records are
+    written whole with a single write to the file opened for appending, so
+    processes such as the workers of a pre-forking server can share a log. A
+    forked child discards the records its parent had buffered.
+
+    :ivar Counter recorded: number of runs recorded
+    :ivar Counter dropped: number of runs that couldn't be pickled
+    '''
+
+    def __init__(self, path, buffer_size=1 << 16):
+        '''
+        :param string path: log file, appended to if it exists
+        :param int buffer_size: bytes to buffer before writing to the file
+        '''
+        self.path = path
+        self.buffer_size = buffer_size
+        self.recorded = Counter()
+        self.dropped = Counter()
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pending = []
+        self._pending_bytes = 0
+        atexit.register(self.close)
+        _after_fork(self, '_reset')
+
+    def record(self, experiment, args, kwargs, control):
+        '''
+        :param Experiment experiment: the experiment that ran
+        :param args: positional arguments the control was called with
+        :param dict kwargs: keyword arguments the control was called with
+        :param Observation control: the control's observation
+        '''
+        try:
+            data = pickle.dumps({
+                'experiment': experiment.name,
+                'args': args,
+                'kwargs': kwargs,
+                'control': control,
+            }, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            self.dropped.increment()
+            msg = 'Exception occured when recording %s experiment'
+            logger.exception(msg % experiment.name)
+            return
+
+        record = _header.pack(len(data)) + data
+        with self._lock:
+            self._pending.append(record)
+            self._pending_bytes += len(record)
+            if self._pending_bytes >= self.buffer_size:
+                self._write()
+        self.recorded.increment()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def close(self):
+        with self._lock:
+            self._write()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def _write(self):
+        # must be called with the lock held. Writes to a file opened with
+        # O_APPEND go to its end as one piece, so records aren't interleaved
+        # with those of other processes
+        if not self._pending:
+            return
+        data = memoryview(b''.join(self._pending))
+        self._pending = []
+        self._pending_bytes = 0
+        if self._fd is None:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+            self._fd = os.open(self.path, flags, 0o644)
+        while data:
+            data = data[os.write(self._fd, data):]
+
+    def _reset(self):
+        # in a forked child the buffered records are the parent's to write, and
+        # the lock may be held by a thread which no longer exists. The child
+        # keeps appending to the file through the descriptor it inherited
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_bytes = 0
+
+
+def read_log(path):
+    '''
+    Read the records written by a :class:`Recorder`. The log is memory mapped
+    and records are unpickled one at a time. A record left incomplete by a
+    crash, at the end of the log, is skipped.
+
+    :param string path: log file
+    :return: an iterator of record dicts with ``experiment``, ``args``,
+        ``kwargs`` and ``control`` keys
+    '''
+    with _open_log(path) as log:
+        for offset, length in _index(log):
+            yield pickle.loads(log[offset:offset + length])
+
+
+def replay(experiment, path, processes=None, batch_size=100):
+    '''
+    Run an experiment's candidates against the runs recorded in a log, and
+    conclude each as if the candidates had run alongside the control: values
+    are compared, and results are recorded and passed to ``publish()``.
+    Only runs recorded by an experiment of the same name are replayed.
+
+    Candidates are run in batches on a pool of worker processes, so candidate
+    functions must be picklable. Results are concluded in the calling process
+    in the order they were recorded.
+
+    :param Experiment experiment: experiment with the candidates to run
+    :param string path: log written by a :class:`Recorder`
+    :param int processes: number of worker processes. Defaults to the number
+        of CPUs. With 0, candidates are run in the calling process
+    :param int batch_size: number of runs sent to a worker at a time
+    :return int: number of runs replayed
+    '''
+    candidates = list(experiment._candidates)
+    batches = _batches(path, batch_size)
+    args = (path, experiment.name, candidates, experiment.cpu_time, experiment.profiler)
+
+    replayed = 0
+    if processes == 0:
+        for batch in batches:
+            replayed += _conclude_batch(experiment, candidates, _replay_batch(batch, *args))
+        return replayed
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # a few batches are queued per worker to keep them busy, without
+        # reading the whole log ahead of the results
+        pending = deque()
+        for batch in batches:
+            if len(pending) >= processes * 2:
+                replayed += _conclude_batch(experiment, candidates, pending.popleft().result())
+            pending.append(executor.submit(_replay_batch, batch, *args))
+        while pending:
+            replayed += _conclude_batch(experiment, candidates, pending.popleft().result())
+    return replayed
+
+
+def _conclude_batch(experiment, candidates, runs):
+    for control, observations in runs:
+        # context isn't sent back from workers, so it's restored here
+        for cand, obs in zip(candidates, observations):
+            obs._experiment_context = control._experiment_context
+            obs._observation_context = cand['context']
+        experiment._conclude(control, observations)
+    return len(runs)
+
+
+def _replay_batch(offsets, path, name, candidates, cpu_time, profiler):
+    # runs in a worker process, which reads its records from the log itself
+    from laboratory.experiment import _observe
+
+    runs = []
+    with _open_log(path) as log:
+        for offset, length in offsets:
+            record = pickle.loads(log[offset:offset + length])
+            if record['experiment'] != name:
+                continue
+            args, kwargs = record['args'], record['kwargs']
+            observations = [
+                _observe(
+                    cand['func'], args, kwargs, cand['name'], None, None, False,
+                    cpu_time, profiler,
+                )
+                for cand in candidates
+            ]
+            runs.append((record['control'], observations))
+    return runs
+
+
+def _batches(path, batch_size):
+    batch = []
+    with _open_log(path) as log:
+        for record in _index(log):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _index(log):
+    offset, size = 0, len(log)
+    while offset + _header.size <= size:
+        length, = _header.unpack_from(log, offset)
+        offset += _header.size
+        if offset + length > size:
+            logger.warning('Skipping incomplete record at the end of the log')
+            return
+        yield offset, length
+        offset += length
+
+
+class _open_log(object):
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._file = open(self.path, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._map = b''
+        else:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def __exit__(self, *exc_info):
+        if not isinstance(self._map, bytes):
+            self._map.close()
+        self._file.close()
@@ -1,21 +1,122 @@
 
+from laboratory.comparators import _timed_out
+
+
 class Result(object):
     '''
     :ivar Experiment experiment: The experiment instance that recorded this Result
     :ivar Observation control: The control observation
     :ivar [Observation] candidates: A list of candidate observations
-    :ivar bool match: Whether all candidates match the control case
+    :ivar list state_changes: :class:`~laboratory.breaker.StateChange` for each
+     candidate circuit that changed state, if the experiment has a circuit breaker
+    :ivar bool cached: the candidates weren't run; their observations and
+     comparisons were reused from the experiment's cache
+
+    Candidates are compared with the control lazily, the first time they're needed
+    by :attr:`match` or :attr:`mismatches`, and each comparison is only made once.
+    If nothing reads them (e.g. a publisher that is sampling), ``compare()`` is
+    never called. Comparisons read the control's value, which the caller may
+    change once ``conduct()`` has returned, so a publisher that hands results to
+    another thread should read :attr:`comparisons` before doing so.
+
+    When the experiment has ``raise_on_mismatch`` set, comparisons are made
+    straight away so that mismatches are raised from ``conduct()``. Results
+    concluded off the caller's thread are built with ``raise_on_mismatch=False``.
     '''
 
-    def __init__(self, experiment, control, candidates):
+    __slots__ = ('experiment', 'control', 'candidates', 'state_changes', 'cached', '_matches')
+
+    def __init__(self, experiment, control, candidates, matches=None, raise_on_mismatch=None):
         self.experiment = experiment
         self.control = control
         self.candidates = candidates
+        self.state_changes = []
+        self.cached = matches is not None
+        self._matches = list(matches) if matches is not None else [None] * len(candidates)
+
+        if raise_on_mismatch is None:
+            raise_on_mismatch = experiment.raise_on_mismatch
+        if raise_on_mismatch:
+            self.match
+
+    @property
+    def match(self):
+        '''
+        Whether all candidates match the control case. Stops comparing at the
+        first candidate that doesn't match. Candidates whose comparison timed
+        out aren't known not to match, so don't make this False; see
+        :attr:`unknown`.
+
+        :rtype: bool
+        '''
+        for index in range(len(self.candidates)):
+            if not self._compare(index):
+                return False
+        return True
+
+    @property
+    def mismatches(self):
+        '''
+        Candidates that do not match the control case, keyed by observation name.
+
+        :rtype: dict
+        '''
+        return dict(
+            (candidate.name, candidate)
+            for index, candidate in enumerate(self.candidates)
+            if not self._compare(index)
+        )
+
+    @property
+    def unknown(self):
+        '''
+        Names of the candidates whose comparison with the control timed out, so
+        it isn't known whether they match.
+
+        :rtype: list
+        '''
+        return [
+            candidate.name
+            for index, candidate in enumerate(self.candidates)
+            if _timed_out(self._compare(index))
+        ]
+
+    @property
+    def comparisons(self):
+        '''
+        The outcome of comparing each candidate with the control, in the same
+        order as :attr:`candidates`. Each is a bool, or a
+        :class:`~laboratory.comparators.Comparison` if the experiment has a
+        ``comparator``.
+
+        :rtype: list
+        '''
+        return [self._compare(index) for index in range(len(self.candidates))]
+
+    @property
+    def mutations(self):
+        '''
+        Arguments changed by each function, keyed by observation name, for the
+        functions which changed any. Empty unless the experiment's isolation
+        policy detects mutation.
+
+        :rtype: dict
+        '''
+        return dict(
+            (observation.name, observation.mutations)
+            for observation in [self.control] + self.candidates
+            if observation.mutations
+        )
 
-        self.match = all([
-            self.experiment.compare(self.control, o)
-            for o in self.candidates
-        ])
+    def _compare(self, index):
+        match = self._matches[index]
+        if match is None:
+            match = self._matches[index] = self.experiment.compare(
+                self.control, self.candidates[index],
+            )
+            if not match:
+                self.experiment._registration.mismatches.increment()
+        return match
 
     def __repr__(self):
         return "Result(match={}, control={!r}, candidates={!r})".format(
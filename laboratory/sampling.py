@@ -0,0 +1,348 @@
+from collections import deque, namedtuple
+import logging
+import random
+import threading
+import zlib
+
+from laboratory.observation import perf_counter_ns
+from laboratory.stats import Counter, Histogram
+
+
+logger = logging.getLogger(__name__)
+
+
+INCREASE = 'increase'
+DECREASE = 'decrease'
+HOLD = 'hold'
+
+
+class Decision(namedtuple('Decision', 'action previous percentage inflation sampled unsampled')):
+    '''
+    An :class:`OverheadGovernor` changed, or kept, the percentage of runs it samples.
+
+    :ivar string action: ``increase``, ``decrease`` or ``hold``
+    :ivar float previous: the percentage sampled before
+    :ivar float percentage: the percentage sampled now
+    :ivar float inflation: how much slower calls were when sampled, at the
+     governor's percentile, e.g. ``0.05`` for 5% slower
+    :ivar int sampled: number of sampled calls measured
+    :ivar int unsampled: number of unsampled calls measured
+    '''
+
+    __slots__ = ()
+
+
+class Sampler(object):
+    '''
+    Base class for samplers, which decide whether each call to ``conduct()``
+    runs the experiment's candidates. Subclasses implement :meth:`should_sample`.
+
+    :ivar Counter sampled_in: number of runs that were sampled
+    :ivar Counter sampled_out: number of runs that were skipped
+    :ivar bool times_unsampled: the experiment times the control on runs that
+     aren't sampled, and passes the duration to :meth:`record_unsampled`
+    '''
+
+    times_unsampled = False
+
+    def __init__(self):
+        self.sampled_in = Counter()
+        self.sampled_out = Counter()
+
+    def sample(self, experiment):
+        '''
+        Decide whether to run ``experiment``'s candidates, and count the decision.
+
+        :rtype: bool
+        '''
+        if self.should_sample(experiment):
+            self.sampled_in.increment()
+            return True
+        self.sampled_out.increment()
+        return False
+
+    def should_sample(self, experiment):
+        '''
+        :param Experiment experiment: the experiment being conducted
+        :rtype: bool
+        '''
+        raise NotImplementedError
+
+    def record(self, result):
+        '''
+        Called with the :class:`Result` of each sampled run, before it is
+        published. A no-op by default.
+        '''
+        return
+
+    def record_unsampled(self, duration):
+        '''
+        Called with the duration in nanoseconds of the control on each run that
+        wasn't sampled, if :attr:`times_unsampled` is set. A no-op by default.
+        '''
+        return
+
+
+class PercentageSampler(Sampler):
+    '''
+    Samples a fixed percentage of runs at random.
+    '''
+
+    def __init__(self, percentage):
+        '''
+        :param float percentage: percentage of runs to sample, from 0 to 100
+        '''
+        super(PercentageSampler, self).__init__()
+        self.percentage = percentage
+
+    def should_sample(self, experiment):
+        return random.random() * 100 < self.percentage
+
+
+class RateLimitSampler(Sampler):
+    '''
+    Samples at most ``per_second`` runs each second using a token bucket.
+    Threads never wait on each other: a run that finds the bucket in use by
+    another thread is not sampled.
+    '''
+
+    def __init__(self, per_second, burst=None):
+        '''
+        :param float per_second: rate at which tokens are added to the bucket
+        :param float burst: size of the bucket, defaults to ``per_second``
+        '''
+        super(RateLimitSampler, self).__init__()
+        self.per_second = float(per_second)
+        self.burst = float(burst if burst is not None else max(per_second, 1))
+
+        self._tokens = self.burst
+        self._updated = perf_counter_ns()
+        self._lock = threading.Lock()
+
+    def should_sample(self, experiment):
+        if not self._lock.acquire(False):
+            return False
+        try:
+            now = perf_counter_ns()
+            elapsed = (now - self._updated) / 1e9
+            self._updated = now
+            self._tokens = min(self.burst, self._tokens + elapsed * self.per_second)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+
+class AdaptiveSampler(Sampler):
+    '''
+    Samples as many runs as possible while keeping the time spent running
+    candidates below a fraction of the time spent running the control.
+
+    The cost of an experiment is measured as the candidates' total duration
+    relative to the control's, smoothed over recent runs.
+    '''
+
+    def __init__(self, max_overhead=0.1, min_percentage=0.1, smoothing=0.05):
+        '''
+        :param float max_overhead: maximum candidate time to spend per unit of
+            control time, e.g. ``0.1`` for 10%
+        :param float min_percentage: percentage of runs to sample regardless of
+            cost, so that the cost keeps being measured
+        :param float smoothing: weight given to each new measurement
+        '''
+        super(AdaptiveSampler, self).__init__()
+        self.max_overhead = max_overhead
+        self.min_percentage = min_percentage
+        self.smoothing = smoothing
+        self.cost = None
+
+    @property
+    def percentage(self):
+        '''
+        The percentage of runs currently being sampled
+
+        :rtype: float
+        '''
+        if not self.cost:
+            return 100.0
+        percentage = 100.0 * self.max_overhead / self.cost
+        return max(self.min_percentage, min(100.0, percentage))
+
+    def should_sample(self, experiment):
+        return random.random() * 100 < self.percentage
+
+    def record(self, result):
+        control = result.control.duration
+        if control <= 0:
+            return
+        # candidates reused from a cache cost nothing this run
+        candidates = 0 if result.cached else sum(c.duration for c in result.candidates)
+        cost = candidates / float(control)
+        if self.cost is None:
+            self.cost = cost
+        else:
+            self.cost += self.smoothing * (cost - self.cost)
+
+
+class HashSampler(Sampler):
+    '''
+    Deterministically samples a percentage of runs based on a value in the
+    experiment's context, such as a user id, so that the same value is either
+    always or never sampled. Runs without the context value are not sampled.
+    '''
+
+    def __init__(self, percentage, key, salt=''):
+        '''
+        :param float percentage: percentage of values to sample, from 0 to 100
+        :param string key: the experiment context key to sample on
+        :param string salt: changes which values are sampled, so that
+            experiments don't all sample the same users
+        '''
+        super(HashSampler, self).__init__()
+        self.percentage = percentage
+        self.key = key
+        self.salt = salt
+
+    def should_sample(self, experiment):
+        value = experiment.get_context().get(self.key)
+        if value is None:
+            return False
+        digest = zlib.crc32(('%s%s' % (self.salt, value)).encode('utf-8')) & 0xffffffff
+        return digest % 10000 < self.percentage * 100
+
+
+class OverheadGovernor(Sampler):
+    '''
+    Samples as many runs as it can while keeping the latency callers see on
+    sampled runs within a budget of the latency of unsampled runs, at a
+    percentile such as p99.
+
+    Unsampled runs are timed around the control. Sampled runs are measured
+    from the start of the first function the caller waited for to the end of
+    the last: candidates are included when they ran inline, or alongside the
+    control in an ``AsyncExperiment`` that isn't run in the background. Every
+    ``interval`` seconds, once both have at least ``min_samples``
+    measurements, the governor compares them and adjusts the percentage
+    sampled: it's cut by ``decrease`` if sampled runs were slower than the
+    budget allows, and raised by ``increase`` otherwise. Measurements then
+    start again.
+
+    Each decision is logged, kept in :attr:`decisions` and passed to
+    ``on_decision``. Share a governor only between experiments of the same name,
+    as their controls should take similar time.
+
+    :ivar float percentage: the percentage of runs currently being sampled
+    :ivar deque decisions: the most recent :class:`Decision` objects
+    '''
+
+    times_unsampled = True
+
+    def __init__(self, budget=0.02, percentile=99, percentage=10.0, min_percentage=0.1,
+                 max_percentage=100.0, increase=1.0, decrease=0.5, interval=10.0,
+                 min_samples=100, on_decision=None, history=100):
+        '''
+        :param float budget: how much slower sampled runs may be, e.g. ``0.02``
+            for 2%
+        :param float percentile: percentile of latency compared, from 0 to 100
+        :param float percentage: percentage of runs to sample to begin with
+        :param float min_percentage: percentage of runs to sample however
+            expensive they are, so that the overhead keeps being measured
+        :param float max_percentage: most runs to sample
+        :param float increase: percentage points added while within budget
+        :param float decrease: fraction the percentage is multiplied by when
+            over budget
+        :param float interval: seconds between decisions
+        :param int min_samples: measurements of both sampled and unsampled runs
+            needed to decide
+        :param callable on_decision: called with each :class:`Decision`
+        :param int history: number of decisions to keep
+        '''
+        super(OverheadGovernor, self).__init__()
+        self.budget = budget
+        self.percentile = percentile
+        self.percentage = float(percentage)
+        self.min_percentage = min_percentage
+        self.max_percentage = max_percentage
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self.min_samples = min_samples
+        self.on_decision = on_decision
+        self.decisions = deque(maxlen=history)
+        self._sampled = Histogram()
+        self._unsampled = Histogram()
+        self._decide_at = perf_counter_ns() + int(interval * 1e9)
+        self._lock = threading.Lock()
+
+    def should_sample(self, experiment):
+        return random.random() * 100 < self.percentage
+
+    def record(self, result):
+        control = result.control
+        if control.failure or control.end_ns is None:
+            return
+
+        # the caller waited for candidates that ran inline, or alongside the
+        # control without being left to the background
+        experiment = result.experiment
+        waited = [control]
+        if (experiment.executor is None and experiment.worker is None and
+                not getattr(experiment, 'background', False) and not result.cached):
+            waited.extend(c for c in result.candidates if c.end_ns is not None)
+        duration = max(o.end_ns for o in waited) - min(o.start_ns for o in waited)
+        self._record(self._sampled, duration)
+
+    def record_unsampled(self, duration):
+        self._record(self._unsampled, duration)
+
+    def _record(self, histogram, duration):
+        # callers never wait on each other; a measurement is dropped instead
+        if not self._lock.acquire(False):
+            return
+        try:
+            histogram.record(duration)
+            decision = None
+            if perf_counter_ns() >= self._decide_at:
+                decision = self._decide()
+        finally:
+            self._lock.release()
+
+        if decision is not None:
+            self._report(decision)
+
+    def _decide(self):
+        # must be called with the lock held
+        sampled, unsampled = self._sampled, self._unsampled
+        if sampled.count < self.min_samples or unsampled.count < self.min_samples:
+            return None
+
+        baseline = unsampled.percentile(self.percentile)
+        inflation = sampled.percentile(self.percentile) / float(max(baseline, 1)) - 1
+        previous = self.percentage
+        if inflation > self.budget:
+            action = DECREASE
+            percentage = max(self.min_percentage, previous * self.decrease)
+        else:
+            percentage = min(self.max_percentage, previous + self.increase)
+            action = INCREASE if percentage > previous else HOLD
+        self.percentage = percentage
+
+        decision = Decision(action, previous, percentage, inflation, sampled.count, unsampled.count)
+        self.decisions.append(decision)
+        sampled.reset()
+        unsampled.reset()
+        self._decide_at = perf_counter_ns() + int(self.interval * 1e9)
+        return decision
+
+    def _report(self, decision):
+        logger.info(
+            'Sampling %.2f%% of runs, was %.2f%%: sampled runs were %.1f%% slower at p%s'
+            % (decision.percentage, decision.previous, decision.inflation * 100, self.percentile)
+        )
+        if self.on_decision is not None:
+            try:
+                self.on_decision(decision)
+            except Exception:
+                logger.exception('Exception occured when reporting sampling decision')
@@ -0,0 +1,203 @@
+from functools import partial
+import threading
+import weakref
+
+
+class Counter(object):
+    '''
+    A counter which can be incremented from many threads without locking.
+    Each thread increments its own cell, and cells are summed when read. When
+    a thread exits its cell is folded into a base total, so a counter used from
+    short-lived threads doesn't keep a cell for each of them.
+
+    :ivar int value: current count
+    '''
+
+    __slots__ = ('_local', '_cells', '_base', '_lock', '__weakref__')
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = {}
+        self._base = 0
+        # reentrant, as a cell may be folded by the garbage collector while
+        # the same thread holds the lock
+        self._lock = threading.RLock()
+
+    def increment(self, amount=1):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._add_cell()
+        cell[0] += amount
+
+    @property
+    def value(self):
+        with self._lock:
+            return self._base + sum(cell[0] for cell in list(self._cells.values()))
+
+    def reset(self):
+        '''
+        Reset the count to zero. Increments made concurrently may be lost.
+        '''
+        with self._lock:
+            self._base = 0
+            for cell in list(self._cells.values()):
+                cell[0] = 0
+
+    def _add_cell(self):
+        # only the thread's local refers to the owner, so it's collected when
+        # the thread exits, and the callback folds the cell into the base
+        cell = [0]
+        owner = _CellOwner()
+        ref = weakref.ref(owner, partial(_fold, weakref.ref(self), cell))
+        with self._lock:
+            self._cells[ref] = cell
+        self._local.owner = owner
+        self._local.cell = cell
+        return cell
+
+    def __int__(self):
+        return self.value
+
+    def __repr__(self):
+        return 'Counter(%s)' % self.value
+
+
+class Histogram(object):
+    '''
+    A fixed-size, mergeable histogram of non-negative integers such as latencies
+    in nanoseconds, in the style of an HDR histogram. Values are counted in
+    logarithmically sized buckets, each divided into ``2 ** precision`` linear
+    sub-buckets, so percentiles are accurate to within ``1 / 2 ** precision``
+    of the true value whatever the range, using constant memory.
+
+    :ivar int count: number of values recorded
+    :ivar int total: sum of values recorded
+    :ivar int min: smallest value recorded
+    :ivar int max: largest value recorded
+    '''
+
+    __slots__ = ('precision', 'max_bits', 'counts', 'count', 'total', 'min', 'max', '_sub')
+
+    def __init__(self, precision=4, max_bits=48):
+        '''
+        :param int precision: number of bits of precision kept for each value
+        :param int max_bits: values of ``2 ** max_bits`` or more are counted in
+            the highest bucket. The default covers 78 hours in nanoseconds
+        '''
+        self.precision = precision
+        self.max_bits = max_bits
+        self._sub = 1 << precision
+        self.counts = [0] * ((max_bits - precision + 1) * self._sub)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        self.counts[self.bucket(value)] += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def bucket(self, value):
+        '''
+        :return int: index into :attr:`counts` of the bucket counting ``value``
+        '''
+        if value < self._sub:
+            return value
+        exponent = value.bit_length() - self.precision
+        if exponent + self.precision > self.max_bits:
+            return len(self.counts) - 1
+        return exponent * self._sub + (value >> (exponent - 1)) - self._sub
+
+    def bucket_value(self, index):
+        '''
+        :return int: the value at the middle of bucket ``index``
+        '''
+        exponent, offset = divmod(index, self._sub)
+        if exponent == 0:
+            return offset
+        width = 1 << (exponent - 1)
+        return ((offset + self._sub) << (exponent - 1)) + width // 2
+
+    def percentile(self, percentile):
+        '''
+        :param float percentile: from 0 to 100
+        :return int: the estimated value at ``percentile``, or None if empty
+        '''
+        if not self.count:
+            return None
+        return self.value_at(int(round(self.count * percentile / 100.0)))
+
+    def value_at(self, rank):
+        '''
+        :param int rank: position of a value in sorted order, from 1 to :attr:`count`
+        :return int: the estimated value at ``rank``, or None if empty
+        '''
+        if not self.count:
+            return None
+        rank = min(max(1, rank), self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else None
+
+    def merge(self, other):
+        '''
+        Add the values recorded by ``other``, which must have the same
+        precision and range.
+        '''
+        if (other.precision, other.max_bits) != (self.precision, self.max_bits):
+            raise ValueError('Histograms must have the same precision and max_bits')
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def copy(self):
+        histogram = Histogram(self.precision, self.max_bits)
+        histogram.merge(self)
+        return histogram
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def __repr__(self):
+        return 'Histogram(count=%s, p50=%s, p99=%s)' % (
+            self.count, self.percentile(50), self.percentile(99),
+        )
+
+
+class _CellOwner(object):
+    __slots__ = ('__weakref__',)
+
+
+def _fold(counter_ref, cell, ref):
+    counter = counter_ref()
+    if counter is None:
+        return
+    with counter._lock:
+        if counter._cells.pop(ref, None) is not None:
+            counter._base += cell[0]
@@ -0,0 +1,198 @@
+import inspect
+
+from laboratory.observation import perf_counter_ns
+from laboratory.stats import Histogram
+
+
+class _EndOfStream(object):
+    def __repr__(self):
+        return 'EndOfStream'
+
+
+end_of_stream = _EndOfStream()
+
+
+class StreamSummary(object):
+    '''
+    Stands in for the value of a control that returned a generator, and of
+    its candidates. The control's generator is passed through to the caller,
+    and each candidate's value is iterated over and compared with it element
+    by element as the caller consumes it.
+
+    Summaries are equal if their streams produced the same number of elements
+    and no candidate element differed from the control's.
+
+    :ivar int count: number of elements produced
+    :ivar bool complete: the stream was consumed to the end
+    :ivar tuple mismatch: ``(index, control, candidate)`` for the first element
+     that differed from the control's, if any. A stream that ended early or ran
+     on has :data:`end_of_stream` in place of the missing element
+    :ivar Histogram latency: nanoseconds taken to produce each element
+    '''
+
+    __slots__ = ('count', 'complete', 'mismatch', 'latency')
+
+    def __init__(self):
+        self.count = 0
+        self.complete = False
+        self.mismatch = None
+        self.latency = Histogram()
+
+    def __eq__(self, other):
+        if not isinstance(other, StreamSummary):
+            return NotImplemented
+        return (
+            self.count == other.count and self.complete == other.complete and
+            self.mismatch is None and other.mismatch is None
+        )
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'StreamSummary(count=%r, complete=%r, mismatch=%r)' % (
+            self.count, self.complete, self.mismatch,
+        )
+
+
+def is_stream(value):
+    '''
+    :return bool: whether ``value`` is a generator to be compared as a stream.
+        Other iterators, such as files or database cursors, have methods of
+        their own, so they're returned to the caller as they are
+    '''
+    return inspect.isgenerator(value)
+
+
+def compare_streams(experiment, control, candidates):
+    '''
+    Pass the control's stream through, comparing candidates' streams with it
+    in lockstep, and conclude the experiment once the stream ends or is closed.
+    Candidates whose value isn't iterable are left as they are.
+
+    :param Experiment experiment: the experiment being conducted
+    :param Observation control: the control's observation, whose value is a generator
+    :param list candidates: candidate observations
+    :return: an iterator of the control's elements
+    '''
+    streams = []
+    for observation in candidates:
+        if observation.failure or isinstance(observation.value, (str, bytes)):
+            continue
+        try:
+            streams.append(_Stream(observation, iter(observation.value)))
+        except TypeError:
+            pass
+    return _compare(experiment, _Stream(control, control.value), streams, candidates)
+
+
+class _Stream(object):
+    __slots__ = ('observation', 'iterator', 'summary', 'elapsed', 'active')
+
+    def __init__(self, observation, iterator):
+        self.observation = observation
+        self.iterator = iterator
+        self.summary = StreamSummary()
+        self.elapsed = 0
+        self.active = True
+
+    def next(self):
+        start = perf_counter_ns()
+        try:
+            element = next(self.iterator)
+        finally:
+            elapsed = perf_counter_ns() - start
+            self.elapsed += elapsed
+        self.summary.count += 1
+        self.summary.latency.record(elapsed)
+        return element
+
+    def check(self, experiment, index, expected):
+        # compare the candidate's next element with the control's
+        try:
+            element = self.next()
+        except StopIteration:
+            self.stop((index, expected, end_of_stream), complete=True)
+        except Exception as ex:
+            self.observation.set_exception(ex)
+            self.stop()
+        else:
+            if not _match(experiment, expected, element):
+                self.stop((index, expected, element))
+
+    def finish(self, index):
+        # the control has ended, so the candidate should have too
+        try:
+            element = self.next()
+        except StopIteration:
+            self.stop(complete=True)
+        except Exception as ex:
+            self.observation.set_exception(ex)
+            self.stop()
+        else:
+            self.stop((index, end_of_stream, element))
+
+    def stop(self, mismatch=None, complete=False):
+        self.active = False
+        self.summary.mismatch = mismatch
+        self.summary.complete = complete
+        close = getattr(self.iterator, 'close', None)
+        if close is not None:
+            close()
+
+    def conclude(self):
+        # durations include the time spent producing elements
+        self.observation.end_ns += self.elapsed
+        self.observation.value = self.summary
+
+
+def _compare(experiment, control, streams, candidates):
+    index = 0
+    control_failed = False
+    try:
+        while True:
+            try:
+                element = control.next()
+            except StopIteration:
+                control.summary.complete = True
+                break
+            except Exception:
+                control_failed = True
+                raise
+
+            for stream in streams:
+                if stream.active:
+                    stream.check(experiment, index, element)
+            index += 1
+            yield element
+
+        for stream in streams:
+            if stream.active:
+                stream.finish(index)
+    finally:
+        for stream in streams:
+            if stream.active:
+                stream.stop()
+        if not control.summary.complete:
+            close = getattr(control.iterator, 'close', None)
+            if close is not None:
+                close()
+
+        # as with any other control exception, nothing is published. The
+        # result is concluded as if in the background: mismatches are logged,
+        # as raising while the generator is being closed early would be ignored
+        # and the result never published
+        if not control_failed:
+            control.conclude()
+            for stream in streams:
+                stream.conclude()
+            experiment._conclude(control.observation, candidates, background=True)
+
+
+def _match(experiment, control, candidate):
+    if experiment.comparator is None:
+        return not (control != candidate)
+    return bool(experiment.comparator(control, candidate))
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+import laboratory
+from laboratory.aio import AsyncExperiment
+
+
+class ResultExperiment(laboratory.Experiment):
+    '''
+    Keeps the results it publishes for tests to check, and passes them on to
+    its ``publisher`` if it has one.
+
+    :ivar list results: every result published
+    :ivar threading.Event published: set once a result is published
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(ResultExperiment, self).__init__(*args, **kwargs)
+        self.results = []
+        self.published = threading.Event()
+
+    @property
+    def result(self):
+        '''
+        :return Result: the last result published, or None
+        '''
+        return self.results[-1] if self.results else None
+
+    def publish(self, result):
+        self.results.append(result)
+        self.published.set()
+        super(ResultExperiment, self).publish(result)
+
+
+class AsyncResultExperiment(AsyncExperiment):
+    '''
+    :class:`ResultExperiment` for asyncio code.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncResultExperiment, self).__init__(*args, **kwargs)
+        self.results = []
+
+    @property
+    def result(self):
+        return self.results[-1] if self.results else None
+
+    async def publish(self, result):
+        self.results.append(result)
+
+
+@pytest.fixture
+def result_experiment():
+    '''
+    The :class:`ResultExperiment` class, to create or subclass experiments
+    whose results tests check.
+    '''
+    return ResultExperiment
+
+
+@pytest.fixture
+def async_result_experiment():
+    '''
+    The :class:`AsyncResultExperiment` class.
+    '''
+    return AsyncResultExperiment
+
+
+@pytest.fixture
+def conduct():
+    '''
+    Conduct a :class:`ResultExperiment` once, waiting for its result if
+    candidates run on an executor or worker.
+
+    The fixture is a function taking the control function, then candidate
+    functions or ``(name, function)`` pairs. ``args`` and ``kwargs`` are passed
+    to every function, ``candidate_context`` is each candidate's context, and
+    any other keyword arguments are passed to the experiment. It returns the
+    control's value and the experiment.
+    '''
+    return _conduct
+
+
+def _conduct(control, *candidates, **kwargs):
+    args = kwargs.pop('args', None)
+    func_kwargs = kwargs.pop('kwargs', None)
+    candidate_context = kwargs.pop('candidate_context', None)
+
+    experiment = ResultExperiment(**kwargs)
+    experiment.control(control, args=args, kwargs=func_kwargs)
+    for index, candidate in enumerate(candidates):
+        if isinstance(candidate, tuple):
+            name, candidate = candidate
+        else:
+            name = 'Candidate' if len(candidates) == 1 else 'Candidate %d' % index
+        experiment.candidate(
+            candidate, args=args, kwargs=func_kwargs, name=name, context=candidate_context,
+        )
+
+    value = experiment.conduct()
+    if experiment.executor is not None or experiment.worker is not None:
+        assert experiment.published.wait(10)
+    return value, experiment
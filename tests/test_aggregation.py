@@ -0,0 +1,252 @@
+import random
+
+import pytest
+
+from laboratory.aggregation import Aggregator
+from laboratory.stats import Histogram
+
+
+def raise_exception():
+    raise KeyError('c')
+
+
+@pytest.fixture
+def record(conduct):
+    def record(aggregator, name='exp', candidate=lambda: 1):
+        return conduct(lambda: 1, ('cand', candidate), name=name, aggregator=aggregator)
+    return record
+
+
+def test_aggregator_counts_results(record):
+    aggregator = Aggregator()
+    record(aggregator)
+    record(aggregator, candidate=lambda: 2)
+    record(aggregator, candidate=raise_exception)
+    record(aggregator, name='other')
+
+    snapshot = aggregator.snapshot()
+    assert sorted(snapshot) == ['exp', 'other']
+
+    stats = snapshot['exp'].to_dict()
+    assert stats['runs'] == 3
+    assert stats['mismatches'] == 2
+    assert stats['match_rate'] == pytest.approx(1 / 3.0)
+    assert stats['control']['count'] == 3
+    assert stats['control']['exceptions'] == 0
+    assert stats['candidates']['cand']['exceptions'] == 1
+    assert stats['candidates']['cand']['mismatches'] == 2
+    assert stats['candidates']['cand']['p50'] is not None
+
+
+def test_timed_out_comparisons_are_left_out_of_rates(conduct):
+    from laboratory.comparators import Comparison
+
+    aggregator = Aggregator()
+    for match in (Comparison(True, timed_out=True), True, False):
+        conduct(
+            lambda: 1, ('cand', lambda: 1), name='exp', aggregator=aggregator,
+            comparator=lambda control, candidate, match=match: match,
+        )
+
+    stats = aggregator.snapshot()['exp'].to_dict()
+    assert stats['runs'] == 3
+    assert stats['unknown'] == 1
+    assert stats['match_rate'] == 0.5
+    assert stats['candidates']['cand']['unknown'] == 1
+    assert stats['candidates']['cand']['mismatch_rate'] == 0.5
+
+
+def test_aggregator_compares_outside_lock(conduct):
+    aggregator = Aggregator()
+
+    def compare(control, candidate):
+        # snapshot() takes the lock, so this would deadlock if it were held
+        aggregator.snapshot()
+        return control == candidate
+
+    conduct(
+        lambda: 1, ('cand', lambda: 1), name='exp', aggregator=aggregator, comparator=compare,
+    )
+
+    assert aggregator.snapshot()['exp'].mismatches == 0
+
+
+def test_snapshot_reset(record):
+    aggregator = Aggregator()
+    record(aggregator)
+
+    assert aggregator.snapshot(reset=True)['exp'].runs == 1
+    assert aggregator.snapshot() == {}
+
+
+def test_snapshot_is_a_copy(record):
+    aggregator = Aggregator()
+    record(aggregator)
+    snapshot = aggregator.snapshot()
+    record(aggregator)
+
+    assert snapshot['exp'].runs == 1
+    assert aggregator.snapshot()['exp'].runs == 2
+
+
+def test_experiment_stats_merge(record):
+    first, second = Aggregator(), Aggregator()
+    record(first)
+    record(second, candidate=lambda: 2)
+
+    merged = first.snapshot()['exp']
+    merged.merge(second.snapshot()['exp'])
+    assert merged.runs == 2
+    assert merged.mismatches == 1
+    assert merged.candidates['cand'].latency.count == 2
+
+
+def test_histogram_percentiles_are_accurate():
+    values = [random.randint(1, 10 ** 9) for _ in range(10000)]
+    histogram = Histogram(precision=5)
+    for value in values:
+        histogram.record(value)
+
+    values.sort()
+    for percentile in (50, 90, 99):
+        expected = values[int(len(values) * percentile / 100.0) - 1]
+        assert histogram.percentile(percentile) == pytest.approx(expected, rel=0.05)
+
+    assert histogram.count == 10000
+    assert histogram.min == values[0]
+    assert histogram.max == values[-1]
+
+
+def test_histogram_small_values_are_exact():
+    histogram = Histogram()
+    for value in range(10):
+        histogram.record(value)
+    assert histogram.percentile(50) == 4
+    assert histogram.percentile(100) == 9
+
+
+def test_histogram_clamps_large_values():
+    histogram = Histogram(max_bits=20)
+    histogram.record(2 ** 40)
+    assert histogram.counts[-1] == 1
+    assert histogram.percentile(50) == 2 ** 40
+
+
+def test_histogram_merge():
+    first, second = Histogram(), Histogram()
+    first.record(10)
+    second.record(1000)
+    first.merge(second)
+
+    assert first.count == 2
+    assert first.min == 10
+    assert first.max == 1000
+
+    with pytest.raises(ValueError):
+        first.merge(Histogram(precision=2))
+
+
+def test_shared_aggregator_counts_results(tmpdir, record):
+    from laboratory.aggregation import SharedAggregator
+
+    aggregator = SharedAggregator(str(tmpdir.join('stats')), slots=4, series=8)
+    record(aggregator)
+    record(aggregator, candidate=lambda: 2)
+    record(aggregator, candidate=raise_exception)
+    record(aggregator, name='other')
+
+    reader = SharedAggregator(str(tmpdir.join('stats')))
+    snapshot = reader.snapshot()
+    assert sorted(snapshot) == ['exp', 'other']
+
+    stats = snapshot['exp'].to_dict()
+    assert stats['runs'] == 3
+    assert stats['mismatches'] == 2
+    assert stats['control']['count'] == 3
+    assert stats['candidates']['cand']['exceptions'] == 1
+    assert stats['candidates']['cand']['mismatches'] == 2
+    assert stats['candidates']['cand']['p50'] is not None
+    assert snapshot['exp'].control.latency.count == 3
+
+    aggregator.close()
+    reader.close()
+
+
+@pytest.mark.skipif(not hasattr(__import__('os'), 'fork'), reason='requires fork')
+def test_shared_aggregator_merges_processes(tmpdir, record):
+    import os
+    from laboratory.aggregation import SharedAggregator
+
+    aggregator = SharedAggregator(str(tmpdir.join('stats')), slots=4, series=8)
+    record(aggregator)
+
+    # children stay alive until the parent has looked, as the slot of a
+    # child that has exited could be claimed by the next
+    recorded, done = os.pipe(), os.pipe()
+    children = []
+    for _ in range(2):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(done[1])
+                record(aggregator)
+                record(aggregator, name='child')
+                os.write(recorded[1], b'x')
+                os.read(done[0], 1)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    for _ in children:
+        os.read(recorded[0], 1)
+    workers = aggregator.workers()
+    os.close(done[1])
+    for pid in children:
+        os.waitpid(pid, 0)
+    for fd in recorded + (done[0],):
+        os.close(fd)
+
+    assert sorted(workers) == sorted([os.getpid()] + children)
+    snapshot = aggregator.snapshot()
+    assert snapshot['exp'].runs == 3
+    assert snapshot['child'].runs == 2
+    assert snapshot['exp'].control.latency.count == 3
+    aggregator.close()
+
+
+def test_shared_aggregator_drops_when_full(tmpdir, record):
+    from laboratory.aggregation import SharedAggregator
+
+    aggregator = SharedAggregator(str(tmpdir.join('stats')), slots=1, series=3)
+    record(aggregator)
+    record(aggregator, name='other')
+    assert aggregator.dropped.value == 1
+    assert list(aggregator.snapshot()) == ['exp']
+
+    # a second aggregator in the same process needs a slot of its own
+    second = SharedAggregator(str(tmpdir.join('stats')))
+    record(second)
+    assert second.dropped.value == 1
+
+    # slots are released on close, and counts carried on from
+    aggregator.close()
+    second.close()
+    third = SharedAggregator(str(tmpdir.join('stats')))
+    record(third)
+    assert third.snapshot()['exp'].runs == 2
+    third.close()
+
+
+def test_shared_aggregator_uses_existing_layout(tmpdir):
+    from laboratory.aggregation import SharedAggregator
+
+    path = str(tmpdir.join('stats'))
+    SharedAggregator(path, slots=2, series=4, precision=3).close()
+    aggregator = SharedAggregator(path)
+    assert (aggregator.slots, aggregator.series_per_slot, aggregator.precision) == (2, 4, 3)
+    aggregator.close()
+
+    with open(path, 'r+b') as f:
+        f.write(b'\0' * 8)
+    with pytest.raises(ValueError):
+        SharedAggregator(path)
@@ -0,0 +1,254 @@
+import asyncio
+
+import mock
+import pytest
+
+import laboratory
+from laboratory import AsyncExperiment
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def double(x):
+    await asyncio.sleep(0)
+    return x * 2
+
+
+async def raise_exception():
+    raise KeyError('c')
+
+
+def test_conduct_awaits_control_and_candidates(async_result_experiment):
+    experiment = async_result_experiment()
+    experiment.control(double, args=[2])
+    experiment.candidate(double, args=[2])
+
+    assert run(experiment.conduct()) == 4
+    assert experiment.result.match
+    assert experiment.result.candidates[0].value == 4
+
+
+def test_sync_functions_are_supported(async_result_experiment):
+    experiment = async_result_experiment()
+    experiment.control(lambda: 1)
+    experiment.candidate(double, args=[1])
+
+    assert run(experiment.conduct()) == 1
+    assert not experiment.result.match
+
+
+def test_control_raising_exception(async_result_experiment):
+    experiment = async_result_experiment()
+    experiment.control(raise_exception)
+    experiment.candidate(double, args=[1])
+
+    with pytest.raises(KeyError):
+        run(experiment.conduct())
+    assert not experiment.results
+
+
+def test_candidate_raising_exception_silently(async_result_experiment):
+    experiment = async_result_experiment()
+    experiment.control(double, args=[1])
+    experiment.candidate(raise_exception)
+
+    assert run(experiment.conduct()) == 2
+    assert isinstance(experiment.result.candidates[0].exception, KeyError)
+
+
+def test_candidate_timeout_cancels_candidate(async_result_experiment):
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    experiment = async_result_experiment(candidate_timeout=0.01)
+    experiment.control(double, args=[1])
+    experiment.candidate(slow)
+
+    async def scenario():
+        value = await experiment.conduct()
+        await asyncio.sleep(0)
+        return value
+
+    assert run(scenario()) == 2
+    obs = experiment.result.candidates[0]
+    assert isinstance(obs.exception, laboratory.exceptions.TimeoutException)
+    assert cancelled
+
+
+def test_background_returns_before_candidates_complete(async_result_experiment):
+    experiment = async_result_experiment(background=True)
+
+    async def scenario():
+        event = asyncio.Event()
+
+        async def candidate():
+            await event.wait()
+            return 2
+
+        experiment.control(double, args=[1])
+        experiment.candidate(candidate)
+
+        value = await experiment.conduct()
+        published_early = bool(experiment.results)
+        event.set()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return value, published_early
+
+    value, published_early = run(scenario())
+    assert value == 2
+    assert not published_early
+    assert experiment.result.match
+
+
+def test_async_enabled(async_result_experiment):
+    class DisabledExperiment(async_result_experiment):
+        async def enabled(self):
+            return False
+
+    cand_func = mock.Mock()
+    experiment = DisabledExperiment()
+    experiment.control(double, args=[3])
+    experiment.candidate(cand_func)
+
+    assert run(experiment.conduct()) == 6
+    assert not cand_func.called
+
+
+async def candidate_mismatch(x):
+    return False
+
+
+@AsyncExperiment.decorator(candidate=candidate_mismatch, raise_on_mismatch=True)
+async def control_mismatch(x):
+    return True
+
+
+def test_decorated_coroutine():
+    with pytest.raises(laboratory.exceptions.MismatchException):
+        run(control_mismatch('blah'))
+
+
+def test_decorator_creates_experiment_once(async_result_experiment):
+    candidate = mock.Mock(side_effect=lambda x: x * 2)
+
+    @async_result_experiment.decorator(candidate=candidate)
+    async def control(x):
+        return x * 2
+
+    experiment = control.experiment
+    assert run(control(1)) == 2
+    assert run(control(3)) == 6
+    assert control.experiment is experiment
+    assert [c.args for c in candidate.call_args_list] == [(1,), (3,)]
+    assert [r.control.value for r in experiment.results] == [2, 6]
+    assert all(r.match for r in experiment.results)
+
+
+@pytest.mark.parametrize('option', ['executor', 'worker', 'cache'])
+def test_unsupported_options_raise(option):
+    with pytest.raises(ValueError):
+        AsyncExperiment(**{option: mock.Mock()})
+
+
+def test_circuit_breaker_skips_open_candidates(async_result_experiment):
+    from laboratory.breaker import CircuitBreaker
+
+    candidate = mock.Mock(side_effect=raise_exception)
+    breaker = CircuitBreaker(max_exception_rate=0.5, min_calls=1)
+    experiment = async_result_experiment(circuit_breaker=breaker)
+    experiment.control(double, args=[2])
+    experiment.candidate(candidate)
+
+    assert run(experiment.conduct()) == 4
+    assert run(experiment.conduct()) == 4
+    assert candidate.call_count == 1
+
+
+def test_recording_awaits_only_the_control(tmpdir, async_result_experiment):
+    from laboratory.replay import Recorder, read_log
+
+    candidate = mock.Mock()
+    recorder = Recorder(str(tmpdir.join('log')))
+    experiment = async_result_experiment(recorder=recorder)
+    experiment.control(double, args=[2])
+    experiment.candidate(candidate)
+
+    assert run(experiment.conduct()) == 4
+    assert not candidate.called
+    recorder.close()
+    assert [r['control'].value for r in read_log(recorder.path)] == [4]
+
+
+def test_candidates_are_isolated(async_result_experiment):
+    from laboratory.isolation import ReadOnly
+
+    items = [1, 2]
+
+    async def append(items):
+        items.append(3)
+
+    experiment = async_result_experiment(isolation=ReadOnly())
+    experiment.control(len, args=[items])
+    experiment.candidate(append, args=[items])
+
+    assert run(experiment.conduct()) == 2
+    assert items == [1, 2]
+    assert experiment.result.candidates[0].failure
+
+
+def test_unsampled_runs_are_timed(async_result_experiment):
+    from laboratory.sampling import OverheadGovernor
+
+    governor = OverheadGovernor(percentage=0)
+    governor.record_unsampled = mock.Mock()
+    experiment = async_result_experiment(sampler=governor)
+    experiment.control(double, args=[2])
+    experiment.candidate(double, args=[2])
+
+    assert run(experiment.conduct()) == 4
+    assert governor.record_unsampled.call_count == 1
+
+
+def test_background_mismatch_is_logged_and_published(async_result_experiment):
+    experiment = async_result_experiment(background=True, raise_on_mismatch=True)
+
+    async def scenario():
+        experiment.control(double, args=[1])
+        experiment.candidate(double, args=[2])
+        value = await experiment.conduct()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return value
+
+    with mock.patch('laboratory.experiment.logger') as logger:
+        assert run(scenario()) == 2
+
+    assert not experiment.result.match
+    assert logger.error.called
+
+
+def test_cpu_time(async_result_experiment):
+    experiment = async_result_experiment(cpu_time=True)
+
+    async def candidate():
+        return sum(range(1000))
+
+    experiment.control(lambda: sum(range(1000)))
+    experiment.candidate(candidate)
+    run(experiment.conduct())
+
+    assert experiment.result.control.cpu_ns is not None
+    assert experiment.result.candidates[0].cpu_ns is not None
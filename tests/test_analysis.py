@@ -0,0 +1,131 @@
+import random
+import statistics
+
+import laboratory
+from laboratory.analysis import (
+    FASTER, INCONCLUSIVE, SLOWER, Analyzer, CandidateAnalysis, RunningStats,
+)
+from laboratory.observation import Observation
+from laboratory.result import Result
+
+
+def durations(count, control_ns, candidate_ns, noise=0.05, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield (
+            int(control_ns * (1 + rng.uniform(-noise, noise))),
+            int(candidate_ns * (1 + rng.uniform(-noise, noise))),
+        )
+
+
+def analyse(count, control_ns, candidate_ns, **kwargs):
+    analysis = CandidateAnalysis(**kwargs)
+    for control, candidate in durations(count, control_ns, candidate_ns):
+        analysis.record(control, candidate)
+    return analysis
+
+
+def observation(name, duration, failure=False):
+    obs = Observation(name)
+    obs.start_ns, obs.end_ns = 0, duration
+    obs.failure = failure
+    return obs
+
+
+def test_running_stats():
+    values = [random.Random(2).uniform(0, 100) for _ in range(50)]
+    stats, first, second = RunningStats(), RunningStats(), RunningStats()
+    for value in values:
+        stats.add(value)
+    for value in values[:20]:
+        first.add(value)
+    for value in values[20:]:
+        second.add(value)
+    first.merge(second)
+
+    for running in (stats, first):
+        assert running.count == 50
+        assert abs(running.mean - statistics.mean(values)) < 1e-9
+        assert abs(running.variance - statistics.variance(values)) < 1e-6
+
+    assert RunningStats().variance is None
+
+
+def test_faster_candidate():
+    verdict = analyse(200, 10000, 8000).verdict(min_samples=100)
+    assert verdict.verdict == FASTER
+    assert verdict.stop
+    assert verdict.samples == 200
+    low, high = verdict.interval
+    assert low < verdict.difference < high < 0
+
+
+def test_slower_candidate():
+    assert analyse(200, 10000, 12000).verdict().verdict == SLOWER
+
+
+def test_equal_durations_are_inconclusive():
+    verdict = analyse(500, 10000, 10000).verdict()
+    assert verdict.verdict == INCONCLUSIVE
+    assert not verdict.stop
+
+
+def test_min_samples_delays_stopping():
+    verdict = analyse(50, 10000, 5000).verdict(min_samples=100)
+    assert verdict.verdict == FASTER
+    assert not verdict.stop
+
+
+def test_min_effect():
+    analysis = analyse(1000, 10000, 9900)
+    assert analysis.verdict().verdict == FASTER
+    assert analysis.verdict(min_effect=0.05).verdict == INCONCLUSIVE
+
+
+def test_sequential_interval_is_wider():
+    analysis = analyse(200, 10000, 9000)
+    sequential, fixed = analysis.interval(), analysis.interval(sequential=False)
+    assert sequential[0] < fixed[0] < fixed[1] < sequential[1]
+    assert CandidateAnalysis().interval() is None
+
+
+def test_percentile_ratios():
+    ratios = analyse(1000, 10000, 5000).verdict().ratios
+    assert sorted(ratios) == [50, 95, 99]
+    ratio, low, high = ratios[50]
+    assert low <= ratio <= high
+    assert 0.45 < ratio < 0.55
+    assert CandidateAnalysis().ratio(50) is None
+
+
+def test_analyzer_records_results():
+    analyzer = Analyzer(min_samples=10)
+    experiment = laboratory.Experiment(name='exp')
+
+    for control, candidate in durations(100, 10000, 20000):
+        analyzer.record(Result(experiment, observation('Control', control), [
+            observation('fast', candidate // 4),
+            observation('slow', candidate),
+            observation('broken', 1, failure=True),
+        ]))
+
+    verdicts = analyzer.verdicts('exp')
+    assert sorted(verdicts) == ['fast', 'slow']
+    assert verdicts['fast'].verdict == FASTER
+    assert verdicts['slow'].verdict == SLOWER
+    assert analyzer.should_stop('exp')
+    assert not analyzer.should_stop('other')
+
+    analyzer.reset()
+    assert analyzer.verdicts('exp') == {}
+
+
+def test_experiment_records_in_analyzer():
+    analyzer = Analyzer()
+    experiment = laboratory.Experiment(analyzer=analyzer)
+    experiment.control(lambda: 1)
+    experiment.candidate(lambda: 1)
+    for _ in range(3):
+        experiment.conduct()
+
+    assert analyzer.verdicts('Experiment')['Candidate'].samples == 3
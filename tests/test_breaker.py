@@ -0,0 +1,191 @@
+import mock
+import pytest
+
+import laboratory
+from laboratory.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, StateChange
+from laboratory.publishing import result_to_dict
+
+
+def make_experiment(breaker, candidate, control=lambda: 1, name='Candidate'):
+    experiment = laboratory.Experiment(circuit_breaker=breaker)
+    experiment.publish = mock.Mock()
+    experiment.control(control)
+    experiment.candidate(candidate, name=name)
+    return experiment
+
+
+def published(experiment):
+    return experiment.publish.call_args[0][0]
+
+
+@pytest.fixture
+def clock():
+    with mock.patch('laboratory.breaker.perf_counter_ns') as perf_counter_ns:
+        perf_counter_ns.return_value = 0
+        yield perf_counter_ns
+
+
+def test_opens_on_exception_rate(clock):
+    breaker = CircuitBreaker(max_exception_rate=0.5, min_calls=4, cooldown=10)
+    candidate = mock.Mock(side_effect=ValueError)
+    experiment = make_experiment(breaker, candidate)
+
+    for _ in range(4):
+        experiment.conduct()
+
+    assert breaker.state('Experiment', 'Candidate') == OPEN
+    change, = published(experiment).state_changes
+    assert (change.previous, change.state) == (CLOSED, OPEN)
+    assert change.reason == 'exception rate 1.00'
+
+    experiment.conduct()
+    assert candidate.call_count == 4
+
+
+def test_control_called_directly_when_all_circuits_open(clock):
+    breaker = CircuitBreaker(max_exception_rate=0.5, min_calls=1)
+    experiment = make_experiment(breaker, mock.Mock(side_effect=ValueError))
+    experiment.conduct()
+    experiment.publish.reset_mock()
+
+    assert experiment.conduct() == 1
+    assert not experiment.publish.called
+
+
+def test_only_open_candidates_are_skipped(clock):
+    breaker = CircuitBreaker(max_exception_rate=0.5, min_calls=1)
+    good = mock.Mock(return_value=1)
+    experiment = make_experiment(breaker, mock.Mock(side_effect=ValueError), name='bad')
+    experiment.candidate(good, name='good')
+
+    experiment.conduct()
+    experiment.conduct()
+
+    assert good.call_count == 2
+    assert [obs.name for obs in published(experiment).candidates] == ['good']
+
+
+def test_opens_on_mismatch_rate(clock):
+    breaker = CircuitBreaker(max_mismatch_rate=0.1, min_calls=2)
+    experiment = make_experiment(breaker, lambda: 2)
+    experiment.conduct()
+    experiment.conduct()
+    assert breaker.state('Experiment', 'Candidate') == OPEN
+
+
+def test_timed_out_comparisons_are_left_out_of_mismatch_rate(clock):
+    from laboratory.comparators import Comparison
+
+    breaker = CircuitBreaker(max_mismatch_rate=0.5, min_calls=4)
+    matches = [False, False] + [Comparison(True, timed_out=True)] * 2
+    experiment = make_experiment(breaker, lambda: 2)
+    experiment.comparator = lambda control, candidate: matches.pop()
+    for _ in range(4):
+        experiment.conduct()
+
+    assert breaker.state('Experiment', 'Candidate') == OPEN
+    change, = published(experiment).state_changes
+    assert change.reason == 'mismatch rate 1.00'
+
+
+def test_opens_on_p99(clock):
+    breaker = CircuitBreaker(max_p99=0.001, min_calls=2)
+    experiment = make_experiment(breaker, lambda: 1)
+    with mock.patch('laboratory.observation.Observation.duration', 2000000):
+        experiment.conduct()
+        experiment.conduct()
+    assert breaker.state('Experiment', 'Candidate') == OPEN
+
+
+def test_window_slides():
+    breaker = CircuitBreaker(max_exception_rate=0.5, window=4, min_calls=4)
+    fail = [True]
+    experiment = make_experiment(breaker, mock.Mock(side_effect=lambda: fail[0] and 1 / 0))
+
+    experiment.conduct()
+    experiment.conduct()
+    fail[0] = False
+    for _ in range(10):
+        experiment.conduct()
+    assert breaker.state('Experiment', 'Candidate') == CLOSED
+
+    fail[0] = True
+    for _ in range(3):
+        experiment.conduct()
+    assert breaker.state('Experiment', 'Candidate') == OPEN
+
+
+def test_half_open_probe(clock):
+    breaker = CircuitBreaker(max_exception_rate=0.5, min_calls=1, cooldown=10)
+    fail = [True]
+    candidate = mock.Mock(side_effect=lambda: fail[0] and 1 / 0)
+    experiment = make_experiment(breaker, candidate)
+    experiment.conduct()
+    assert breaker.state('Experiment', 'Candidate') == OPEN
+
+    # a failed probe opens the circuit again
+    clock.return_value = 11 * 10 ** 9
+    experiment.conduct()
+    assert [(c.previous, c.state) for c in published(experiment).state_changes] == [
+        (OPEN, HALF_OPEN), (HALF_OPEN, OPEN),
+    ]
+
+    # a clean probe closes it
+    fail[0] = False
+    clock.return_value = 22 * 10 ** 9
+    experiment.conduct()
+    assert breaker.state('Experiment', 'Candidate') == CLOSED
+    assert candidate.call_count == 3
+
+
+def test_one_probe_per_cooldown(clock):
+    breaker = CircuitBreaker(max_exception_rate=0.5, min_calls=1, cooldown=10)
+    experiment = make_experiment(breaker, mock.Mock(side_effect=ValueError))
+    experiment.conduct()
+
+    clock.return_value = 11 * 10 ** 9
+    assert breaker.allow(experiment, 'Candidate')
+    assert breaker.state('Experiment', 'Candidate') == HALF_OPEN
+    assert not breaker.allow(experiment, 'Candidate')
+
+
+def test_shared_between_experiments(clock):
+    breaker = CircuitBreaker(max_exception_rate=0.5, min_calls=2)
+    for _ in range(2):
+        make_experiment(breaker, mock.Mock(side_effect=ValueError)).conduct()
+    assert breaker.state('Experiment', 'Candidate') == OPEN
+
+    breaker.reset()
+    assert breaker.state('Experiment', 'Candidate') == CLOSED
+
+
+def test_state_changes_published():
+    breaker = CircuitBreaker(max_exception_rate=0.5, min_calls=1)
+    experiment = make_experiment(breaker, mock.Mock(side_effect=ValueError))
+    experiment.conduct()
+
+    change, = result_to_dict(published(experiment))['state_changes']
+    assert change['state'] == OPEN
+    assert change['candidate'] == 'Candidate'
+
+
+def test_compares_outside_lock(clock):
+    breaker = CircuitBreaker(max_mismatch_rate=0.1, min_calls=1)
+
+    def compare(control, candidate):
+        # reset() takes the lock, so this would deadlock if it were held
+        breaker.reset()
+        return control == candidate
+
+    experiment = laboratory.Experiment(circuit_breaker=breaker, comparator=compare)
+    experiment.control(lambda: 1)
+    experiment.candidate(lambda: 2)
+    experiment.conduct()
+    assert breaker.state('Experiment', 'Candidate') == OPEN
+
+
+def test_state_change_is_a_tuple():
+    change = StateChange('exp', 'cand', CLOSED, OPEN, 'exception rate 1.00')
+    assert change.state == OPEN
+    assert 'circuit changed state' in StateChange.__doc__
+    assert not hasattr(change, '__dict__')
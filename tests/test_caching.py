@@ -0,0 +1,157 @@
+import mock
+import pytest
+
+import laboratory
+from laboratory.caching import ResultCache
+
+
+@pytest.fixture
+def decorate(result_experiment):
+    def decorate(cache, candidate, **kwargs):
+        @result_experiment.decorator(candidate, cache=cache, **kwargs)
+        def control(x, y=0):
+            return x + y
+        return control
+    return decorate
+
+
+def test_repeated_arguments_skip_candidate(decorate):
+    cache = ResultCache()
+    candidate = mock.Mock(side_effect=lambda x, y=0: x + y)
+    control = decorate(cache, candidate)
+
+    assert control(1, y=2) == 3
+    assert control(1, y=2) == 3
+    assert control(2) == 2
+    assert candidate.call_count == 2
+
+    first, second, third = control.experiment.results
+    assert not first.cached and second.cached and not third.cached
+    assert second.match
+    assert second.candidates[0] is first.candidates[0]
+    assert (cache.hits.value, cache.misses.value) == (1, 2)
+
+
+def test_cached_verdict_is_reused(decorate):
+    candidate = mock.Mock(return_value=0)
+    control = decorate(ResultCache(), candidate)
+
+    control(1)
+    with mock.patch.object(control.experiment, 'compare') as compare:
+        control(1)
+        result = control.experiment.results[-1]
+        assert not result.match
+        assert list(result.mismatches) == ['Candidate']
+        assert not compare.called
+
+
+def test_cached_mismatch_raises(decorate):
+    control = decorate(ResultCache(), lambda x, y=0: -1, raise_on_mismatch=True)
+    with pytest.raises(laboratory.MismatchException):
+        control(1)
+    with pytest.raises(laboratory.MismatchException):
+        control(1)
+
+
+def test_lru_eviction(decorate):
+    cache = ResultCache(maxsize=2)
+    candidate = mock.Mock(return_value=1)
+    control = decorate(cache, candidate)
+
+    for x in (1, 2, 1, 3, 1, 2):
+        control(x)
+
+    # 2 is evicted when 3 is added, as 1 was used more recently
+    assert candidate.call_count == 4
+    assert cache.evictions.value == 2
+    assert len(cache) == 2
+
+
+def test_ttl(monkeypatch, decorate):
+    now = [0]
+    monkeypatch.setattr('laboratory.caching.perf_counter_ns', lambda: now[0])
+    candidate = mock.Mock(return_value=1)
+    control = decorate(ResultCache(ttl=10), candidate)
+
+    control(1)
+    now[0] = 9 * 10 ** 9
+    control(1)
+    now[0] = 11 * 10 ** 9
+    control(1)
+    assert candidate.call_count == 2
+
+
+def test_custom_key(result_experiment):
+    cache = ResultCache(key=lambda args, kwargs: args[0]['id'])
+    candidate = mock.Mock(return_value=1)
+    experiment = result_experiment(cache=cache)
+    experiment.control(lambda user: 1, args=[{'id': 1, 'name': 'a'}])
+    experiment.candidate(candidate)
+
+    experiment.conduct()
+    experiment.conduct()
+    assert candidate.call_count == 1
+
+
+def test_unhashable_arguments_are_not_cached(result_experiment):
+    cache = ResultCache()
+    candidate = mock.Mock(return_value=1)
+    for _ in range(2):
+        experiment = result_experiment(cache=cache)
+        experiment.control(len, args=[[1]])
+        experiment.candidate(candidate)
+        experiment.conduct()
+    assert candidate.call_count == 2
+    assert cache.uncacheable.value == 2
+
+
+def test_shared_between_experiments_by_name(result_experiment):
+    cache = ResultCache()
+    candidate = mock.Mock(return_value=1)
+    for name in ('a', 'a', 'b'):
+        experiment = result_experiment(name=name, cache=cache)
+        experiment.control(lambda: 1)
+        experiment.candidate(candidate)
+        experiment.conduct()
+    assert candidate.call_count == 2
+
+
+def test_cached_results_are_recorded(decorate):
+    from laboratory.aggregation import Aggregator
+
+    aggregator = Aggregator()
+    control = decorate(
+        ResultCache(), lambda x, y=0: -x, name='cached results', aggregator=aggregator,
+    )
+    control(1)
+    control(1)
+
+    stats = aggregator.snapshot()['cached results']
+    assert (stats.runs, stats.mismatches) == (2, 2)
+    assert stats.candidates['Candidate'].latency.count == 1
+    registration = control.experiment._registration
+    assert registration.mismatches.value == 2
+
+
+def test_failing_key_is_not_cached(result_experiment):
+    cache = ResultCache(key=lambda args, kwargs: args[0]['id'])
+    candidate = mock.Mock(return_value=1)
+    experiment = result_experiment(cache=cache)
+    experiment.control(lambda user: 1, args=[{}])
+    experiment.candidate(candidate)
+
+    with mock.patch('laboratory.caching.logger') as logger:
+        assert experiment.conduct() == 1
+    assert candidate.call_count == 1
+    assert cache.uncacheable.value == 1
+    assert logger.exception.called
+
+
+def test_clear(decorate):
+    cache = ResultCache()
+    candidate = mock.Mock(return_value=1)
+    control = decorate(cache, candidate)
+    control(1)
+    cache.clear()
+    control(1)
+    assert candidate.call_count == 2
@@ -0,0 +1,132 @@
+import concurrent.futures
+import gc
+
+import mock
+
+import laboratory
+from laboratory.capture import (
+    Capture, Digest, DigestCapture, KeepValue, ReprCapture, WeakRefCapture,
+)
+from laboratory.comparators import DigestComparator
+
+
+class Value(object):
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def test_digest_equality():
+    assert Digest('abc', 3) == Digest('abc', 3, preview='x')
+    assert Digest('abc', 3) != Digest('abd', 3)
+    assert Digest('abc', 3) != 'abc'
+    assert len(set([Digest('abc', 3), Digest('abc', 3)])) == 1
+
+
+def test_keep_value():
+    value = [1, 2]
+    assert KeepValue()(value) is value
+
+
+def test_digest_capture():
+    capture = DigestCapture(preview=10)
+    digest = capture(list(range(100)))
+    assert isinstance(digest, Digest)
+    assert digest.size > 0
+    assert digest.preview == '[0, 1, ...'
+    assert digest == capture(list(range(100)))
+    assert digest != capture(list(range(101)))
+    assert capture(digest) is digest
+
+
+def test_digest_capture_unpicklable_value():
+    capture = DigestCapture()
+    assert capture(lambda: 1) != capture(object())
+
+
+def test_repr_capture_compares_full_repr():
+    capture = ReprCapture(max_length=5)
+    digest = capture('a' * 100)
+    assert digest.preview == "'a..."
+    assert digest != capture('a' * 99)
+    assert digest == capture('a' * 100)
+
+
+def test_weakref_capture():
+    capture = WeakRefCapture()
+    value = Value(1)
+    ref = capture(value)
+    assert ref() is value
+    assert ref == capture(Value(1))
+
+    del value
+    gc.collect()
+    assert ref() is None
+
+
+def test_weakref_capture_fallback():
+    assert WeakRefCapture()({'a': 1}) == {'a': 1}
+    assert isinstance(WeakRefCapture(DigestCapture())({'a': 1}), Digest)
+
+
+def test_experiment_returns_raw_control_value(conduct):
+    value, experiment = conduct(lambda: {'a': 1}, lambda: {'a': 1}, capture=DigestCapture())
+    result = experiment.result
+    assert value == {'a': 1}
+    assert isinstance(result.control.value, Digest)
+    assert isinstance(result.candidates[0].value, Digest)
+    assert result.match
+
+
+def test_experiment_compares_digests(conduct):
+    _, experiment = conduct(lambda: {'a': 1}, lambda: {'a': 2}, capture=DigestCapture())
+    assert not experiment.result.match
+
+
+def test_digest_comparator_accepts_digests(conduct):
+    _, experiment = conduct(
+        lambda: [1, 2], lambda: [1, 2], capture=DigestCapture(), comparator=DigestComparator(),
+    )
+    assert experiment.result.match
+    assert DigestComparator()(DigestCapture()([1, 2]), [1, 2])
+
+
+def test_callable_capture(conduct):
+    value, experiment = conduct(lambda: 'abc', lambda: 'xyz', capture=len)
+    result = experiment.result
+    assert value == 'abc'
+    assert result.control.value == 3
+    assert result.match
+
+
+def test_failures_are_not_captured():
+    capture = mock.Mock(side_effect=lambda value: value)
+    experiment = laboratory.Experiment(capture=capture)
+    experiment.control(lambda: 1)
+    experiment.candidate(mock.Mock(side_effect=ValueError))
+    experiment.conduct()
+    capture.assert_called_once_with(1)
+
+
+def test_capture_exception_keeps_value(conduct):
+    class BrokenCapture(Capture):
+        def __call__(self, value):
+            raise ValueError()
+
+    value, experiment = conduct(lambda: 1, lambda: 1, capture=BrokenCapture())
+    assert value == 1
+    assert experiment.result.control.value == 1
+
+
+def test_concurrent_returns_raw_control_value(conduct):
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    try:
+        value, experiment = conduct(
+            lambda: [1], lambda: [1], capture=DigestCapture(), executor=executor,
+        )
+        assert value == [1]
+        assert experiment.result.match
+    finally:
+        executor.shutdown()
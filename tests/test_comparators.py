@@ -0,0 +1,172 @@
+import mock
+import pytest
+
+import laboratory
+from laboratory import comparators
+from laboratory.comparators import (
+    Budget, BudgetExceeded, Comparator, Comparison, DiffComparator,
+    DigestComparator, EqualityComparator, OrderedComparator, ToleranceComparator,
+)
+
+
+def test_comparison_truthiness():
+    assert Comparison(True)
+    assert not Comparison(False, [('[0]', 1, 2)])
+
+
+def test_equality_comparator():
+    assert EqualityComparator()(1, 1)
+    assert not EqualityComparator()(1, 2)
+
+
+def test_digest_comparator():
+    comparator = DigestComparator()
+    assert comparator({'a': [1, 2]}, {'a': [1, 2]})
+    assert not comparator({'a': [1, 2]}, {'a': [1, 3]})
+
+
+def test_digest_comparator_serializer():
+    comparator = DigestComparator(algorithm='md5', serializer=lambda v: repr(sorted(v)).encode())
+    assert comparator({3, 1, 2}, {1, 2, 3})
+
+
+def test_ordered_comparator_reports_first_difference():
+    comparison = OrderedComparator()([1, 2, 3, 4], [1, 2, 0, 0])
+    assert not comparison
+    assert comparison.differences == [('[2]', 3, 0)]
+
+    comparison = OrderedComparator()([1, 2], [1])
+    assert comparison.differences == [('len()', 2, 1)]
+
+
+def test_tolerance_comparator():
+    comparator = ToleranceComparator(abs_tol=0.01)
+    assert comparator({'a': [1.0, 2.0]}, {'a': [1.001, 2.0]})
+    assert not comparator({'a': [1.0, 2.0]}, {'a': [1.1, 2.0]})
+    assert not comparator({'a': 1.0}, {'b': 1.0})
+    assert not comparator(float('nan'), float('nan'))
+
+
+def test_array_comparator():
+    np = pytest.importorskip('numpy')
+    assert comparators.get('array')(np.arange(5), np.arange(5))
+    assert not comparators.get('array')(np.arange(5), np.arange(6))
+    assert comparators.get('array', atol=0.1)(np.zeros(3), np.zeros(3) + 0.01)
+
+
+def test_diff_comparator_paths():
+    control = {'users': [{'email': 'a@example.com'}, {'email': 'b@example.com'}], 'count': 2}
+    candidate = {'users': [{'email': 'a@example.com'}, {'email': 'c@example.com'}], 'total': 2}
+
+    comparison = DiffComparator()(control, candidate)
+    assert not comparison
+    assert ("['users'][1]['email']", 'b@example.com', 'c@example.com') in comparison.differences
+    assert ("['count']", 2, comparators._missing) in comparison.differences
+    assert ("['total']", comparators._missing, 2) in comparison.differences
+
+
+def test_diff_comparator_max_differences():
+    comparison = DiffComparator(max_differences=3)(list(range(10)), [-1] * 10)
+    assert len(comparison.differences) == 3
+
+
+def test_budget_exceeded_counts_as_match():
+    class SlowComparator(Comparator):
+        def compare(self, control, candidate, budget):
+            while True:
+                budget.tick()
+
+    comparison = SlowComparator(budget=0.001)(1, 2)
+    assert comparison
+    assert comparison.timed_out
+
+
+def test_digest_comparator_checks_budget_while_hashing():
+    value = b'x' * (comparators._CHUNK_BYTES * 2)
+    assert DigestComparator(budget=10)(value, value)
+
+    comparison = DigestComparator(budget=0)(value, value)
+    assert comparison.timed_out
+
+
+def test_timed_out_comparisons_are_unknown(result_experiment):
+    class SlowComparator(Comparator):
+        def compare(self, control, candidate, budget):
+            budget.check()
+            return control == candidate
+
+    experiment = result_experiment(comparator=SlowComparator(budget=0))
+    experiment.control(lambda: 1)
+    experiment.candidate(lambda: 2, name='slow')
+    experiment.conduct()
+
+    assert experiment.result.match
+    assert experiment.result.unknown == ['slow']
+
+
+def test_budget_without_limit_never_expires():
+    budget = Budget(None, interval=1)
+    for _ in range(1000):
+        budget.tick()
+
+    budget = Budget(0, interval=1)
+    with pytest.raises(BudgetExceeded):
+        budget.tick()
+        budget.tick()
+
+    Budget(None).check()
+    with pytest.raises(BudgetExceeded):
+        Budget(0).check()
+
+
+def test_registry(conduct):
+    assert isinstance(comparators.get('diff'), DiffComparator)
+    assert comparators.get('tolerance', abs_tol=1).abs_tol == 1
+
+    comparators.register('always', lambda: lambda control, candidate: True)
+    try:
+        _, experiment = conduct(lambda: 1, lambda: 2, comparator='always')
+        assert experiment.result.match
+    finally:
+        del comparators._registry['always']
+
+    with pytest.raises(KeyError):
+        comparators.get('nonexistent')
+
+
+def test_experiment_uses_comparator(conduct):
+    _, experiment = conduct(lambda: 1.0, lambda: 1.05, comparator=ToleranceComparator(abs_tol=0.1))
+    assert experiment.result.match
+    _, experiment = conduct(lambda: 1.0, lambda: 1.05)
+    assert not experiment.result.match
+
+
+def test_experiment_accepts_callable(conduct):
+    _, experiment = conduct(
+        lambda: {'id': 1, 'x': 1}, lambda: {'id': 1, 'x': 2},
+        comparator=lambda control, candidate: control['id'] == candidate['id'],
+    )
+    assert experiment.result.match
+
+
+def test_result_comparisons(conduct):
+    _, experiment = conduct(lambda: {'a': 1}, lambda: {'a': 2}, comparator='diff')
+    result = experiment.result
+    comparison, = result.comparisons
+    assert not comparison
+    assert comparison.differences == [("['a']", 1, 2)]
+    assert list(result.mismatches) == ['Candidate']
+
+
+def test_candidate_exception_is_mismatch(conduct):
+    _, experiment = conduct(lambda: 1, mock.Mock(side_effect=ValueError), comparator='diff')
+    assert not experiment.result.match
+
+
+def test_raise_on_mismatch_includes_differences(conduct):
+    with pytest.raises(laboratory.MismatchException) as e:
+        conduct(
+            lambda: {'a': [1, 2]}, lambda: {'a': [1, 3]},
+            comparator='diff', raise_on_mismatch=True,
+        )
+    assert "['a'][1]: 2 != 3" in str(e.value)
@@ -0,0 +1,296 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import mock
+import pytest
+
+import laboratory
+from laboratory.concurrency import BackgroundWorker, Scheduler, shared_executor
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=2)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def test_control_returns_before_candidates_complete(executor, result_experiment):
+    release = threading.Event()
+
+    def candidate():
+        release.wait(5)
+        return 1
+
+    experiment = result_experiment(executor=executor)
+    experiment.control(lambda: 1)
+    experiment.candidate(candidate)
+
+    assert experiment.conduct() == 1
+    assert not experiment.published.is_set()
+
+    release.set()
+    assert experiment.published.wait(5)
+    assert experiment.result.match
+
+
+def test_candidates_run_on_executor(executor, result_experiment):
+    threads = {}
+
+    def candidate(name):
+        threads[name] = threading.current_thread()
+        return name
+
+    experiment = result_experiment(executor=executor)
+    experiment.control(lambda: 'a')
+    experiment.candidate(candidate, args=['a'], name='a')
+    experiment.candidate(candidate, args=['b'], name='b')
+    experiment.conduct()
+
+    assert experiment.published.wait(5)
+    assert threading.current_thread() not in threads.values()
+
+    result = experiment.result
+    assert not result.match
+    assert sorted(c.name for c in result.candidates) == ['a', 'b']
+
+
+def test_candidate_timeout(executor, result_experiment):
+    release = threading.Event()
+
+    experiment = result_experiment(executor=executor, candidate_timeout=0.05)
+    experiment.control(lambda: True)
+    experiment.candidate(lambda: release.wait(5))
+
+    experiment.conduct()
+    assert experiment.published.wait(5)
+    release.set()
+
+    obs = experiment.result.candidates[0]
+    assert obs.failure
+    assert isinstance(obs.exception, laboratory.exceptions.TimeoutException)
+    assert not experiment.result.match
+
+
+def test_control_exception_publishes_nothing(executor, result_experiment):
+    def raise_exception():
+        raise KeyError('c')
+
+    experiment = result_experiment(executor=executor)
+    experiment.control(raise_exception)
+    experiment.candidate(lambda: True)
+
+    with pytest.raises(KeyError):
+        experiment.conduct()
+
+    assert not experiment.published.wait(0.1)
+
+
+def test_candidate_exception_is_recorded(executor, result_experiment):
+    def raise_exception():
+        raise KeyError('c')
+
+    experiment = result_experiment(executor=executor)
+    experiment.control(lambda: True)
+    experiment.candidate(raise_exception)
+    experiment.conduct()
+
+    assert experiment.published.wait(5)
+    obs = experiment.result.candidates[0]
+    assert isinstance(obs.exception, KeyError)
+
+
+def test_publish_exception_is_logged(executor, result_experiment):
+    experiment = result_experiment(executor=executor)
+    experiment.publish = mock.Mock(side_effect=ValueError)
+    experiment.control(lambda: True)
+    experiment.candidate(lambda: True)
+
+    with mock.patch('laboratory.experiment.logger') as logger:
+        assert experiment.conduct() is True
+        executor.shutdown(wait=True)
+
+    assert experiment.publish.called
+    assert logger.exception.called
+
+
+def test_submit_failure_is_recorded_on_the_candidate(result_experiment):
+    pool = ThreadPoolExecutor(max_workers=1)
+    pool.shutdown(wait=True)
+
+    experiment = result_experiment(executor=pool)
+    experiment.control(lambda: 1)
+    experiment.candidate(lambda: 1)
+
+    with mock.patch('laboratory.concurrency.logger') as logger:
+        assert experiment.conduct() == 1
+    assert logger.exception.called
+
+    assert experiment.published.wait(5)
+    obs = experiment.result.candidates[0]
+    assert obs.failure
+    assert isinstance(obs.exception, RuntimeError)
+
+
+def test_mismatch_is_logged_and_published(executor, result_experiment):
+    experiment = result_experiment(executor=executor, raise_on_mismatch=True)
+    experiment.control(lambda: 1)
+    experiment.candidate(lambda: 2)
+
+    with mock.patch('laboratory.experiment.logger') as logger:
+        assert experiment.conduct() == 1
+        assert experiment.published.wait(5)
+
+    assert not experiment.result.match
+    assert logger.error.called
+
+
+def test_shared_executor_is_shared():
+    assert shared_executor() is shared_executor()
+
+
+def test_scheduler_runs_and_cancels_callbacks():
+    scheduler = Scheduler()
+    ran = threading.Event()
+    cancelled = mock.Mock()
+
+    entry = scheduler.schedule(0.01, cancelled)
+    scheduler.cancel(entry)
+    scheduler.schedule(0.02, ran.set)
+
+    assert ran.wait(5)
+    assert not cancelled.called
+
+
+def test_worker_runs_candidates_after_control_returns(result_experiment):
+    order = []
+    worker = BackgroundWorker(maxsize=10)
+
+    def control():
+        order.append('control')
+        return 1
+
+    def candidate():
+        order.append('candidate')
+        return 1
+
+    experiment = result_experiment(worker=worker)
+    experiment.control(control)
+    experiment.candidate(candidate)
+
+    assert experiment.conduct() == 1
+    assert experiment.published.wait(5)
+    assert order == ['control', 'candidate']
+    assert experiment.result.match
+    assert worker.submitted == 1
+
+
+def block(started, release):
+    started.set()
+    release.wait(5)
+
+
+def test_worker_drops_work_when_full():
+    started, release = threading.Event(), threading.Event()
+    worker = BackgroundWorker(maxsize=1)
+    worker.submit(block, started, release)
+    started.wait(5)
+
+    # the worker thread is busy with the first job, so the queue
+    # will accept a single job before dropping anything else
+    accepted = [worker.submit(lambda: None) for _ in range(5)]
+    release.set()
+    worker.join()
+
+    assert accepted == [True, False, False, False, False]
+    assert worker.dropped == 4
+    assert worker.submitted == 2
+
+
+def test_worker_sheds_work_above_threshold():
+    started, release = threading.Event(), threading.Event()
+    worker = BackgroundWorker(maxsize=100, shed_above=0.0)
+    worker.submit(block, started, release)
+    started.wait(5)
+
+    accepted = [worker.submit(lambda: None) for _ in range(100)]
+    release.set()
+    worker.join()
+
+    assert worker.dropped > 0
+    assert accepted.count(True) < 100
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires fork')
+def test_worker_discards_parent_jobs_after_fork():
+    started, release = threading.Event(), threading.Event()
+    ran = []
+    worker = BackgroundWorker(maxsize=10)
+    worker.submit(block, started, release)
+    started.wait(5)
+    worker.submit(ran.append, 'parent')
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            worker.join()
+            worker.submit(ran.append, 'child')
+            worker.join()
+            os.write(write, ('%s %s' % (','.join(ran), worker.dropped)).encode())
+        finally:
+            os._exit(0)
+
+    os.close(write)
+    child = os.read(read, 100)
+    os.close(read)
+    os.waitpid(pid, 0)
+    release.set()
+    worker.join()
+
+    assert child == b'child 1'
+    assert ran == ['parent']
+    assert worker.dropped == 0
+
+
+def test_worker_captures_control_before_returning(result_experiment):
+    started, release = threading.Event(), threading.Event()
+    worker = BackgroundWorker()
+    worker.submit(block, started, release)
+    started.wait(5)
+
+    experiment = result_experiment(worker=worker, capture=list)
+    experiment.control(lambda: [1])
+    experiment.candidate(lambda: [1])
+    value = experiment.conduct()
+    value.append(2)
+    release.set()
+    worker.join()
+
+    assert experiment.result.control.value == [1]
+    assert experiment.result.match
+
+
+def test_worker_logs_exceptions():
+    worker = BackgroundWorker()
+
+    with mock.patch('laboratory.concurrency.logger') as logger:
+        worker.submit(lambda: {}['a'])
+        worker.join()
+
+    assert logger.exception.called
+
+
+def test_worker_logs_and_publishes_mismatches(result_experiment):
+    worker = BackgroundWorker()
+    experiment = result_experiment(worker=worker, raise_on_mismatch=True)
+    experiment.control(lambda: 1)
+    experiment.candidate(lambda: 2)
+
+    with mock.patch('laboratory.experiment.logger') as logger:
+        assert experiment.conduct() == 1
+        assert experiment.published.wait(5)
+
+    assert list(experiment.result.mismatches) == ['Candidate']
+    assert logger.error.called
@@ -27,3 +27,115 @@ def test_decorated_functions():
         dummy_control_mismatch("blah")
 
     assert dummy_control_match("blah") == True
+
+
+def test_decorator_builds_experiment_once():
+    class CountingExperiment(Experiment):
+        instances = 0
+
+        def __init__(self, *args, **kwargs):
+            super(CountingExperiment, self).__init__(*args, **kwargs)
+            CountingExperiment.instances += 1
+
+    @CountingExperiment.decorator(candidate=dummy_candidate_match)
+    def control(x):
+        return True
+
+    control(1)
+    control(2)
+    assert CountingExperiment.instances == 1
+    assert isinstance(control.experiment, CountingExperiment)
+
+
+def test_decorated_function_arguments():
+    candidate = mock.Mock(return_value=3)
+
+    class ResultExperiment(Experiment):
+        def publish(self, result):
+            self.results.append(result)
+
+    @ResultExperiment.decorator(candidate=candidate)
+    def add(a, b=0):
+        return a + b
+
+    add.experiment.results = []
+
+    assert add(1, b=2) == 3
+    assert add(2) == 2
+    candidate.assert_any_call(1, b=2)
+    candidate.assert_any_call(2)
+    assert [r.match for r in add.experiment.results] == [True, False]
+
+
+def test_decorated_function_called_from_threads():
+    import threading
+
+    @Experiment.decorator(candidate=lambda x: x, raise_on_mismatch=True)
+    def identity(x):
+        return x
+
+    errors = []
+
+    def call():
+        for i in range(200):
+            try:
+                assert identity(i) == i
+            except Exception as ex:
+                errors.append(ex)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+
+def test_disabled_decorated_function_skips_experiment():
+    candidate = mock.Mock()
+
+    class DisabledExperiment(Experiment):
+        def enabled(self):
+            return False
+
+    @DisabledExperiment.decorator(candidate=candidate)
+    def control(x):
+        return x
+
+    with mock.patch.object(DisabledExperiment, '_conduct') as conduct:
+        assert control(1) == 1
+
+    assert not conduct.called
+    assert not candidate.called
+
+
+def test_decorated_function_checks_enabled_once():
+    class EnabledExperiment(Experiment):
+        enabled = mock.Mock(return_value=True)
+
+    @EnabledExperiment.decorator(candidate=dummy_candidate_match)
+    def control(x):
+        return True
+
+    control(1)
+    assert EnabledExperiment.enabled.call_count == 1
+
+
+def test_decorated_function_runs_overridden_conduct():
+    class TracingExperiment(Experiment):
+        conducted = []
+
+        def conduct(self, randomize=True):
+            value = super(TracingExperiment, self).conduct(randomize)
+            self.conducted.append(value)
+            return value
+
+    @TracingExperiment.decorator(candidate=lambda a, b=0: a + b)
+    def add(a, b=0):
+        return a + b
+
+    assert add(1, b=2) == 3
+    assert add(2) == 2
+    assert TracingExperiment.conducted == [3, 2]
+    assert isinstance(add.experiment, TracingExperiment)
@@ -173,3 +173,141 @@ def test_functions_executed_in_order():
 
     control_indexes = [run_experiment() for i in range(5)]
     assert set(control_indexes) == set([0])
+
+
+def test_context_is_isolated_from_experiment():
+    experiment = ResultExperiment(context={'nested': {'a': 1}})
+    experiment.control(lambda: 0)
+    experiment.candidate(lambda: 0)
+    experiment.conduct()
+
+    ctx = experiment._result.control.get_context()
+    ctx['nested']['a'] = 2
+    experiment._result.candidates[0].update_context({'b': 2})
+
+    assert experiment.get_context() == {'nested': {'a': 1}}
+    assert experiment._result.candidates[0].get_context() == {'nested': {'a': 1}, 'b': 2}
+
+
+def test_context_is_snapshotted_when_conducted():
+    context = {'nested': {'a': 1}}
+    experiment = ResultExperiment(context=context)
+    experiment.control(lambda: 0)
+    experiment.candidate(lambda: 0)
+    experiment.conduct()
+
+    context['b'] = 2
+    context['nested'] = {'a': 2}
+
+    assert experiment._result.control.get_context() == {'nested': {'a': 1}}
+    assert experiment._result.candidates[0].get_context() == {'nested': {'a': 1}}
+
+
+@mock.patch('laboratory.experiment.deepcopy', create=True)
+@mock.patch('laboratory.observation.deepcopy')
+def test_context_is_not_copied_until_requested(deepcopy, experiment_deepcopy):
+    experiment = ResultExperiment(context={'ctx': True})
+    experiment.control(lambda: 0, context={'control': True})
+    experiment.conduct()
+
+    obs = experiment._result.control
+    obs.update_context({'updated': True})
+    assert obs.get_context_value('ctx') is True
+    assert obs.get_context_value('control') is True
+    assert obs.get_context_value('updated') is True
+    assert obs.get_context_value('missing', 'default') == 'default'
+    assert not deepcopy.called
+    assert not experiment_deepcopy.called
+
+    deepcopy.side_effect = dict
+    assert obs.get_context() == {'ctx': True, 'control': True, 'updated': True}
+    assert deepcopy.call_count == 1
+
+
+def test_observation_timing():
+    experiment = ResultExperiment(cpu_time=True)
+    experiment.control(lambda: sum(range(1000)))
+    experiment.conduct()
+
+    obs = experiment._result.control
+    assert isinstance(obs.duration, int)
+    assert obs.duration >= 0
+    assert obs.duration_timedelta.total_seconds() * 1e9 == pytest.approx(obs.duration, abs=1000)
+    assert obs.start_time <= obs.end_time
+    assert obs.cpu_ns is not None and obs.cpu_ns >= 0
+
+
+def test_observation_has_no_instance_dict():
+    obs = Observation('an observation')
+    with pytest.raises(AttributeError):
+        obs.unknown_attribute = True
+
+
+def test_comparison_is_lazy_and_short_circuits():
+    experiment = ResultExperiment()
+    experiment.compare = mock.Mock(return_value=False)
+    experiment.control(lambda: 0)
+    experiment.candidate(lambda: 1, name='first')
+    experiment.candidate(lambda: 2, name='second')
+    experiment.conduct(randomize=False)
+
+    result = experiment._result
+    assert not experiment.compare.called
+
+    assert not result.match
+    assert experiment.compare.call_count == 1
+
+    assert sorted(result.mismatches) == ['first', 'second']
+    assert experiment.compare.call_count == 2
+
+    assert not result.match
+    assert experiment.compare.call_count == 2
+
+
+def test_mismatches():
+    experiment = ResultExperiment()
+    experiment.control(lambda: 0)
+    experiment.candidate(lambda: 0, name='match')
+    experiment.candidate(lambda: 1, name='mismatch')
+    experiment.conduct()
+
+    mismatches = experiment._result.mismatches
+    assert list(mismatches) == ['mismatch']
+    assert mismatches['mismatch'].value == 1
+
+
+@mock.patch('laboratory.experiment.Observation')
+def test_disabled_experiment_calls_control_directly(observation):
+    experiment = laboratory.Experiment()
+    experiment.enabled = lambda: False
+    experiment.control(lambda x: x * 2, args=[2])
+    experiment.candidate(lambda x: x)
+
+    assert experiment.conduct() == 4
+    assert not observation.called
+
+
+def test_enabled_is_cached_for_ttl():
+    enabled = mock.Mock(return_value=False)
+    experiment = laboratory.Experiment(enabled_ttl=60)
+    experiment.enabled = enabled
+    experiment.control(lambda: True)
+
+    for _ in range(3):
+        experiment.conduct()
+    assert enabled.call_count == 1
+
+    experiment.reload_enabled()
+    experiment.conduct()
+    assert enabled.call_count == 2
+
+
+def test_enabled_cache_expires():
+    enabled = mock.Mock(return_value=True)
+    experiment = laboratory.Experiment(enabled_ttl=0)
+    experiment.enabled = enabled
+    experiment.control(lambda: True)
+
+    experiment.conduct()
+    experiment.conduct()
+    assert enabled.call_count == 2
@@ -0,0 +1,203 @@
+import concurrent.futures
+
+import mock
+import pytest
+
+import laboratory
+from laboratory.isolation import (
+    CopyOnWrite, CopyOnWriteDict, CopyOnWriteList, Isolation, ReadOnly, ReadOnlyList,
+)
+
+
+def append(items):
+    items.append(4)
+    return len(items)
+
+
+def test_read_only_views():
+    isolation = ReadOnly()
+    data = {'a': 1}
+    view = isolation.isolate(data)
+    assert view['a'] == 1
+    with pytest.raises(TypeError):
+        view['a'] = 2
+
+    items = [1, 2]
+    view = isolation.isolate(items)
+    assert view == [1, 2] and list(view) == [1, 2] and view[-1] == 2
+    assert not hasattr(view, 'append')
+
+    buf = bytearray(b'abc')
+    view = isolation.isolate(buf)
+    assert view.readonly and bytes(view) == b'abc'
+    with pytest.raises(TypeError):
+        view[0] = 0
+
+    assert isolation.isolate(b'abc') == b'abc'
+    obj = object()
+    assert isolation.isolate(obj) is obj
+
+
+def test_read_only_numpy_arrays():
+    numpy = pytest.importorskip('numpy')
+    array = numpy.arange(3)
+    view = ReadOnly().isolate(array)
+    assert isinstance(view, numpy.ndarray) and not view.flags.writeable
+    assert array.flags.writeable
+    with pytest.raises(ValueError):
+        view[0] = 1
+
+
+def test_read_only_candidate_fails_instead_of_mutating(conduct):
+    items = [1, 2, 3]
+    value, experiment = conduct(len, append, isolation=ReadOnly(), args=[items])
+    result = experiment.result
+
+    assert value == 3
+    assert items == [1, 2, 3]
+    assert result.candidates[0].failure
+
+
+def test_copy_on_write_dict():
+    data = {'a': 1}
+    wrapper = CopyOnWriteDict(data)
+    assert wrapper['a'] == 1 and dict(wrapper) == data and wrapper == data
+    assert not wrapper.copied
+
+    wrapper['b'] = 2
+    del wrapper['a']
+    assert wrapper.copied
+    assert dict(wrapper) == {'b': 2}
+    assert data == {'a': 1}
+
+
+def test_copy_on_write_list():
+    items = [3, 1, 2]
+    wrapper = CopyOnWriteList(items)
+    assert wrapper == items and not wrapper.copied
+
+    wrapper.append(0)
+    wrapper.sort()
+    assert wrapper.copied
+    assert list(wrapper) == [0, 1, 2, 3]
+    assert items == [3, 1, 2]
+
+
+def test_copy_on_write_candidates_see_the_original(conduct):
+    items = [1, 2, 3]
+    candidates = [('a', append), ('b', append)]
+    value, experiment = conduct(len, *candidates, isolation=CopyOnWrite(), args=[items])
+    result = experiment.result
+
+    assert value == 3
+    assert items == [1, 2, 3]
+    assert [obs.value for obs in result.candidates] == [4, 4]
+    assert result.match is False
+
+
+def test_control_is_isolated(conduct):
+    items = [1, 2, 3]
+    value, experiment = conduct(append, len, isolation=CopyOnWrite(), args=[items])
+    assert value == 4
+    assert items == [1, 2, 3]
+    assert experiment.result.candidates[0].value == 3
+
+    with pytest.raises(AttributeError):
+        conduct(append, len, isolation=ReadOnly(), args=[items])
+    assert items == [1, 2, 3]
+
+
+def test_buffers_are_snapshotted_before_any_function_runs(conduct):
+    buf = bytearray(b'abc')
+
+    def overwrite(view):
+        buf[:] = b'xyz'
+        return bytes(view)
+
+    candidates = [('overwrite', overwrite), ('read', bytes)]
+    value, experiment = conduct(bytes, *candidates, isolation=ReadOnly(), args=[buf])
+    result = experiment.result
+
+    assert value == b'abc'
+    assert [obs.value for obs in result.candidates] == [b'abc', b'abc']
+    assert buf == bytearray(b'xyz')
+
+
+def test_prepare_snapshots_shared_arguments_once():
+    isolation = ReadOnly()
+    isolation.snapshot = mock.Mock(side_effect=lambda value: value)
+    buf = bytearray(b'abc')
+
+    prepared = isolation.prepare([([buf], {}), ([buf], {'other': buf})])
+    assert isolation.snapshot.call_count == 1
+    assert len(prepared) == 2
+    assert bytes(prepared[1][1]['other']) == b'abc'
+
+
+def test_detects_which_candidate_mutated(conduct):
+    items = [1, 2, 3]
+    data = {'a': [1]}
+
+    def mutate_nested(items, data):
+        data['a'].append(2)
+
+    candidates = [('good', lambda items, data: None), ('bad', mutate_nested)]
+    _, experiment = conduct(
+        lambda items, data: None, *candidates,
+        isolation=ReadOnly(detect=True), args=[items], kwargs={'data': data}
+    )
+    result = experiment.result
+
+    assert result.mutations == {'bad': ('data',)}
+    by_name = dict((obs.name, obs) for obs in result.candidates)
+    assert by_name['good'].mutations == ()
+    assert result.control.mutations == ()
+
+
+def test_detects_buffer_mutation_by_the_control(conduct):
+    buf = bytearray(b'abc')
+
+    def clear(buf):
+        buf[:] = b'xyz'
+
+    _, experiment = conduct(clear, lambda buf: None, isolation=Isolation(detect=True), args=[buf])
+    result = experiment.result
+    assert result.mutations == {'Control': (0,)}
+
+
+def test_no_detection_by_default(conduct):
+    _, experiment = conduct(len, append, isolation=Isolation(), args=[[1]])
+    result = experiment.result
+    assert result.mutations == {}
+    assert result.control.mutations is None
+
+
+def test_isolation_with_executor():
+    items = [1, 2, 3]
+    candidate = mock.Mock(side_effect=append)
+    experiment = laboratory.Experiment(isolation=ReadOnly())
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        experiment.executor = executor
+        experiment.control(len, args=[items])
+        experiment.candidate(candidate, args=[items])
+        assert experiment.conduct() == 3
+
+    assert items == [1, 2, 3]
+    assert isinstance(candidate.call_args[0][0], ReadOnlyList)
+
+
+def test_control_is_isolated_with_worker(conduct):
+    from laboratory.concurrency import BackgroundWorker
+
+    items = [1, 2, 3]
+    value, experiment = conduct(
+        append, len, isolation=CopyOnWrite(), args=[items], worker=BackgroundWorker(),
+    )
+
+    assert value == 4
+    assert experiment.result.candidates[0].value == 3
+    assert items == [1, 2, 3]
+
+
+def test_read_only_list_repr():
+    assert repr(ReadOnlyList([1])) == 'ReadOnlyList([1])'
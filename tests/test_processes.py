@@ -0,0 +1,190 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import textwrap
+
+import mock
+import pytest
+
+import laboratory
+from laboratory import concurrency
+from laboratory.observation import Observation, unrecorded
+
+
+def pid(*args):
+    return os.getpid()
+
+
+def describe(value, scale=1):
+    return type(value).__name__, len(value) * scale
+
+
+def raise_value_error():
+    raise ValueError('candidate failed')
+
+
+@pytest.fixture(scope='module')
+def executor():
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork'))
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def test_candidates_run_in_another_process(executor, conduct):
+    value, experiment = conduct(
+        pid, pid, executor=executor, cpu_time=True,
+        context={'user': 1}, candidate_context={'candidate': True},
+    )
+    assert value == os.getpid()
+
+    candidate, = experiment.result.candidates
+    assert candidate.value != os.getpid()
+    assert candidate.duration >= 0
+    assert candidate.cpu_ns is not None
+    assert candidate.get_context() == {'user': 1, 'candidate': True}
+
+
+def test_candidate_exception_maps_back(executor, conduct):
+    _, experiment = conduct(lambda: None, raise_value_error, executor=executor)
+
+    result = experiment.result
+    candidate, = result.candidates
+    assert candidate.failure
+    assert isinstance(candidate.exception, ValueError)
+    assert candidate.exc_info[2] is None
+    assert 'in raise_value_error' in candidate.format_exception()
+    assert not result.match
+
+
+def test_mismatch_exception_includes_remote_traceback():
+    experiment = laboratory.Experiment(raise_on_mismatch=True)
+    control = Observation('Control')
+    control.record(None)
+    candidate = Observation('Candidate')
+    try:
+        raise_value_error()
+    except ValueError as e:
+        candidate.set_exception(e)
+    candidate = pickle.loads(pickle.dumps(candidate))
+
+    with pytest.raises(laboratory.MismatchException) as e:
+        experiment.compare(control, candidate)
+    assert 'in raise_value_error' in str(e.value)
+
+
+def test_large_arguments_sent_through_shared_memory(executor, conduct):
+    data = b'x' * 100
+    with mock.patch.object(concurrency, 'SHARED_MEMORY_MIN_BYTES', 10), \
+            mock.patch.object(concurrency, '_release', wraps=concurrency._release) as release:
+        _, experiment = conduct(
+            describe, describe, executor=executor, args=(data,), kwargs={'scale': 2},
+        )
+
+    result = experiment.result
+    assert result.match
+    assert result.candidates[0].value == ('bytes', 200)
+    buffer, = release.call_args[0][0]
+    assert buffer.kind == 'bytes'
+
+
+def test_shared_buffers_round_trip():
+    with mock.patch.object(concurrency, 'SHARED_MEMORY_MIN_BYTES', 1):
+        buffers = []
+        shared = concurrency._share(bytearray(b'abc'), buffers)
+        assert concurrency._share(b'', buffers) == b''
+        assert concurrency._share('abc', buffers) == 'abc'
+
+    try:
+        assert pickle.loads(pickle.dumps(shared)).restore() == bytearray(b'abc')
+    finally:
+        concurrency._release(buffers)
+
+    with pytest.raises(FileNotFoundError):
+        shared.restore()
+
+
+@pytest.mark.skipif(
+    'fork' not in multiprocessing.get_all_start_methods(), reason='requires fork',
+)
+def test_workers_do_not_track_shared_memory(tmpdir):
+    # resource trackers only complain when they shut down, in their own process,
+    # so the experiment is run in a separate interpreter
+    script = tmpdir.join('shared.py')
+    script.write(textwrap.dedent('''
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        import os
+
+        import laboratory
+        from laboratory import concurrency
+
+        concurrency.SHARED_MEMORY_MIN_BYTES = 10
+        pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork'))
+        pool.submit(os.getpid).result()
+
+        experiment = laboratory.Experiment(executor=pool)
+        experiment.control(len, args=[b'x' * 100])
+        experiment.candidate(len, args=[b'x' * 100])
+        experiment.conduct()
+        pool.shutdown(wait=True)
+    '''))
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.run(
+        [sys.executable, str(script)], stderr=subprocess.PIPE, timeout=60,
+        env=dict(os.environ, PYTHONPATH=root),
+    )
+    assert process.returncode == 0, process.stderr
+    assert b'resource_tracker' not in process.stderr
+
+
+def test_numpy_arrays_round_trip():
+    np = pytest.importorskip('numpy')
+    value = np.arange(12, dtype='float32').reshape(3, 4)
+    with mock.patch.object(concurrency, 'SHARED_MEMORY_MIN_BYTES', 1):
+        buffers = []
+        shared = concurrency._share(value, buffers)
+    try:
+        restored = pickle.loads(pickle.dumps(shared)).restore()
+    finally:
+        concurrency._release(buffers)
+    assert (restored == value).all()
+    assert restored.dtype == value.dtype
+
+
+def test_observation_pickles():
+    obs = Observation('Candidate', {'a': 1})
+    try:
+        raise_value_error()
+    except ValueError as e:
+        obs.set_exception(e)
+
+    copy = pickle.loads(pickle.dumps(obs))
+    assert copy.value is unrecorded
+    assert copy.get_context() == {'a': 1}
+    assert copy.format_exception() == obs.format_exception()
+    assert 'ValueError: candidate failed' in copy.format_exception()
+
+
+def test_shared_process_executor_is_shared():
+    with mock.patch.object(concurrency, '_shared_process_executor', None):
+        executor = concurrency.shared_process_executor(max_workers=1)
+        try:
+            assert concurrency.shared_process_executor() is executor
+            assert isinstance(executor, ProcessPoolExecutor)
+        finally:
+            executor.shutdown(wait=True)
+
+
+def test_shared_memory_failure_is_recorded_on_the_candidate(executor, conduct):
+    data = b'x' * concurrency.SHARED_MEMORY_MIN_BYTES
+    with mock.patch.object(concurrency, '_SharedBuffer', side_effect=OSError('no space')):
+        value, experiment = conduct(len, len, executor=executor, args=[data])
+
+    assert value == len(data)
+    candidate, = experiment.result.candidates
+    assert candidate.failure
+    assert isinstance(candidate.exception, OSError)
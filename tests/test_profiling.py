@@ -0,0 +1,85 @@
+import gc
+import pickle
+import tracemalloc
+
+import mock
+import pytest
+
+from laboratory.profiling import Profile, Profiler
+from laboratory.publishing import observation_to_dict
+
+
+def allocate():
+    return [object() for _ in range(10000)]
+
+
+def collect():
+    gc.collect()
+    return 1
+
+
+@pytest.fixture
+def stop_tracemalloc():
+    tracing = tracemalloc.is_tracing()
+    yield
+    if not tracing:
+        tracemalloc.stop()
+
+
+def test_no_profile_by_default(conduct):
+    _, experiment = conduct(collect, allocate)
+    assert experiment.result.control.profile is None
+
+
+def test_gc_pauses(conduct):
+    _, experiment = conduct(collect, allocate, profiler=Profiler())
+    result = experiment.result
+    assert result.control.profile.gc_collections >= 1
+    assert result.control.profile.gc_ns > 0
+    assert result.control.profile.memory_delta is None
+    assert result.control.profile.stats is None
+
+
+def test_memory(stop_tracemalloc, conduct):
+    _, experiment = conduct(collect, allocate, profiler=Profiler(memory=True, gc=False))
+    profile = experiment.result.candidates[0].profile
+    assert profile.memory_peak > 10000 * 16
+    assert profile.allocated_blocks > 0
+    assert profile.gc_collections is None
+
+
+def test_sampled_cprofile(conduct):
+    with mock.patch('laboratory.profiling.random.random', return_value=0.5):
+        _, experiment = conduct(collect, allocate, profiler=Profiler(sample=0.1))
+        assert experiment.result.control.profile.stats is None
+        _, experiment = conduct(collect, allocate, profiler=Profiler(sample=0.9, limit=3))
+        profile = experiment.result.candidates[0].profile
+
+    assert len(profile.stats) <= 3
+    function, calls, total, cumulative = profile.stats[0]
+    assert 'allocate' in function
+    assert calls == 1
+    assert cumulative >= total
+
+
+def test_profile_recorded_when_function_raises(conduct):
+    _, experiment = conduct(collect, mock.Mock(side_effect=ValueError), profiler=Profiler())
+    result = experiment.result
+    assert result.candidates[0].failure
+    assert result.candidates[0].profile.gc_collections is not None
+
+
+def test_profile_published_and_pickled(conduct):
+    _, experiment = conduct(collect, allocate, profiler=Profiler())
+    result = experiment.result
+    data = observation_to_dict(result.control)
+    assert data['profile']['gc_collections'] >= 1
+
+    copy = pickle.loads(pickle.dumps(result.control))
+    assert copy.profile.gc_ns == result.control.profile.gc_ns
+
+
+def test_profile_repr():
+    profile = Profile()
+    profile.gc_ns = 5
+    assert repr(profile) == 'Profile(gc_ns=5)'
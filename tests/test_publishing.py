@@ -0,0 +1,216 @@
+import json
+import os
+import socket
+import threading
+
+import mock
+import pytest
+
+from laboratory.publishing import (
+    BufferedPublisher, CallbackSink, JSONLinesSink, StatsdSink, result_to_dict,
+)
+
+
+def test_experiment_publishes_to_publisher(conduct):
+    publisher = mock.Mock()
+    conduct(lambda: 1, lambda: 1, name='exp', publisher=publisher)
+
+    assert publisher.publish.called
+    result = publisher.publish.call_args[0][0]
+    assert result.match
+
+
+def test_results_are_written_in_batches(conduct):
+    batches = []
+    written = threading.Event()
+
+    def callback(results):
+        batches.append(results)
+        written.set()
+
+    publisher = BufferedPublisher([CallbackSink(callback)], batch_size=3, flush_interval=60)
+    for _ in range(3):
+        conduct(lambda: 1, lambda: 1, name='exp', publisher=publisher)
+
+    assert written.wait(5)
+    publisher.close()
+    assert [len(batch) for batch in batches] == [3]
+    assert publisher.published.value == 3
+
+
+def test_results_are_flushed_on_interval(conduct):
+    written = threading.Event()
+    publisher = BufferedPublisher(
+        [CallbackSink(lambda results: written.set())], batch_size=100, flush_interval=0.01,
+    )
+    conduct(lambda: 1, lambda: 1, name='exp', publisher=publisher)
+
+    assert written.wait(5)
+    publisher.close()
+
+
+def test_close_flushes_buffer(conduct):
+    sink = mock.Mock()
+    publisher = BufferedPublisher([sink], batch_size=100, flush_interval=60)
+    conduct(lambda: 1, lambda: 1, name='exp', publisher=publisher)
+    publisher.close()
+
+    assert sink.write.called
+    assert sink.close.called
+
+
+def test_results_are_compared_before_buffering(result_experiment):
+    sink = mock.Mock()
+    publisher = BufferedPublisher([sink], batch_size=100, flush_interval=60)
+    experiment = result_experiment(name='compared before buffering', publisher=publisher)
+    experiment.control(lambda: [1])
+    experiment.candidate(lambda: [1])
+
+    value = experiment.conduct()
+    value.append(2)
+    publisher.close()
+
+    assert experiment.result.match
+    assert experiment._registration.mismatches.value == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires fork')
+def test_forked_child_does_not_write_parent_results(conduct):
+    written = []
+    publisher = BufferedPublisher(
+        [CallbackSink(written.extend)], batch_size=100, flush_interval=60,
+    )
+    conduct(lambda: 1, lambda: 1, name='exp', publisher=publisher)
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            conduct(lambda: 2, lambda: 2, name='exp', publisher=publisher)
+            # as the close() registered with atexit would
+            publisher.close()
+            values = ','.join(str(result.control.value) for result in written)
+            os.write(write, values.encode())
+        finally:
+            os._exit(0)
+
+    os.close(write)
+    child = os.read(read, 100)
+    os.close(read)
+    os.waitpid(pid, 0)
+    publisher.close()
+
+    assert child == b'2'
+    assert [result.control.value for result in written] == [1]
+
+
+def test_full_buffer_drops_results():
+    sink = mock.Mock()
+    publisher = BufferedPublisher([sink], batch_size=100, flush_interval=60, maxsize=2)
+    assert [publisher.publish(mock.Mock()) for _ in range(4)] == [True, True, False, False]
+    assert publisher.dropped.value == 2
+    publisher.close()
+
+
+def test_full_buffer_blocks_until_timeout():
+    publisher = BufferedPublisher(
+        [mock.Mock()], batch_size=100, flush_interval=60, maxsize=1,
+        block=True, block_timeout=0.01,
+    )
+    assert publisher.publish(mock.Mock())
+    assert not publisher.publish(mock.Mock())
+    publisher.close()
+
+
+def test_blocked_publish_resumes_when_space_is_made():
+    publisher = BufferedPublisher(
+        [mock.Mock()], batch_size=100, flush_interval=60, maxsize=1, block=True,
+    )
+    assert publisher.publish(mock.Mock())
+    timer = threading.Timer(0.01, publisher.flush)
+    timer.start()
+    assert publisher.publish(mock.Mock())
+    timer.join()
+    publisher.close()
+
+
+def test_results_published_after_close_are_dropped():
+    sink = mock.Mock()
+    publisher = BufferedPublisher([sink], batch_size=100, flush_interval=60)
+    publisher.close()
+
+    assert not publisher.publish(mock.Mock())
+    assert publisher.dropped.value == 1
+    assert publisher.published.value == 0
+    assert not sink.write.called
+
+
+def test_sink_exceptions_are_logged(conduct):
+    sink = mock.Mock()
+    sink.write.side_effect = ValueError
+    publisher = BufferedPublisher([sink], batch_size=100, flush_interval=60)
+    conduct(lambda: 1, lambda: 1, name='exp', publisher=publisher)
+
+    with mock.patch('laboratory.publishing.logger') as logger:
+        publisher.flush()
+    assert logger.exception.called
+    publisher.close()
+
+
+def test_jsonlines_sink(tmpdir, conduct):
+    path = str(tmpdir.join('results.jsonl'))
+    publisher = BufferedPublisher([JSONLinesSink(path)], flush_interval=60)
+    conduct(lambda: 1, lambda: object(), name='exp', publisher=publisher)
+    publisher.close()
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+
+    assert len(lines) == 1
+    assert lines[0]['experiment'] == 'exp'
+    assert lines[0]['match'] is False
+    assert lines[0]['control']['value'] == 1
+    assert lines[0]['candidates'][0]['value'].startswith('<object')
+
+
+def test_statsd_sink(conduct):
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+
+    sink = StatsdSink(port=server.getsockname()[1], prefix='lab')
+    publisher = BufferedPublisher([sink], flush_interval=60)
+    conduct(lambda: 1, lambda: 1, name='exp', publisher=publisher)
+    publisher.close()
+
+    metrics = server.recv(512).decode('utf-8').split('\n')
+    server.close()
+
+    assert 'lab.exp.match:1|c' in metrics
+    assert any(m.startswith('lab.exp.Control:') and m.endswith('|ms') for m in metrics)
+    assert any(m.startswith('lab.exp.Candidate:') for m in metrics)
+
+
+def test_statsd_sink_splits_packets():
+    sink = StatsdSink(packet_size=64)
+    sink._socket = mock.Mock()
+    result = mock.Mock(match=True, candidates=[])
+    result.experiment.name = 'exp'
+    result.control.name = 'Control'
+    result.control.duration = 1000
+    result.control.failure = False
+
+    sink.write([result] * 4)
+    packets = [c[0][0] for c in sink._socket.sendto.call_args_list]
+    assert len(packets) > 1
+    assert all(len(p) <= 64 for p in packets)
+
+
+def test_result_to_dict(conduct):
+    publisher = mock.Mock()
+    conduct(lambda: 1, lambda: {}['a'], name='exp', publisher=publisher)
+    data = result_to_dict(publisher.publish.call_args[0][0])
+
+    assert data['match'] is False
+    assert data['candidates'][0]['exception'].startswith('KeyError')
+    assert isinstance(data['control']['duration'], int)
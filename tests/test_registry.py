@@ -0,0 +1,167 @@
+import json
+import signal
+import time
+
+import mock
+import pytest
+
+import laboratory
+from laboratory.registry import Registry, registry
+from laboratory.sampling import PercentageSampler
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    registry.reset()
+    yield
+    registry.unwatch()
+    registry.reset()
+
+
+def make(name='exp', candidate=lambda: 1, **kwargs):
+    experiment = laboratory.Experiment(name=name, **kwargs)
+    experiment.control(lambda: 1)
+    experiment.candidate(candidate)
+    return experiment
+
+
+def test_experiments_register_by_name():
+    make('a').conduct()
+    make('a').conduct()
+    make('b', sampler=PercentageSampler(0)).conduct()
+
+    assert registry.names() == ['a', 'b']
+    stats = registry.snapshot()
+    assert stats['a']['calls'] == 2 and stats['a']['sampled'] == 2
+    assert stats['b']['calls'] == 1 and stats['b']['sampled'] == 0
+    assert stats['a']['candidate_ns'] > 0
+    assert stats['a']['enabled'] is None
+
+
+def test_decorated_functions_register_once_defined():
+    @laboratory.Experiment.decorator(candidate=lambda: 1, name='decorated')
+    def control():
+        return 1
+
+    assert registry.get('decorated').calls.value == 0
+    control()
+    assert registry.get('decorated').calls.value == 1
+
+
+def test_disabled_decorated_functions_count_calls():
+    @laboratory.Experiment.decorator(candidate=lambda: 1, name='decorated')
+    def control():
+        return 1
+
+    registry.disable('decorated')
+    control()
+    registry.enable('decorated')
+    control()
+
+    assert registry.get('decorated').calls.value == 2
+    assert registry.get('decorated').sampled.value == 1
+
+
+def test_mismatches_are_counted_when_compared():
+    experiment = make(candidate=lambda: 2)
+    experiment.publish = lambda result: result.match
+    experiment.conduct()
+    experiment.conduct()
+    assert registry.get('exp').mismatches.value == 2
+
+
+def test_disable_and_enable_at_runtime():
+    candidate = mock.Mock(return_value=1)
+    experiment = make(candidate=candidate)
+    experiment.enabled = mock.Mock(return_value=False)
+
+    registry.enable('exp')
+    experiment.conduct()
+    assert candidate.call_count == 1
+    assert not experiment.enabled.called
+
+    registry.disable('exp')
+    assert experiment.conduct() == 1
+    assert candidate.call_count == 1
+
+    registry.clear_overrides('exp')
+    experiment.conduct()
+    assert candidate.call_count == 1
+    assert experiment.enabled.called
+
+
+def test_percentage_overrides_sampler():
+    candidate = mock.Mock(return_value=1)
+    experiment = make(candidate=candidate, sampler=PercentageSampler(100))
+
+    registry.set_percentage('exp', 0)
+    for _ in range(10):
+        experiment.conduct()
+    assert not candidate.called
+
+    registry.set_percentage('exp', None)
+    experiment.conduct()
+    assert candidate.called
+
+
+def test_load_overrides(tmpdir):
+    path = tmpdir.join('overrides.json')
+    path.write(json.dumps({'a': {'enabled': False}, 'b': {'percentage': 5}}))
+    registry.enable('c')
+
+    registry.load(str(path))
+    assert registry.get('a').enabled is False
+    assert registry.get('b').percentage == 5
+    assert registry.get('c').enabled is None
+
+
+def test_watch_reloads_when_modified(tmpdir):
+    path = tmpdir.join('overrides.json')
+    path.write(json.dumps({'a': {'enabled': False}}))
+    registry.watch(str(path), interval=0.01)
+    assert registry.get('a').enabled is False
+
+    path.write(json.dumps({'a': {'enabled': True}}))
+    path.setmtime(time.time() + 10)
+    deadline = time.time() + 5
+    while registry.get('a').enabled is not True and time.time() < deadline:
+        time.sleep(0.01)
+    assert registry.get('a').enabled is True
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='requires SIGUSR1')
+def test_reload_on_signal(tmpdir):
+    import os
+
+    path = tmpdir.join('overrides.json')
+    path.write(json.dumps({'a': {'percentage': 1}}))
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        registry.reload_on_signal(str(path), signal.SIGUSR1)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert registry.get('a').percentage == 1
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+
+
+def test_separate_registry():
+    other = Registry()
+    assert other.register('x') is other.register('x')
+    assert other.get('y') is None
+    assert registry.get('x') is None
+
+
+def test_existing_experiments_register_again_after_reset():
+    experiment = make('a')
+    experiment.conduct()
+    registry.disable('a')
+    registry.reset()
+
+    experiment.conduct()
+    assert registry.names() == ['a']
+    assert registry.snapshot()['a']['calls'] == 1
+    assert registry.snapshot()['a']['sampled'] == 1
+
+    registry.disable('a')
+    experiment.conduct()
+    assert registry.snapshot()['a']['sampled'] == 1
@@ -0,0 +1,139 @@
+import os
+
+import mock
+import pytest
+
+import laboratory
+from laboratory.replay import Recorder, read_log, replay
+
+
+def double(x, offset=0):
+    return x * 2 + offset
+
+
+def double_badly(x, offset=0):
+    if x == 3:
+        raise ValueError(x)
+    return x * 2 + offset
+
+
+@pytest.fixture
+def log(tmpdir):
+    return str(tmpdir.join('experiment.log'))
+
+
+@pytest.fixture
+def record(result_experiment):
+    def record(log, calls, name='Experiment', context=None):
+        recorder = Recorder(log)
+
+        @result_experiment.decorator(double_badly, name=name, recorder=recorder, context=context)
+        def control(x, offset=0):
+            return x * 2 + offset
+
+        for x in calls:
+            control(x, offset=1)
+        recorder.close()
+        return control
+    return record
+
+
+def test_recording_runs_only_the_control(log, record, result_experiment):
+    candidate = mock.Mock()
+    recorder = Recorder(log)
+    experiment = result_experiment(recorder=recorder)
+    experiment.control(double, args=[2])
+    experiment.candidate(candidate)
+
+    assert experiment.conduct() == 4
+    assert not candidate.called
+    assert not experiment.results
+    assert recorder.recorded.value == 1
+
+    recorder.close()
+    record, = read_log(log)
+    assert record['experiment'] == 'Experiment'
+    assert record['args'] == [2]
+    assert record['control'].value == 4
+
+
+def test_recording_follows_sampling(log):
+    from laboratory.sampling import PercentageSampler
+
+    recorder = Recorder(log)
+    experiment = laboratory.Experiment(recorder=recorder, sampler=PercentageSampler(0))
+    experiment.control(double, args=[2])
+    assert experiment.conduct() == 4
+    assert recorder.recorded.value == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires fork')
+def test_forked_child_does_not_write_parent_records(log):
+    recorder = Recorder(log)
+    experiment = laboratory.Experiment(recorder=recorder)
+    experiment.control(double, args=[1])
+    experiment.conduct()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            experiment = laboratory.Experiment(recorder=recorder)
+            experiment.control(double, args=[2])
+            experiment.conduct()
+            # as the close() registered with atexit would
+            recorder.close()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    recorder.close()
+
+    assert sorted(record['args'] for record in read_log(log)) == [[1], [2]]
+
+
+def test_unpicklable_runs_are_dropped(log):
+    recorder = Recorder(log)
+    experiment = laboratory.Experiment(recorder=recorder)
+    experiment.control(lambda x: 1, args=[lambda: None])
+    assert experiment.conduct() == 1
+    assert recorder.dropped.value == 1
+    assert recorder.recorded.value == 0
+
+
+def test_replay_in_process(log, record):
+    control = record(log, range(5), context={'region': 'eu'})
+
+    assert replay(control.experiment, log, processes=0, batch_size=2) == 5
+    results = control.experiment.results
+    assert [r.control.value for r in results] == [1, 3, 5, 7, 9]
+    assert [r.match for r in results] == [True, True, True, False, True]
+    assert results[0].candidates[0].get_context() == {'region': 'eu'}
+
+
+def test_replay_in_processes(log, record):
+    control = record(log, range(10))
+
+    assert replay(control.experiment, log, processes=2, batch_size=3) == 10
+    results = control.experiment.results
+    assert [r.candidates[0].value for r in results if r.match] == [1, 3, 5, 9, 11, 13, 15, 17, 19]
+    assert isinstance(results[3].candidates[0].exception, ValueError)
+
+
+def test_replay_only_matching_experiment(log, record, result_experiment):
+    record(log, [1, 2])
+    record(log, [3], name='Other')
+
+    experiment = result_experiment()
+    experiment.candidate(double)
+    assert replay(experiment, log, processes=0) == 2
+
+
+def test_incomplete_record_is_skipped(log, record):
+    record(log, [1, 2])
+    with open(log, 'ab') as f:
+        f.write(b'\x00\x00\x01\x00partial')
+    assert len(list(read_log(log))) == 2
+
+
+def test_empty_log(log):
+    open(log, 'wb').close()
+    assert list(read_log(log)) == []
@@ -0,0 +1,223 @@
+import threading
+
+import mock
+import pytest
+
+import laboratory
+from laboratory.sampling import (
+    DECREASE, HOLD, INCREASE, AdaptiveSampler, HashSampler, OverheadGovernor,
+    PercentageSampler, RateLimitSampler, Sampler,
+)
+from laboratory.stats import Counter
+
+
+def test_sampled_out_runs_only_control():
+    cand_func = mock.Mock()
+    experiment = laboratory.Experiment(sampler=PercentageSampler(0))
+    experiment.control(lambda: 1)
+    experiment.candidate(cand_func)
+
+    assert experiment.conduct() == 1
+    assert not cand_func.called
+    assert experiment.sampler.sampled_out.value == 1
+    assert experiment.sampler.sampled_in.value == 0
+
+
+def test_sampler_not_consulted_when_disabled():
+    sampler = mock.Mock()
+    experiment = laboratory.Experiment(sampler=sampler)
+    experiment.enabled = lambda: False
+    experiment.control(lambda: 1)
+
+    experiment.conduct()
+    assert not sampler.sample.called
+
+
+def test_sampler_records_results(result_experiment):
+    class RecordingSampler(Sampler):
+        def should_sample(self, experiment):
+            return True
+
+    sampler = RecordingSampler()
+    sampler.record = mock.Mock()
+
+    experiment = result_experiment(sampler=sampler)
+    experiment.control(lambda: 1)
+    experiment.candidate(lambda: 1)
+    experiment.conduct()
+
+    sampler.record.assert_called_once_with(experiment.result)
+    assert sampler.sampled_in.value == 1
+
+
+def test_percentage_sampler():
+    sampler = PercentageSampler(25)
+    decisions = [sampler.sample(None) for _ in range(4000)]
+    assert 800 < decisions.count(True) < 1200
+    assert sampler.sampled_in.value + sampler.sampled_out.value == 4000
+
+
+def test_rate_limit_sampler():
+    sampler = RateLimitSampler(per_second=1, burst=3)
+    decisions = [sampler.sample(None) for _ in range(10)]
+    assert decisions == [True] * 3 + [False] * 7
+
+
+def test_adaptive_sampler_backs_off_when_candidates_are_expensive():
+    sampler = AdaptiveSampler(max_overhead=0.1, smoothing=1.0)
+    assert sampler.percentage == 100.0
+
+    result = mock.Mock(cached=False)
+    result.control.duration = 1000
+    result.candidates = [mock.Mock(duration=2000)]
+    sampler.record(result)
+
+    assert sampler.percentage == 5.0
+
+    result.cached = True
+    sampler.record(result)
+    assert sampler.percentage == 100.0
+
+
+def test_hash_sampler_is_deterministic():
+    sampler = HashSampler(50, key='user_id')
+
+    def experiment(user_id):
+        return laboratory.Experiment(context={'user_id': user_id})
+
+    first = [sampler.sample(experiment(i)) for i in range(1000)]
+    second = [sampler.sample(experiment(i)) for i in range(1000)]
+    assert first == second
+    assert 400 < first.count(True) < 600
+    assert not sampler.sample(laboratory.Experiment())
+
+
+def test_counter_across_threads():
+    counter = Counter()
+
+    def increment():
+        for _ in range(1000):
+            counter.increment()
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value == 4000
+    counter.reset()
+    assert counter.value == 0
+
+
+def test_counter_folds_cells_of_exited_threads():
+    counter = Counter()
+    counter.increment()
+
+    for _ in range(10):
+        thread = threading.Thread(target=counter.increment, args=(2,))
+        thread.start()
+        thread.join()
+
+    assert counter.value == 21
+    assert len(counter._cells) == 1
+    counter.reset()
+    assert counter.value == 0
+
+
+def governed_result(control_ns, candidate_ns=0, **experiment):
+    control = mock.Mock(failure=False, start_ns=0, end_ns=control_ns)
+    candidate = mock.Mock(start_ns=control_ns, end_ns=control_ns + candidate_ns)
+    experiment.setdefault('executor', None)
+    experiment.setdefault('worker', None)
+    return mock.Mock(
+        control=control, candidates=[candidate], cached=False,
+        experiment=mock.Mock(background=False, **experiment),
+    )
+
+
+def run_interval(governor, now, sampled_ns, unsampled_ns, **experiment):
+    for _ in range(10):
+        governor.record_unsampled(unsampled_ns)
+        governor.record(governed_result(sampled_ns, **experiment))
+    now[0] += 2 * 10 ** 9
+    governor.record_unsampled(unsampled_ns)
+
+
+def test_overhead_governor_adjusts_percentage(monkeypatch):
+    now = [0]
+    monkeypatch.setattr('laboratory.sampling.perf_counter_ns', lambda: now[0])
+    decisions = []
+    governor = OverheadGovernor(
+        budget=0.05, percentage=10, interval=1, min_samples=10,
+        on_decision=decisions.append,
+    )
+
+    run_interval(governor, now, 1000, 1000)
+    assert governor.percentage == 11
+    run_interval(governor, now, 1200, 1000)
+    assert governor.percentage == 5.5
+
+    assert [d.action for d in decisions] == [INCREASE, DECREASE]
+    assert decisions[1].previous == 11
+    assert decisions[1].inflation == pytest.approx(0.2, abs=0.1)
+    assert decisions[1].sampled == 10 and decisions[1].unsampled == 11
+    assert list(governor.decisions) == decisions
+
+
+def test_overhead_governor_counts_inline_candidates(monkeypatch):
+    now = [0]
+    monkeypatch.setattr('laboratory.sampling.perf_counter_ns', lambda: now[0])
+    governor = OverheadGovernor(budget=0.05, interval=1, min_samples=10)
+
+    # candidates run on an executor don't hold up the caller
+    for _ in range(10):
+        governor.record(governed_result(1000, 500, executor=object()))
+    run_interval(governor, now, 1000, 1000)
+    assert governor.decisions[-1].inflation == pytest.approx(0, abs=0.1)
+
+    for _ in range(10):
+        governor.record(governed_result(1000, 500))
+    run_interval(governor, now, 1000, 1000)
+    assert governor.decisions[-1].inflation > 0.05
+
+
+def test_overhead_governor_waits_for_enough_samples(monkeypatch):
+    now = [0]
+    monkeypatch.setattr('laboratory.sampling.perf_counter_ns', lambda: now[0])
+    governor = OverheadGovernor(percentage=10, min_percentage=1, interval=1, min_samples=100)
+    run_interval(governor, now, 5000, 1000)
+    assert governor.percentage == 10
+    assert not governor.decisions
+
+
+def test_overhead_governor_stays_within_limits(monkeypatch):
+    now = [0]
+    monkeypatch.setattr('laboratory.sampling.perf_counter_ns', lambda: now[0])
+    governor = OverheadGovernor(
+        percentage=2, min_percentage=1, max_percentage=2, interval=1, min_samples=10,
+    )
+    run_interval(governor, now, 1000, 1000)
+    assert governor.decisions[-1].action == HOLD
+    run_interval(governor, now, 5000, 1000)
+    run_interval(governor, now, 5000, 1000)
+    assert governor.percentage == 1
+
+
+def test_unsampled_runs_are_timed():
+    governor = OverheadGovernor(percentage=0)
+    governor.record_unsampled = mock.Mock()
+    experiment = laboratory.Experiment(sampler=governor)
+    experiment.control(lambda: 1)
+    experiment.candidate(lambda: 1)
+
+    assert experiment.conduct() == 1
+    assert governor.record_unsampled.call_count == 1
+    assert governor.record_unsampled.call_args[0][0] > 0
+
+    # other samplers don't pay for timing
+    sampler = PercentageSampler(0)
+    sampler.record_unsampled = mock.Mock()
+    experiment.sampler = sampler
+    experiment.conduct()
+    assert not sampler.record_unsampled.called
@@ -0,0 +1,164 @@
+import mock
+import pytest
+
+import laboratory
+from laboratory.comparators import ToleranceComparator
+from laboratory.streams import StreamSummary, end_of_stream
+
+
+class Page(object):
+    def __init__(self, items, fail_at=None):
+        self.items = items
+        self.fail_at = fail_at
+        self.consumed = 0
+        self.closed = False
+
+    def __call__(self):
+        try:
+            for index, item in enumerate(self.items):
+                if index == self.fail_at:
+                    raise ValueError(index)
+                self.consumed += 1
+                yield item
+        finally:
+            self.closed = True
+
+
+def test_matching_streams(conduct):
+    stream, experiment = conduct(Page([1, 2, 3]), Page([1, 2, 3]))
+    assert not experiment.results
+
+    assert list(stream) == [1, 2, 3]
+    result = experiment.result
+    assert result.match
+    summary = result.candidates[0].value
+    assert isinstance(summary, StreamSummary)
+    assert (summary.count, summary.complete, summary.mismatch) == (3, True, None)
+    assert summary.latency.count == 3
+    assert result.control.value.count == 3
+
+
+def test_mismatch_stops_consuming_candidate(conduct):
+    candidate = Page([1, 5, 3, 4])
+    stream, experiment = conduct(Page([1, 2, 3, 4]), candidate)
+
+    assert list(stream) == [1, 2, 3, 4]
+    result = experiment.result
+    assert not result.match
+    assert result.candidates[0].value.mismatch == (1, 2, 5)
+    assert candidate.consumed == 2
+    assert candidate.closed
+
+
+def test_candidate_too_short_or_too_long(conduct):
+    stream, experiment = conduct(Page([1, 2]), Page([1]), Page([1, 2, 3]))
+    list(stream)
+
+    short, long = sorted(experiment.result.candidates, key=lambda obs: obs.name)
+    assert short.value.mismatch == (1, 2, end_of_stream)
+    assert long.value.mismatch == (2, end_of_stream, 3)
+
+
+def test_candidate_exception_is_recorded(conduct):
+    stream, experiment = conduct(Page([1, 2, 3]), Page([1, 2, 3], fail_at=1))
+    assert list(stream) == [1, 2, 3]
+
+    candidate, = experiment.result.candidates
+    assert candidate.failure
+    assert isinstance(candidate.exception, ValueError)
+    assert not experiment.result.match
+
+
+def test_control_exception_propagates_and_publishes_nothing(conduct):
+    candidate = Page([1, 2, 3])
+    stream, experiment = conduct(Page([1, 2, 3], fail_at=1), candidate)
+
+    with pytest.raises(ValueError):
+        list(stream)
+    assert not experiment.results
+    assert candidate.closed
+
+
+def test_closing_early_publishes_partial_comparison(conduct):
+    control, candidate = Page(list(range(100))), Page(list(range(100)))
+    stream, experiment = conduct(control, candidate)
+
+    assert next(stream) == 0
+    assert next(stream) == 1
+    stream.close()
+
+    result = experiment.result
+    assert result.match
+    assert result.control.value.count == 2
+    assert not result.control.value.complete
+    assert control.closed and candidate.closed
+
+
+def test_closing_early_logs_mismatches(conduct):
+    stream, experiment = conduct(Page([1, 2, 3]), Page([1, 3, 3]), raise_on_mismatch=True)
+
+    assert next(stream) == 1
+    with mock.patch('laboratory.experiment.logger') as logger:
+        assert next(stream) == 2
+        stream.close()
+
+    result = experiment.result
+    assert not result.match
+    assert result.candidates[0].value.mismatch == (1, 2, 3)
+    assert logger.error.called
+
+
+def test_candidate_returning_a_list(conduct):
+    stream, experiment = conduct(Page([1, 2]), lambda: [1, 2])
+    list(stream)
+    assert experiment.result.match
+
+
+def test_elements_compared_with_comparator(conduct):
+    stream, experiment = conduct(
+        Page([1.0, 2.0]), Page([1.001, 2.0]), comparator=ToleranceComparator(abs_tol=0.01),
+    )
+    list(stream)
+    assert experiment.result.match
+
+
+def test_durations_include_element_time(conduct):
+    stream, experiment = conduct(Page([1, 2]), Page([1, 2]))
+    list(stream)
+    result = experiment.result
+    assert result.control.duration >= result.control.value.latency.total
+
+
+def test_decorated_generator():
+    @laboratory.Experiment.decorator(candidate=lambda n: iter(range(n)))
+    def control(n):
+        for i in range(n):
+            yield i
+
+    assert list(control(3)) == [0, 1, 2]
+
+
+def test_other_iterators_are_returned_as_they_are(conduct):
+    import io
+    import sqlite3
+
+    connection = sqlite3.connect(':memory:')
+    cursor = connection.execute('select 1')
+    value, experiment = conduct(lambda: cursor, lambda: cursor)
+    assert value is cursor
+    assert value.fetchall() == [(1,)]
+    connection.close()
+
+    text = io.StringIO('a\nb\n')
+    value, experiment = conduct(lambda: text, lambda: text)
+    assert value is text
+    assert value.read() == 'a\nb\n'
+    assert experiment.result.match
+
+
+def test_summary_equality():
+    a, b = StreamSummary(), StreamSummary()
+    assert a == b
+    b.mismatch = (0, 1, 2)
+    assert a != b
+    assert a != 1